@@ -1,6 +1,17 @@
-from .models import LifeTable  # NOQA
+from .cube import CashflowCube  # NOQA
+from .curve import YieldCurve  # NOQA
+from .models import LifeTable, LifeTableRegistry  # NOQA
+from .parallel import generate_factor_sets  # NOQA
+from .results import ResultCache  # NOQA
+from .store import CubeStore  # NOQA
 
 
 __all__ = [
+    'CashflowCube',
+    'CubeStore',
     'LifeTable',
+    'LifeTableRegistry',
+    'ResultCache',
+    'YieldCurve',
+    'generate_factor_sets',
 ]
@@ -0,0 +1,333 @@
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from collections import OrderedDict
+from database import Database
+from instrument import peak_rss
+from models import LifeTable
+from settings import XLSWB, BENCHMARK_THRESHOLD, LOWAGE, UPAGE, MALE, FEMALE
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+TARIFF = 'AEG2011'
+PENSION_AGE = 67
+INTREST = 3
+
+# differences below these are treated as noise
+MIN_SECONDS = 0.005
+MIN_BYTES = 1 << 20
+
+# items of environment() that should match for timings to be comparable
+COMPARABLE = ['python', 'numpy', 'pandas', 'machine']
+
+
+def _fresh_table(xlswb):
+    """ Returns LifeTable on a new database, so no cash flows are memoized
+    yet. Its engine and tables are built here, outside the timed call.
+    """
+    table = LifeTable(TARIFF, database=Database(xlswb))
+    table.engine, table.lx, table.hx, table.adjust, table.adjust_records
+    return table
+
+
+def bench_load_workbook(xlswb):
+    return lambda: Database(xlswb, cache=False)
+
+
+def bench_load_cache(xlswb):
+    Database(xlswb)
+    return lambda: Database(xlswb)
+
+
+def bench_npx(xlswb):
+    table = _fresh_table(xlswb)
+    ages = np.arange(121)[:, np.newaxis]
+    years = np.arange(121)[np.newaxis, :]
+    return lambda: [table.npx(ages, sex, years) for sex in (MALE, FEMALE)]
+
+
+def bench_cf_annuity(xlswb):
+    table = _fresh_table(xlswb)
+    return lambda: [table.cf_annuity(age, sex, PENSION_AGE - age)
+                    for sex in (MALE, FEMALE) for age in range(LOWAGE, UPAGE)]
+
+
+def bench_create_lookup_table(xlswb):
+    table = _fresh_table(xlswb)
+    return lambda: table.create_lookup_table(INTREST)
+
+
+def bench_cf(insurance_id):
+    """ Returns benchmark of cf() for given insurance_id over the factor grid. """
+    def bench(xlswb):
+        table = _fresh_table(xlswb)
+        return lambda: [table.cf(insurance_id, age, sex, PENSION_AGE, intrest=INTREST)
+                        for sex in (MALE, FEMALE) for age in range(LOWAGE, UPAGE)]
+    return bench
+
+
+def bench_pv(xlswb):
+    table = _fresh_table(xlswb)
+    cfs = [table.cf(insurance_id, age, MALE, PENSION_AGE, intrest=INTREST)
+           for insurance_id in ('OPLL', 'NPLL-O', 'NPTL-B') for age in range(LOWAGE, UPAGE)]
+    return lambda: [table.pv(cf, INTREST) for cf in cfs]
+
+
+def bench_calculate_factors(xlswb):
+    table = _fresh_table(xlswb)
+    return lambda: table.calculate_factors(INTREST, pension_age=PENSION_AGE)
+
+
+def bench_export(xlswb):
+    table = _fresh_table(xlswb)
+    tmpdir = tempfile.mkdtemp()
+
+    def run():
+        try:
+            table.export(os.path.join(tmpdir, 'factors.xlsx'), INTREST, pension_age=PENSION_AGE)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return run
+
+
+def bench_export_stream(xlswb):
+    table = _fresh_table(xlswb)
+    tmpdir = tempfile.mkdtemp()
+
+    def run():
+        try:
+            table.export_stream(os.path.join(tmpdir, 'factors.xlsx'), INTREST,
+                                pension_age=PENSION_AGE)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return run
+
+
+# name: (setup, number of repeats). setup(xlswb) does all preparation that
+# should not be timed and returns the callable to be timed.
+BENCHMARKS = OrderedDict([
+    ('load_workbook', (bench_load_workbook, 1)),
+    ('load_cache', (bench_load_cache, 3)),
+    ('npx', (bench_npx, 5)),
+    ('cf_annuity', (bench_cf_annuity, 5)),
+    ('create_lookup_table', (bench_create_lookup_table, 3)),
+    ('cf_OPLL', (bench_cf('OPLL'), 3)),
+    ('cf_NPLL-B', (bench_cf('NPLL-B'), 3)),
+    ('cf_NPLL-O', (bench_cf('NPLL-O'), 3)),
+    ('cf_NPLLRS', (bench_cf('NPLLRS'), 3)),
+    ('cf_NPTL-B', (bench_cf('NPTL-B'), 3)),
+    ('cf_NPTL-O', (bench_cf('NPTL-O'), 3)),
+    ('cf_ay_avg', (bench_cf('ay_avg'), 3)),
+    ('pv', (bench_pv, 5)),
+    ('calculate_factors', (bench_calculate_factors, 3)),
+    ('export', (bench_export, 1)),
+    ('export_stream', (bench_export_stream, 1)),
+])
+
+
+def _rss_growth(func, queue):
+    """ Puts growth of peak resident set size (bytes) while running func on queue. """
+    before = peak_rss()
+    func()
+    queue.put(peak_rss() - before)
+
+
+def peak_memory(func):
+    """ Returns peak memory in bytes allocated while running func.
+
+    Uses tracemalloc where available. Otherwise func runs in a forked
+    child process and the growth of its peak resident set size is returned.
+
+    Parameters:
+    -----------
+    func: callable without arguments
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_rss_growth, args=(func, queue))
+    process.start()
+    peak = queue.get()
+    process.join()
+    return peak
+
+
+def measure(setup, repeat, xlswb=XLSWB):
+    """ Returns dict with best time in seconds and peak memory in bytes.
+
+    Every repeat starts from a new setup, so memoized state of an earlier
+    repeat does not flatter the timing.
+
+    Parameters:
+    -----------
+    setup: callable(xlswb) returning the callable to be timed
+    repeat: int
+    xlswb: str
+    """
+    times = []
+    for i in range(repeat):
+        func = setup(xlswb)
+        gc.collect()
+        start = timeit.default_timer()
+        func()
+        times.append(timeit.default_timer() - start)
+    return {'seconds': min(times), 'peak_memory': peak_memory(setup(xlswb)), 'repeat': repeat}
+
+
+def environment():
+    """ Returns dict describing the machine and versions benchmarks ran on. """
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine()}
+
+
+def run_benchmarks(names=None, xlswb=XLSWB, verbose=False):
+    """ Returns dict {'environment': dict, 'results': {name: measurement}}.
+
+    Parameters:
+    -----------
+    names: list of str. Benchmarks to run, see BENCHMARKS. Default all.
+    xlswb: str
+    verbose: boolean. Print each result when done. Default False.
+    """
+    names = list(BENCHMARKS) if names is None else names
+    results = OrderedDict()
+    for name in names:
+        setup, repeat = BENCHMARKS[name]
+        results[name] = measure(setup, repeat, xlswb)
+        if verbose:
+            print("{0:<20} {1:>10.4f} s {2:>10.1f} MB".format(
+                name, results[name]['seconds'], results[name]['peak_memory'] / 1e6))
+    return {'environment': environment(), 'results': results}
+
+
+def save_baseline(report, filename):
+    """ Writes benchmark report as json.
+
+    Parameters:
+    -----------
+    report: dict as returned by run_benchmarks
+    filename: str
+    """
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def load_baseline(filename):
+    """ Returns benchmark report from json file.
+
+    Parameters:
+    -----------
+    filename: str
+    """
+    with open(filename) as f:
+        return json.load(f)
+
+
+def environment_differences(report, baseline):
+    """ Returns list of (item, baseline, current) for the COMPARABLE items
+    of the environments that differ.
+
+    Parameters:
+    -----------
+    report: dict as returned by run_benchmarks
+    baseline: dict as returned by run_benchmarks or load_baseline
+    """
+    current, base = report.get('environment', {}), baseline.get('environment', {})
+    return [(item, base.get(item), current.get(item)) for item in COMPARABLE
+            if base.get(item) != current.get(item)]
+
+
+def compare(report, baseline, threshold=BENCHMARK_THRESHOLD):
+    """ Returns list of regressions (name, measure, baseline, current).
+
+    A benchmark regresses when its time or peak memory exceeds the
+    baseline by more than threshold (as a fraction) and by more than
+    MIN_SECONDS or MIN_BYTES. Benchmarks missing from the baseline are
+    skipped. Environments are not checked, see environment_differences.
+
+    Parameters:
+    -----------
+    report: dict as returned by run_benchmarks
+    baseline: dict as returned by run_benchmarks or load_baseline
+    threshold: float. Default BENCHMARK_THRESHOLD.
+    """
+    out = []
+    for name, current in report['results'].items():
+        if name not in baseline['results']:
+            continue
+        base = baseline['results'][name]
+        for item, noise in (('seconds', MIN_SECONDS), ('peak_memory', MIN_BYTES)):
+            if base.get(item) is None or current.get(item) is None:
+                continue
+            if (current[item] > base[item] * (1 + threshold) and
+                    current[item] - base[item] > noise):
+                out.append((name, item, base[item], current[item]))
+    return out
+
+
+def main(argv=None):
+    """ Runs benchmarks; returns exit code 1 when a benchmark regressed.
+
+    The comparison is skipped (with a warning) against a baseline from
+    another environment, see environment_differences.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks of the factor pipeline.")
+    parser.add_argument('names', nargs='*', help="benchmarks to run (default all)")
+    parser.add_argument('--baseline', required=True,
+                        help="baseline json file, recorded on this machine")
+    parser.add_argument('--save', action='store_true', help="store results as new baseline")
+    parser.add_argument('--threshold', type=float, default=BENCHMARK_THRESHOLD,
+                        help="allowed slowdown as a fraction (default %(default)s)")
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: {0}".format(', '.join(sorted(unknown))))
+
+    report = run_benchmarks(args.names or None, verbose=True)
+    if args.save:
+        save_baseline(report, args.baseline)
+        print("Baseline written to {0}".format(args.baseline))
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline found at {0}, run with --save first".format(args.baseline))
+        return 0
+    baseline = load_baseline(args.baseline)
+    differences = environment_differences(report, baseline)
+    if differences:
+        print("WARNING baseline recorded in another environment ({0}), comparison skipped; "
+              "record a new baseline with --save".format(', '.join(
+                  "{0} {1} -> {2}".format(item, base, current)
+                  for item, base, current in differences)))
+        return 0
+    regressions = compare(report, baseline, args.threshold)
+    for name, item, base, current in regressions:
+        print("REGRESSION {0} {1}: {2:.4g} -> {3:.4g}".format(name, item, base, current))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from collections import OrderedDict
+
+
+def normalize_curve(intrest):
+    """ Returns tuple of floats representing given intrest or yield curve.
+
+    Trailing repeats of the last rate are dropped, as curves are
+    forward-filled with their last rate anyway.
+
+    Parameters:
+    -----------
+    intrest: int, float, list, array or Series
+    """
+    if intrest is None:
+        return None
+    if isinstance(intrest, pd.Series):
+        intrest = intrest.values
+    rates = [float(rate) for rate in np.atleast_1d(intrest)]
+    while len(rates) > 1 and rates[-1] == rates[-2]:
+        rates.pop()
+    return tuple(rates)
+
+
+def fingerprint(*parts):
+    """ Returns stable sha1 hex digest of given (hashable) parts.
+
+    Yield curves should be passed through normalize_curve first.
+    """
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def curve_fingerprint(intrest):
+    """ Returns stable sha1 hex digest of given intrest or yield curve.
+
+    Parameters:
+    -----------
+    intrest: int, float, list, array or Series
+    """
+    return fingerprint(normalize_curve(intrest))
+
+
+class LRUCache(object):
+    """ Bounded mapping that evicts the least recently used entry.
+
+    Keeps hit and miss counts for monitoring.
+    """
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, func):
+        """ Returns cached value for key, calls func() to create it on a miss.
+
+        Parameters:
+        -----------
+        key: hashable
+        func: callable without arguments
+        """
+        try:
+            value = self.data.pop(key)
+            self.hits += 1
+        except KeyError:
+            value = func()
+            self.misses += 1
+        self.data[key] = value
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+        return value
+
+    def clear(self):
+        """ Removes all entries and resets statistics. """
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """ Returns dict with hits, misses, hit ratio, size and maxsize. """
+        calls = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / calls if calls else None,
+                'size': len(self.data),
+                'maxsize': self.maxsize}
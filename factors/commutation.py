@@ -0,0 +1,179 @@
+import numpy as np
+
+from cache import LRUCache
+from settings import MAXAGE, MEMO_CACHE_SIZE
+from utils import prae_to_continuous
+
+
+def survival_matrix(lx):
+    """ Returns matrix with probabilities tpx, row = age x, column = year t.
+
+    Entries beyond the end of the table (x + t > MAXAGE) or for ages
+    with lx = 0 are set to zero.
+
+    Parameters:
+    -----------
+    lx: array with number of survivors per age, starting at age 0
+    """
+    lx = np.asarray(lx, dtype=float)
+    nrows = len(lx)
+    ages = np.arange(nrows)
+    future = ages[:, np.newaxis] + ages[np.newaxis, :]
+    valid = (future < nrows) & (lx[:, np.newaxis] > 0)
+    numerator = lx[np.minimum(future, nrows - 1)]
+    denominator = np.where(lx > 0, lx, 1.)[:, np.newaxis]
+    return np.where(valid, numerator / denominator, 0.)
+
+
+class Commutation(object):
+    """ Precomputed survival arrays for one mortality table.
+
+    The survival arrays are built once per table. Cash flows built from
+    them are interest free, discounting is left to the discount module.
+    Intermediate cash flow building blocks are memoized by their inputs,
+    so they are shared by all tariffs using the same mortality table.
+    """
+
+    def __init__(self, lx):
+        """ Parameters:
+        -----------
+        lx: dict {gender: Series, DataFrame or array with lx per age}
+        """
+        self.genders = sorted(lx)
+        self.lx = {}
+        self.tpx = {}
+        for gender, values in lx.items():
+            values = np.asarray(values, dtype=float).ravel()
+            self.lx[gender] = values
+            self.tpx[gender] = survival_matrix(values)
+        self.table = np.vstack([self.lx[gender] for gender in self.genders])
+        self.memo = LRUCache(MEMO_CACHE_SIZE)
+
+    def memoize(self, key, func):
+        """ Returns read-only array func(), evaluated once per key.
+
+        Parameters:
+        -----------
+        key: tuple with all inputs func depends on
+        func: callable without arguments
+        """
+        def build():
+            out = func()
+            out.flags.writeable = False
+            return out
+        return self.memo.get(key, build)
+
+    def gender_index(self, sex):
+        """ Returns (array of) row number(s) in self.table for given sex.
+
+        Parameters:
+        -----------
+        sex: 'M', 'F' or array of those
+        """
+        sex = np.asarray(sex)
+        assert np.in1d(sex, self.genders).all(), "sex should be either M of F!"
+        index = np.zeros(sex.shape, dtype=int)
+        for i, gender in enumerate(self.genders):
+            index[sex == gender] = i
+        return index
+
+    def cohort_key(self, age, cohort=None):
+        """ Returns key of the survivors used for a person of given age and
+        cohort, see CohortCommutation. None: a static table has the same
+        survivors for every cohort.
+        """
+        return None
+
+    def npx(self, age, sex, nyears, cohort=None):
+        """ Returns probability person with given age is still alive after n years.
+
+        Arguments are broadcast against each other like a ufunc; ages are
+        capped at MAXAGE.
+
+        Parameters:
+        -----------
+        age: int or array
+        sex: either 'M' of 'F', or array of those
+        nyears: int or array
+        cohort: not used, see CohortCommutation.npx
+        """
+        age = np.asarray(age)
+        gender = self.gender_index(sex)
+        current_age = np.clip(age.astype(int), 0, MAXAGE)
+        future_age = np.clip((age + nyears).astype(int), 0, MAXAGE)
+        current = self.table[gender, current_age]
+        future = self.table[gender, future_age]
+        alive = current > 0
+        out = np.where(alive, future / np.where(alive, current, 1.), 0.)
+        return out[()]
+
+    def annuity(self, age, sex, defer=0, cohort=None):
+        """ Returns array with expected payments (deferred) lifetime annuity.
+
+        Parameters:
+        -----------
+        age: int
+        sex: either 'M' of 'F'
+        defer: int
+        cohort: not used, see CohortCommutation.annuity
+        """
+        tpx = self.tpx[sex]
+        nrows = len(tpx)
+        assert nrows > defer, "Error: deferral period exceeds number of table rows."
+        out = tpx[min(int(age), nrows - 1)].copy()
+        out[:max(int(defer), 0)] = 0
+        return out
+
+    def annuities(self, ages, sex, defer=0, cohort=None):
+        """ Returns matrix (ages x years) with one annuity() row per age,
+        sliced from the survival matrix at once.
+
+        Parameters:
+        -----------
+        ages: array of int
+        sex: either 'M' of 'F'
+        defer: int or array of int, one per age
+        cohort: not used, see CohortCommutation.annuities
+        """
+        tpx = self.tpx[sex]
+        nrows = len(tpx)
+        ages = np.asarray(ages)
+        defer = np.broadcast_to(np.asarray(defer), ages.shape)
+        assert (nrows > defer).all(), "Error: deferral period exceeds number of table rows."
+        out = tpx[np.minimum(ages.astype(int), nrows - 1)]
+        deferred = np.arange(nrows)[np.newaxis, :] < np.maximum(defer.astype(int), 0)[:, np.newaxis]
+        return np.where(deferred, 0., out)
+
+    def joint_annuity(self, age_x, sex_x, age_y, sex_y, defer=0, cohort_x=None, cohort_y=None):
+        """ Returns (memoized) expected payments (deferred) joint life annuity.
+
+        Parameters:
+        -----------
+        age_x, age_y: int
+        sex_x, sex_y: either 'M' of 'F'
+        defer: int
+        cohort_x, cohort_y: int. Age of each life in the base year of a
+        generation table. Default age_x, age_y.
+        """
+        key = ('joint_annuity', int(age_x), sex_x, int(age_y), sex_y, max(int(defer), 0),
+               self.cohort_key(age_x, cohort_x), self.cohort_key(age_y, cohort_y))
+        return self.memoize(key, lambda: (self.annuity(age_x, sex_x, defer, cohort_x) *
+                                          self.annuity(age_y, sex_y, defer, cohort_y)))
+
+    def annuity_avg(self, age, sex, cohort=None):
+        """ Returns (memoized) continuous payments lifetime annuity, averaged
+        over ages age and age + 1 of one cohort.
+
+        Parameters:
+        -----------
+        age: int
+        sex: either 'M' of 'F'
+        cohort: int. Age in the base year of a generation table. Default age.
+        """
+        cohort = age if cohort is None else cohort
+
+        def build():
+            payments = (self.annuity(age, sex, cohort=cohort) +
+                        self.annuity(age + 1, sex, cohort=cohort)) / 2.
+            return prae_to_continuous(payments)
+        return self.memoize(('annuity_avg', int(age), sex, self.cohort_key(age, cohort)), build)
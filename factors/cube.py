@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+
+from discount import present_values, insurance_timing
+from utils import cartesian, to_payments
+
+
+class CashflowCube(object):
+    """ Cash flows of a factor grid in one contiguous float64 array with
+    axes insurance_id x sex x age x year.
+
+    Rows shorter than the longest are padded with zeros; their own length
+    is kept in lengths, so exports can leave the padding out.
+
+    A cube can hold interest independent cash flows only, with the
+    payments depending on the interest basis (undefined partner payments
+    till retirement) described by deferred: for each of those rows, the
+    payment in year k equals lookup_cf[index[k]] * nq[k], lookup_cf being
+    the lookup table cash flow per sex and age for a given interest basis.
+    resolve(lookup_cf) returns the cube with these payments filled in.
+    """
+
+    colnames = ['insurance_id', 'sex_insured', 'age_insured']
+
+    def __init__(self, values, insurance_ids, sexes, ages, pension_age, lengths=None,
+                 deferred=None):
+        """ Parameters:
+        -----------
+        values: 4-D array (insurance_id x sex x age x year)
+        insurance_ids, sexes, ages: lists with labels of the first three axes
+        pension_age: int
+        lengths: 3-D int array with number of years per row. Optional.
+        Default all years.
+        deferred: dict {'rows': int array with grid row numbers,
+        'index': 2-D int array (rows x years) with lookup table row numbers,
+        'nq': 2-D array (rows x years) with probabilities}. Optional.
+        """
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.insurance_ids = list(insurance_ids)
+        self.sexes = list(sexes)
+        self.ages = list(ages)
+        self.pension_age = pension_age
+        assert self.values.shape[:3] == (len(self.insurance_ids), len(self.sexes),
+                                         len(self.ages)), "Error: labels do not match values."
+        if lengths is None:
+            lengths = np.full(self.values.shape[:3], self.values.shape[3], dtype=int)
+        self.lengths = np.asarray(lengths, dtype=int).reshape(self.values.shape[:3])
+        self.deferred = deferred
+
+    @property
+    def interest_free(self):
+        """ True if payments depending on the interest basis are still deferred. """
+        return self.deferred is not None
+
+    @classmethod
+    def from_rows(cls, rows, insurance_ids, sexes, ages, pension_age, deferred=None):
+        """ Returns cube from payment rows in grid order (insurance_id, sex, age).
+
+        Parameters:
+        -----------
+        rows: list of arrays or Series, one per grid row
+        insurance_ids, sexes, ages: lists with labels
+        pension_age: int
+        deferred: list of (row number, lookup table row numbers, probabilities)
+        tuples for payments depending on the interest basis. Optional.
+        """
+        shape = (len(insurance_ids), len(sexes), len(ages))
+        nyears = max(len(row) for row in rows)
+        values = np.zeros((len(rows), nyears))
+        for i, row in enumerate(rows):
+            values[i, :len(row)] = row
+        lengths = np.array([len(row) for row in rows]).reshape(shape)
+        if deferred is not None:
+            ncols = max([len(index) for _, index, _ in deferred] + [0])
+            out = {'rows': np.array([i for i, _, _ in deferred], dtype=int),
+                   'index': np.zeros((len(deferred), ncols), dtype=int),
+                   'nq': np.zeros((len(deferred), ncols))}
+            for j, (_, index, nq) in enumerate(deferred):
+                out['index'][j, :len(index)] = index
+                out['nq'][j, :len(nq)] = nq
+            deferred = out
+        return cls(values.reshape(shape + (nyears,)), insurance_ids, sexes, ages,
+                   pension_age, lengths, deferred)
+
+    def resolve(self, lookup_cf):
+        """ Returns cube with the deferred payments filled in.
+
+        Parameters:
+        -----------
+        lookup_cf: array with lookup table cash flow per lookup table row,
+        for the interest basis to value with
+        """
+        if self.deferred is None:
+            return self
+        matrix = self.matrix().copy()
+        index, nq = self.deferred['index'], self.deferred['nq']
+        matrix[self.deferred['rows'], :index.shape[1]] += np.asarray(lookup_cf)[index] * nq
+        return CashflowCube(matrix.reshape(self.values.shape), self.insurance_ids, self.sexes,
+                            self.ages, self.pension_age, self.lengths)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def matrix(self):
+        """ Returns view (rows x years) with one row per grid row. """
+        return self.values.reshape(-1, self.values.shape[3])
+
+    def labels(self):
+        """ Returns DataFrame with insurance_id, sex_insured and age_insured per row. """
+        return cartesian(lists=[self.insurance_ids, self.sexes, self.ages],
+                         colnames=self.colnames)
+
+    def timing(self):
+        """ Returns array with timing convention per row, see discount.halfyear_until. """
+        return np.repeat(insurance_timing(self.insurance_ids), len(self.sexes) * len(self.ages))
+
+    def deferral(self):
+        """ Returns array with number of years till pension age per row. """
+        ages = np.asarray(self.ages)
+        return np.tile(self.pension_age - ages, len(self.insurance_ids) * len(self.sexes))
+
+    def payments(self, insurance_id, sex, age):
+        """ Returns Series with payments of one row, indexed by year.
+
+        Parameters:
+        -----------
+        insurance_id: str
+        sex: either 'M' of 'F'
+        age: int
+        """
+        i, j, k = (self.insurance_ids.index(insurance_id), self.sexes.index(sex),
+                   self.ages.index(age))
+        return to_payments(self.values[i, j, k, :self.lengths[i, j, k]])
+
+    def present_values(self, intrest, rounding=None):
+        """ Returns 3-D array (insurance_id x sex x age) with present values.
+
+        Parameters:
+        -----------
+        intrest: int, float, list or Series
+        rounding: int. Number of decimals. Optional.
+        """
+        assert not self.interest_free, "Error: resolve deferred payments first."
+        out = present_values(self.matrix(), intrest, self.timing(), self.deferral(), rounding)
+        return out.reshape(self.values.shape[:3])
+
+    def to_frame(self):
+        """ Returns DataFrame with cash flows indexed by age_insured and year,
+        one column per (sex_insured, insurance_id); years beyond the length of
+        a row are NaN.
+        """
+        nyears = self.values.shape[3]
+        years = np.arange(nyears)
+        # (age x year x insurance_id x sex), masked beyond the row lengths
+        values = self.values.transpose(2, 3, 0, 1)
+        valid = years[np.newaxis, :, np.newaxis, np.newaxis] < \
+            self.lengths.transpose(2, 0, 1)[:, np.newaxis, :, :]
+        values = np.where(valid, values, np.nan).reshape(len(self.ages) * nyears, -1)
+        keep = valid.reshape(len(values), -1).any(axis=1)
+        index = pd.MultiIndex.from_product([self.ages, years], names=['age_insured', 'year'])
+        columns = pd.MultiIndex.from_tuples([('cf', sex, insurance_id)
+                                             for insurance_id in self.insurance_ids
+                                             for sex in self.sexes],
+                                            names=[None, 'sex_insured', 'insurance_id'])
+        return pd.DataFrame(values[keep], index=index[keep], columns=columns)
@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache, fingerprint, normalize_curve
+from settings import MAXAGE, CURVE_CACHE_SIZE
+
+
+class YieldCurve(object):
+    """ Intrest in pct per maturity year, forward-filled with its last rate.
+
+    Discount vectors are computed once per curve, for at least MAXAGE + 1
+    years, and kept read-only; shorter vectors are views on them. Curves
+    with the same rates compare and hash equal, so a curve can be part of
+    a cache key.
+    """
+
+    def __init__(self, intrest):
+        """ Parameters:
+        -----------
+        intrest: int, float, list, array or Series
+        """
+        rates = normalize_curve(intrest)
+        assert rates, "Error: yield curve requires at least one rate."
+        self.rates = rates
+        self.vectors = {}
+
+    @classmethod
+    def from_value(cls, intrest):
+        """ Returns YieldCurve for intrest, shared with earlier calls for the same rates.
+
+        Parameters:
+        -----------
+        intrest: YieldCurve, int, float, list, array or Series
+        """
+        if isinstance(intrest, cls):
+            return intrest
+        rates = normalize_curve(intrest)
+        return CURVES.get(rates, lambda: cls(rates))
+
+    def __eq__(self, other):
+        return isinstance(other, YieldCurve) and self.rates == other.rates
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.rates)
+
+    def __repr__(self):
+        return 'YieldCurve({0})'.format(list(self.rates))
+
+    def __array__(self, dtype=None):
+        return np.array(self.rates, dtype=dtype)
+
+    @property
+    def fingerprint(self):
+        """ Returns sha1 hex digest of the rates, see cache.curve_fingerprint. """
+        return fingerprint(self.rates)
+
+    @property
+    def flat_rate(self):
+        """ Returns the rate of a flat curve, None otherwise. """
+        return self.rates[0] if len(self.rates) == 1 else None
+
+    def _vector(self, key, nyears, build):
+        """ Returns first nyears of cached vector, build(n) creating it for n years. """
+        n = max(int(nyears), MAXAGE + 1)
+        if key not in self.vectors or len(self.vectors[key]) < n:
+            vector = build(n)
+            vector.flags.writeable = False
+            self.vectors[key] = vector
+        return self.vectors[key][:nyears]
+
+    def intrest(self, nyears):
+        """ Returns array with intrest in pct for years 0 .. nyears - 1. """
+        def build(n):
+            out = np.empty(n)
+            out[:min(n, len(self.rates))] = self.rates[:n]
+            out[len(self.rates):] = self.rates[-1]
+            return out
+        return self._vector('intrest', nyears, build)
+
+    def discount_factors(self, nyears):
+        """ Returns array with one year discount factor 1 / (1 + r / 100) per year. """
+        return self._vector('v', nyears, lambda n: 1. / (1 + self.intrest(n) / 100.))
+
+    def whole(self, nyears):
+        """ Returns whole-year discount weights v ** t. """
+        return self._vector('whole', nyears,
+                            lambda n: self.discount_factors(n) ** np.arange(n))
+
+    def mid(self, nyears):
+        """ Returns mid-year discount weights v ** (t + 0.5). """
+        return self._vector('mid', nyears,
+                            lambda n: self.discount_factors(n) ** (np.arange(n) + 0.5))
+
+    def weights(self, nyears):
+        """ Returns (whole, mid): whole-year and mid-year discount weights. """
+        return self.whole(nyears), self.mid(nyears)
+
+    def derivatives(self, nyears, order=1):
+        """ Returns (whole, mid): first or second derivatives of the whole-year
+        and mid-year discount weights with respect to the rate of their own
+        year, as a decimal (1 pct = 0.01).
+
+        Parameters:
+        -----------
+        nyears: int
+        order: either 1 or 2. Default 1.
+        """
+        assert order in (1, 2), "Error: order should be either 1 or 2."
+
+        def build(offset, weights):
+            def func(n):
+                exponent = np.arange(n) + offset
+                v = self.discount_factors(n)
+                if order == 1:
+                    return -exponent * weights(n) * v
+                return exponent * (exponent + 1) * weights(n) * v ** 2
+            return func
+        return (self._vector(('dwhole', order), nyears, build(0., self.whole)),
+                self._vector(('dmid', order), nyears, build(0.5, self.mid)))
+
+    def key_rates(self, nyears, npoints=None):
+        """ Returns array (years x curve points) with 1 where the rate of a year
+        is given by the curve point; the last point sets the rate of all
+        later years.
+
+        Parameters:
+        -----------
+        nyears: int
+        npoints: int. Number of curve points, at least len(rates); trailing
+        repeats of the last rate, dropped by normalize_curve, are points of
+        their own. Default len(rates).
+        """
+        npoints = len(self.rates) if npoints is None else int(npoints)
+        assert npoints >= len(self.rates), "Error: curve has more points than npoints."
+        points = np.minimum(np.arange(nyears), npoints - 1)
+        return (points[:, np.newaxis] == np.arange(npoints)).astype(float)
+
+    def mixed(self, deferral, nyears):
+        """ Returns discount weights mid-year until, and whole-year after,
+        given number of years till pension age.
+
+        Parameters:
+        -----------
+        deferral: int
+        nyears: int
+        """
+        deferral = int(deferral)
+        return self._vector(('mixed', deferral), nyears,
+                            lambda n: np.where(np.arange(n) <= deferral,
+                                               self.mid(n), self.whole(n)))
+
+    def to_series(self, nyears):
+        """ Returns Series with intrest per year, e.g. for exports. """
+        return pd.Series(self.intrest(nyears), name='intrest')
+
+
+def curve_points(intrest):
+    """ Returns number of points of given intrest or yield curve as passed,
+    including trailing repeats of the last rate.
+
+    Parameters:
+    -----------
+    intrest: YieldCurve, int, float, list, array or Series
+    """
+    if isinstance(intrest, YieldCurve):
+        return len(intrest.rates)
+    if isinstance(intrest, pd.Series):
+        intrest = intrest.values
+    return np.atleast_1d(intrest).size
+
+
+# curves shared by from_value, keyed by their normalized rates
+CURVES = LRUCache(CURVE_CACHE_SIZE)
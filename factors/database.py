@@ -0,0 +1,380 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache
+from commutation import Commutation
+from generation import GenerationTable, CohortCommutation
+from instrument import instrumented
+from settings import (XLSWB, CACHE_DIR, SHEETS, OPTIONAL_SHEETS, GENERATION_SHEET, MALE, FEMALE, SEXES,
+                      ADJUSTMENT_TYPES, ADJUSTMENT_ITEMS, OPTIONAL_ADJUSTMENTS, LOOKUP_CACHE_SIZE,
+                      CUBE_CACHE_SIZE)
+
+CACHE_VERSION = '1'
+
+logger = logging.getLogger(__name__)
+
+
+def file_checksum(filename):
+    """ Returns sha1 hex digest of file contents.
+
+    Parameters:
+    -----------
+    filename: str
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def cache_filename(xlswb, cachedir=None):
+    """ Returns name of columnar cache file beside given workbook or, with
+    cachedir, in that directory (named after the workbook and its path).
+
+    Parameters:
+    -----------
+    xlswb: str
+    cachedir: str. Optional.
+    """
+    if cachedir is None:
+        return os.path.splitext(xlswb)[0] + '.cache.npz'
+    name = os.path.splitext(os.path.basename(xlswb))[0]
+    path = hashlib.sha1(os.path.abspath(xlswb).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cachedir, '{0}-{1}.cache.npz'.format(name, path))
+
+
+def frames_to_arrays(frames):
+    """ Returns dict {'sheet/column': array} with one array per column.
+
+    Text columns are stored as unicode arrays with a separate null mask,
+    so the cache can be read without unpickling.
+
+    Parameters:
+    -----------
+    frames: dict {sheetname: DataFrame}
+    """
+    arrays = {}
+    for sheetname, df in frames.items():
+        columns = np.array(df.columns, dtype=np.unicode_)
+        arrays[sheetname + '/__columns__'] = columns
+        for column, name in zip(df.columns, columns):
+            values = df[column].values
+            key = sheetname + '/' + name
+            if values.dtype == object:
+                isnull = pd.isnull(values)
+                arrays[key + '/__isnull__'] = isnull
+                values = np.where(isnull, u'', values).astype(np.unicode_)
+            arrays[key] = values
+    return arrays
+
+
+def arrays_to_frames(arrays, sheetnames):
+    """ Inverse of frames_to_arrays.
+
+    Parameters:
+    -----------
+    arrays: dict-like {'sheet/column': array}
+    sheetnames: list of str
+    """
+    frames = {}
+    for sheetname in sheetnames:
+        columns = list(arrays[sheetname + '/__columns__'])
+        data = {}
+        for column in columns:
+            key = sheetname + '/' + column
+            values = arrays[key]
+            if values.dtype.kind == 'U':
+                values = values.astype(object)
+                values[arrays[key + '/__isnull__']] = np.nan
+            data[column] = values
+        frames[sheetname] = pd.DataFrame(data, columns=columns)
+    return frames
+
+
+def write_arrays(filename, arrays):
+    """ Writes arrays to .npz file atomically, creating its directory if
+    needed. Returns False if the location is not writable.
+
+    Parameters:
+    -----------
+    filename: str
+    arrays: dict {name: array}
+    """
+    dirname = os.path.dirname(filename)
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    except (IOError, OSError):
+        return False
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.chmod(tmpname, 0o644)
+        os.rename(tmpname, filename)
+    except (IOError, OSError):
+        os.remove(tmpname)
+        return False
+    return True
+
+
+class Database(object):
+    """ Sheets of the lifedb workbook, parsed once.
+
+    The parsed sheets are kept in a binary columnar cache (.npz) beside
+    the workbook, or in CACHE_DIR if that location is read-only, which is
+    invalidated when the workbook contents change. With a valid cache only
+    its header is checked on construction and each sheet is read from the
+    cache on first access; otherwise the workbook is parsed as a whole.
+    Tables selected by id (lx, hx, adjustments, ukv) are built once and
+    shared by all LifeTables using the same database, as are the undefined
+    partner lookup tables and interest independent cash flow cubes (both
+    in a LRU cache).
+    """
+
+    def __init__(self, xlswb=XLSWB, cache=True, stats=None, cachedir=CACHE_DIR):
+        """ Parameters:
+        -----------
+        xlswb: str
+        cache: boolean. Use (and write) columnar cache. Default True.
+        stats: Stats. Records workbook and cache reads. Optional.
+        cachedir: str. Cache location if the workbook's directory is
+        read-only. Default CACHE_DIR.
+        """
+        self.stats = stats
+        self.xlswb = xlswb
+        self.checksum = file_checksum(xlswb)
+        self.cachefiles = [cache_filename(xlswb), cache_filename(xlswb, cachedir)] if cache else []
+        self.sheets = {}
+        self.cachefile, self.sheetnames = self.find_cache()
+        if self.cachefile is None:
+            self.sheets = self.read_workbook()
+            self.sheetnames = list(self.sheets)
+            self.write_cache()
+        self.memo = {}
+        self.lookups = LRUCache(LOOKUP_CACHE_SIZE)
+        self.cubes = LRUCache(CUBE_CACHE_SIZE)
+
+    def __getitem__(self, sheetname):
+        return self.sheet(sheetname).copy()
+
+    def has_sheet(self, sheetname):
+        return sheetname in self.sheets or sheetname in self.sheetnames
+
+    def sheet(self, sheetname):
+        """ Returns (shared) sheet, read from the cache on first access.
+
+        Parameters:
+        -----------
+        sheetname: str
+        """
+        if sheetname not in self.sheets:
+            if sheetname not in self.sheetnames:
+                raise KeyError(sheetname)
+            frames = self.read_cache([sheetname])
+            if frames is None:
+                # cache changed or removed since it was validated
+                frames = self.read_workbook()
+            for name, frame in frames.items():
+                self.sheets.setdefault(name, frame)
+        return self.sheets[sheetname]
+
+    @instrumented
+    def read_workbook(self):
+        """ Returns dict {sheetname: DataFrame}, parsing the workbook once.
+
+        Optional sheets (generation tables) are read only if present.
+        """
+        workbook = pd.ExcelFile(self.xlswb)
+        sheetnames = SHEETS + [name for name in OPTIONAL_SHEETS if name in workbook.sheet_names]
+        return {name: workbook.parse(name) for name in sheetnames}
+
+    def find_cache(self):
+        """ Returns (cachefile, sheetnames) of the first valid cache,
+        (None, None) if all are stale or missing. Only the header is read.
+        """
+        for cachefile in self.cachefiles:
+            if not os.path.exists(cachefile):
+                continue
+            try:
+                with np.load(cachefile) as arrays:
+                    if self.valid_cache(arrays):
+                        return cachefile, SHEETS + [name for name in OPTIONAL_SHEETS
+                                                    if name + '/__columns__' in arrays.files]
+            except (IOError, OSError, KeyError, ValueError):
+                continue
+        return None, None
+
+    def valid_cache(self, arrays):
+        return (arrays['__version__'] == CACHE_VERSION and
+                arrays['__checksum__'] == self.checksum)
+
+    @instrumented
+    def read_cache(self, sheetnames):
+        """ Returns dict {sheetname: DataFrame} for given sheets from the
+        validated cache, None if it has changed or is missing since.
+
+        Parameters:
+        -----------
+        sheetnames: list of str
+        """
+        try:
+            with np.load(self.cachefile) as arrays:
+                if not self.valid_cache(arrays):
+                    return None
+                return arrays_to_frames(arrays, sheetnames)
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    @instrumented
+    def write_cache(self):
+        """ Writes columnar cache to the first writable location, see
+        cachefiles; logs a warning if none is writable.
+        """
+        if not self.cachefiles:
+            return
+        arrays = frames_to_arrays(self.sheets)
+        arrays['__version__'] = np.array(CACHE_VERSION, dtype=np.unicode_)
+        arrays['__checksum__'] = np.array(self.checksum, dtype=np.unicode_)
+        for cachefile in self.cachefiles:
+            if write_arrays(cachefile, arrays):
+                return
+        logger.warning("workbook cache not written, no writable location in %s",
+                       ', '.join(os.path.dirname(name) for name in self.cachefiles))
+
+    def memoize(self, key, func):
+        """ Returns func(), evaluated once per key. """
+        if key not in self.memo:
+            self.memo[key] = func()
+        return self.memo[key]
+
+    def indexed(self, sheetname, index):
+        """ Returns sheet with given index columns, shared between callers.
+
+        Parameters:
+        -----------
+        sheetname: str
+        index: list of str
+        """
+        return self.memoize(('indexed', sheetname),
+                            lambda: self[sheetname].set_index(index))
+
+    @instrumented
+    def lx(self, select):
+        """ Returns dict {gender: DataFrame} with lx per age for given table id.
+
+        Parameters:
+        -----------
+        select: int
+        """
+        df = self.indexed('tbl_lx', ['id', 'gender', 'age'])
+        return self.memoize(('lx', select),
+                            lambda: {gender: df.ix[select].ix[gender]
+                                     for gender in (MALE, FEMALE)})
+
+    @instrumented
+    def hx(self, select):
+        """ Returns dict {gender: DataFrame} with hx per age for given table id.
+
+        Parameters:
+        -----------
+        select: int
+        """
+        df = self.indexed('tbl_hx', ['id', 'gender', 'age'])
+        return self.memoize(('hx', select),
+                            lambda: {gender: df.ix[select].ix[gender]
+                                     for gender in (MALE, FEMALE)})
+
+    def generation(self, select):
+        """ Returns dict {gender: GenerationTable} for given generation table id.
+
+        Parameters:
+        -----------
+        select: int
+        """
+        def build():
+            if not self.has_sheet(GENERATION_SHEET):
+                raise KeyError("workbook has no generation tables ({0})".format(GENERATION_SHEET))
+            df = self.sheet(GENERATION_SHEET)
+            df = df[df['id'] == select]
+            if not len(df):
+                raise KeyError("generation table {0} not found".format(select))
+            return {gender: GenerationTable.from_frame(df[df['gender'] == gender])
+                    for gender in (MALE, FEMALE)}
+        return self.memoize(('generation', select), build)
+
+    @instrumented
+    def engine(self, select, baseyear=None):
+        """ Returns Commutation engine for given lx table id, or for given
+        generation table id valued in baseyear.
+
+        Parameters:
+        -----------
+        select: int
+        baseyear: int. Required for generation tables only.
+        """
+        if baseyear is None:
+            return self.memoize(('engine', select),
+                                lambda: Commutation(self.lx(select)))
+        return self.memoize(('engine', select, int(baseyear)),
+                            lambda: CohortCommutation(self.generation(select), baseyear))
+
+    @instrumented
+    def adjustments(self, select):
+        """ Returns structured array (SEXES x ADJUSTMENT_TYPES) with one float
+        field per item in ADJUSTMENT_ITEMS, e.g. adjustments['CX1'][0, 1]
+        for male partner pensions. Only items in OPTIONAL_ADJUSTMENTS may be
+        missing from the table; these are NaN. Raises KeyError for other
+        missing items and ValueError for unknown genders, types or items.
+
+        Parameters:
+        -----------
+        select: int
+        """
+        def build():
+            df = self['tbl_adjustments']
+            df = df[df['id'] == select]
+            for column, known in (('gender', SEXES), ('type', ADJUSTMENT_TYPES),
+                                  ('adjustment', ADJUSTMENT_ITEMS)):
+                unknown = sorted(set(df[column]) - set(known))
+                if unknown:
+                    raise ValueError("adjustments {0}: unknown {1}: {2}".format(
+                        select, column, ', '.join(str(value) for value in unknown)))
+            out = np.empty((len(SEXES), len(ADJUSTMENT_TYPES)),
+                           dtype=[(str(item), float) for item in ADJUSTMENT_ITEMS])
+            for item in ADJUSTMENT_ITEMS:
+                out[item] = np.nan
+            for gender, type_, item, value in df[['gender', 'type', 'adjustment', 'value']].values:
+                out[str(item)][SEXES.index(gender), ADJUSTMENT_TYPES.index(type_)] = value
+            missing = ['{0} {1} {2}'.format(gender, type_, item)
+                       for i, gender in enumerate(SEXES)
+                       for j, type_ in enumerate(ADJUSTMENT_TYPES)
+                       for item in ADJUSTMENT_ITEMS
+                       if np.isnan(out[item][i, j]) and (type_, item) not in OPTIONAL_ADJUSTMENTS]
+            if missing:
+                raise KeyError("adjustments {0}: missing {1}".format(select, ', '.join(missing)))
+            out.flags.writeable = False
+            return out
+        return self.memoize(('adjustments', select), build)
+
+    @instrumented
+    def ukv(self, select):
+        """ Returns ukv values indexed by gender, pension_age and intrest.
+
+        Parameters:
+        -----------
+        select: int
+        """
+        def build():
+            df = self['tbl_ukv']
+            df = df[df['id'] == select]
+            df.drop('id', axis=1, inplace=True)
+            df.set_index(['gender', 'pension_age', 'intrest'], inplace=True)
+            return df
+        return self.memoize(('ukv', select), build)
@@ -0,0 +1,178 @@
+import numpy as np
+
+from curve import YieldCurve, curve_points
+from settings import TIMING
+
+
+def discount_factors(intrest, nyears):
+    """ Returns array with one year discount factor 1 / (1 + r / 100) per year.
+
+    Parameters:
+    -----------
+    intrest: YieldCurve, int, float, list or Series
+    nyears: int
+    """
+    return YieldCurve.from_value(intrest).discount_factors(nyears)
+
+
+def halfyear_until(timing, deferral=None):
+    """ Returns array with last year discounted mid-year, per row.
+
+    Payments in years t <= halfyear_until are discounted over t + 0.5 years,
+    later payments over t years.
+
+    Parameters:
+    -----------
+    timing: array of str: 'whole' (whole year), 'mid' (mid-year) or 'mixed'
+    (mid-year until pension age, whole year thereafter)
+    deferral: array of int with number of years till pension age.
+    Required for 'mixed' rows only.
+    """
+    timing = np.asarray(timing)
+    out = np.where(timing == 'mid', np.iinfo(np.int64).max, -1)
+    mixed = timing == 'mixed'
+    if mixed.any():
+        assert deferral is not None, "Error: mixed timing requires deferral."
+        out = np.where(mixed, deferral, out)
+    return out
+
+
+def insurance_timing(insurance_ids):
+    """ Returns array with timing convention per insurance_id.
+
+    Parameters:
+    -----------
+    insurance_ids: list of str
+    """
+    return np.array([TIMING[insurance_id] for insurance_id in insurance_ids])
+
+
+def discount_matrix(curves, nyears):
+    """ Returns array (scenarios x years) with one year discount factors.
+
+    Each curve is forward-filled with its last rate (or truncated) to nyears.
+
+    Parameters:
+    -----------
+    curves: 2-D array (scenarios x maturities), intrest in pct
+    nyears: int
+    """
+    curves = np.atleast_2d(np.asarray(curves, dtype=float))
+    if curves.shape[1] < nyears:
+        fill = np.repeat(curves[:, -1:], nyears - curves.shape[1], axis=1)
+        curves = np.hstack((curves, fill))
+    return 1. / (1 + curves[:, :nyears] / 100.)
+
+
+def curve_matrix(curves):
+    """ Returns 2-D array (scenarios x maturities) with given curves,
+    each forward-filled with its last rate to the length of the longest.
+
+    Parameters:
+    -----------
+    curves: list of int, float, list or Series, or 2-D array
+    """
+    if isinstance(curves, np.ndarray) and curves.ndim == 2:
+        return curves.astype(float)
+    curves = [np.atleast_1d(np.asarray(curve, dtype=float)) for curve in curves]
+    out = np.empty((len(curves), max(len(curve) for curve in curves)))
+    for i, curve in enumerate(curves):
+        out[i, :len(curve)] = curve
+        out[i, len(curve):] = curve[-1]
+    return out
+
+
+def discount_weights(v):
+    """ Returns whole-year and mid-year discount weights v ** t and v ** (t + 0.5).
+
+    Parameters:
+    -----------
+    v: array (years) or (scenarios x years) with one year discount factors
+    """
+    years = np.arange(v.shape[-1])
+    return v ** years, v ** (years + 0.5)
+
+
+def split_timing(cashflows, timing, deferral=None):
+    """ Returns cash flow matrix (rows x 2 * years), with the whole-year
+    discounted payments in the first half and the mid-year discounted
+    payments in the second half of each row.
+
+    Parameters:
+    -----------
+    cashflows: 2-D array (policies x years)
+    timing: array of str with timing convention per row, see halfyear_until
+    deferral: array of int with years till pension age per row. Optional.
+    """
+    cashflows = np.atleast_2d(np.asarray(cashflows, dtype=float))
+    years = np.arange(cashflows.shape[1])
+    until = np.broadcast_to(halfyear_until(timing, deferral), (len(cashflows),))
+    midyear = years[np.newaxis, :] <= until[:, np.newaxis]
+    return np.hstack((np.where(midyear, 0., cashflows),
+                      np.where(midyear, cashflows, 0.)))
+
+
+def present_values(cashflows, intrest, timing, deferral=None, rounding=None):
+    """ Returns present values of all rows of a cash flow matrix.
+
+    Parameters:
+    -----------
+    cashflows: 2-D array (policies x years)
+    intrest: YieldCurve, int, float, list or Series
+    timing: array of str with timing convention per row, see halfyear_until
+    deferral: array of int with years till pension age per row. Optional.
+    rounding: int. Number of decimals. Optional.
+    """
+    split = split_timing(cashflows, timing, deferral)
+    whole, mid = YieldCurve.from_value(intrest).weights(split.shape[1] // 2)
+    out = split.dot(np.append(whole, mid))
+    if rounding is not None:
+        out = np.round(out, int(rounding))
+    return out
+
+
+def key_rate_derivatives(cashflows, intrest, timing, deferral=None, order=1, npoints=None):
+    """ Returns array (rows x curve points) with first or second derivatives
+    of the present value of each row with respect to each point of the
+    yield curve (rates as a decimal), for fixed cash flows.
+
+    Each year depends on one curve point only, so second derivatives
+    with respect to two different points are zero.
+
+    Parameters:
+    -----------
+    cashflows: 2-D array (policies x years)
+    intrest: YieldCurve, int, float, list or Series
+    timing: array of str with timing convention per row, see halfyear_until
+    deferral: array of int with years till pension age per row. Optional.
+    order: either 1 or 2. Default 1.
+    npoints: int. Number of curve points, see YieldCurve.key_rates.
+    Default the number of rates in intrest as passed.
+    """
+    curve = YieldCurve.from_value(intrest)
+    if npoints is None:
+        npoints = curve_points(intrest)
+    split = split_timing(cashflows, timing, deferral)
+    nyears = split.shape[1] // 2
+    whole, mid = curve.derivatives(nyears, order)
+    keys = curve.key_rates(nyears, npoints)
+    return split.dot(np.vstack((whole[:, np.newaxis] * keys, mid[:, np.newaxis] * keys)))
+
+
+def scenario_present_values(cashflows, curves, timing, deferral=None, rounding=None):
+    """ Returns present values (scenarios x policies) for many yield curves.
+
+    Parameters:
+    -----------
+    cashflows: 2-D array (policies x years)
+    curves: 2-D array (scenarios x maturities), intrest in pct
+    timing: array of str with timing convention per row, see halfyear_until
+    deferral: array of int with years till pension age per row. Optional.
+    rounding: int. Number of decimals. Optional.
+    """
+    split = split_timing(cashflows, timing, deferral)
+    whole, mid = discount_weights(discount_matrix(curves, split.shape[1] // 2))
+    out = np.hstack((whole, mid)).dot(split.T)
+    if rounding is not None:
+        out = np.round(out, int(rounding))
+    return out
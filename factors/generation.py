@@ -0,0 +1,202 @@
+import numpy as np
+
+from cache import LRUCache
+from commutation import Commutation
+from settings import MAXAGE, MEMO_CACHE_SIZE, COHORT_CACHE_SIZE
+
+
+def cohort_lx(qx):
+    """ Returns array with number of survivors per age (radix 1) for given
+    cohort mortality rates.
+
+    Parameters:
+    -----------
+    qx: array with mortality rates per age, starting at age 0
+    """
+    return np.append(1., np.cumprod(1. - np.asarray(qx, dtype=float))[:-1])
+
+
+def survival_row(lx, age):
+    """ Returns array with probabilities tpx for t = 0 .. len(lx) - 1,
+    zero beyond the end of the table or if lx = 0 at given age.
+
+    Parameters:
+    -----------
+    lx: array with number of survivors per age, starting at age 0
+    age: int
+    """
+    nrows = len(lx)
+    out = np.zeros(nrows)
+    age = min(int(age), nrows - 1)
+    if lx[age] > 0:
+        out[:nrows - age] = lx[age:] / lx[age]
+    return out
+
+
+class GenerationTable(object):
+    """ Mortality rates qx per calendar year and age for one gender.
+
+    The rates are kept as one 2-D array (year x age). The rates of a
+    cohort are the diagonal of that array for its birth year; years
+    beyond the table are taken equal to the first or last year. Cohort
+    vectors are derived on first use and kept in a LRU cache.
+    """
+
+    def __init__(self, qx, years):
+        """ Parameters:
+        -----------
+        qx: 2-D array (years x ages 0 .. MAXAGE)
+        years: list of int, calendar year per row of qx
+        """
+        self.qx = np.asarray(qx, dtype=float)
+        self.years = np.asarray(years, dtype=int)
+        assert (np.diff(self.years) == 1).all(), "Error: years should be consecutive."
+        assert self.qx.shape == (len(self.years), MAXAGE + 1), \
+            "Error: generation table should have one column per age 0 .. {0}".format(MAXAGE)
+        self.cohorts = LRUCache(COHORT_CACHE_SIZE)
+
+    @classmethod
+    def from_frame(cls, df):
+        """ Returns GenerationTable from DataFrame with columns year, age and qx. """
+        table = df.pivot(index='year', columns='age', values='qx')
+        table = table.reindex(columns=range(MAXAGE + 1))
+        return cls(table.values, table.index.values)
+
+    def cohort_qx(self, birthyear):
+        """ Returns array with mortality rates per age of given birth year.
+
+        Only the diagonal of the table is gathered, the table itself is
+        not copied.
+
+        Parameters:
+        -----------
+        birthyear: int
+        """
+        ages = np.arange(self.qx.shape[1])
+        rows = np.clip(int(birthyear) + ages - self.years[0], 0, len(self.years) - 1)
+        return self.qx[rows, ages]
+
+    def cohort_lx(self, birthyear):
+        """ Returns (cached, read-only) array with survivors per age of given birth year.
+
+        Parameters:
+        -----------
+        birthyear: int
+        """
+        def build():
+            out = cohort_lx(self.cohort_qx(birthyear))
+            out.flags.writeable = False
+            return out
+        return self.cohorts.get(int(birthyear), build)
+
+
+class CohortCommutation(Commutation):
+    """ Commutation engine on generation tables, valued in a base year.
+
+    A person aged x in the base year belongs to the cohort born in
+    baseyear - x; all survival probabilities of that person are taken
+    from the survivors of that cohort. Building blocks evaluated at
+    another age than the current one (e.g. at pension age, or with an
+    age correction) pass the age in the base year as cohort, so the
+    age moves along the diagonal but the birth year does not. The
+    interface is that of Commutation, so cash flow building blocks work
+    on either engine.
+    """
+
+    def __init__(self, tables, baseyear):
+        """ Parameters:
+        -----------
+        tables: dict {gender: GenerationTable}
+        baseyear: int
+        """
+        self.genders = sorted(tables)
+        self.tables = tables
+        self.baseyear = int(baseyear)
+        self.memo = LRUCache(MEMO_CACHE_SIZE)
+
+    def birthyear(self, age):
+        """ Returns (array of) birth year(s) of persons of given age in the base year. """
+        return self.baseyear - np.asarray(age).astype(int)
+
+    def cohort_key(self, age, cohort=None):
+        """ Returns birth year of the survivors used for a person of given age.
+
+        Parameters:
+        -----------
+        age: int
+        cohort: int. Age in the base year. Default age (capped at MAXAGE).
+        """
+        return int(self.birthyear(min(int(age), MAXAGE) if cohort is None else cohort))
+
+    def survivors(self, age, sex, cohort=None):
+        """ Returns survivors per age of the cohort of a person of given age.
+
+        Parameters:
+        -----------
+        age: int
+        sex: either 'M' of 'F'
+        cohort: int. Age in the base year. Default age.
+        """
+        return self.tables[sex].cohort_lx(self.cohort_key(age, cohort))
+
+    def npx(self, age, sex, nyears, cohort=None):
+        """ Returns probability person with given age is still alive after n years.
+
+        Arguments are broadcast against each other like a ufunc; ages are
+        capped at MAXAGE.
+
+        Parameters:
+        -----------
+        age: int or array
+        sex: either 'M' of 'F', or array of those
+        nyears: int or array
+        cohort: int or array. Age in the base year. Default age.
+        """
+        self.gender_index(sex)
+        age, sex, nyears = np.broadcast_arrays(np.asarray(age), np.asarray(sex),
+                                               np.asarray(nyears))
+        current_age = np.clip(age.astype(int), 0, MAXAGE)
+        future_age = np.clip((age + nyears).astype(int), 0, MAXAGE)
+        if cohort is None:
+            birthyear = self.birthyear(current_age)
+        else:
+            birthyear = np.broadcast_to(self.birthyear(cohort), age.shape)
+        out = np.zeros(age.shape)
+        for gender in self.genders:
+            for year in np.unique(birthyear[sex == gender]):
+                mask = (sex == gender) & (birthyear == year)
+                lx = self.tables[gender].cohort_lx(year)
+                current, future = lx[current_age[mask]], lx[future_age[mask]]
+                alive = current > 0
+                out[mask] = np.where(alive, future / np.where(alive, current, 1.), 0.)
+        return out[()]
+
+    def annuity(self, age, sex, defer=0, cohort=None):
+        """ Returns array with expected payments (deferred) lifetime annuity.
+
+        Parameters:
+        -----------
+        age: int
+        sex: either 'M' of 'F'
+        defer: int
+        cohort: int. Age in the base year. Default age.
+        """
+        assert MAXAGE + 1 > defer, "Error: deferral period exceeds number of table rows."
+        out = survival_row(self.survivors(age, sex, cohort), age)
+        out[:max(int(defer), 0)] = 0
+        return out
+
+    def annuities(self, ages, sex, defer=0, cohort=None):
+        """ Returns matrix (ages x years) with one annuity() row per age.
+
+        Parameters:
+        -----------
+        ages: array of int
+        sex: either 'M' of 'F'
+        defer: int or array of int, one per age
+        cohort: array of int, age in the base year per age. Default ages.
+        """
+        ages = np.asarray(ages)
+        defer = np.broadcast_to(np.asarray(defer), ages.shape)
+        cohort = [None] * len(ages) if cohort is None else np.broadcast_to(np.asarray(cohort), ages.shape)
+        return np.vstack([self.annuity(age, sex, n, c) for age, n, c in zip(ages, defer, cohort)])
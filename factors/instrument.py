@@ -0,0 +1,151 @@
+import functools
+import json
+import sys
+import timeit
+
+from collections import OrderedDict
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    """ Returns peak resident set size of this process in bytes. """
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def instrumented(func=None, label=None):
+    """ Decorates method to report to self.stats, when it is set.
+
+    With stats disabled (self.stats is None) the method is called directly.
+
+    Parameters:
+    -----------
+    func: method
+    label: callable(self, *args, **kwargs) returning the name to record
+    the call under. Optional. Default the name of the method.
+    """
+    if func is None:
+        return functools.partial(instrumented, label=label)
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        stats = self.stats
+        if stats is None:
+            return func(self, *args, **kwargs)
+        key = name if label is None else label(self, *args, **kwargs)
+        return stats.call(key, func, self, *args, **kwargs)
+    return wrapper
+
+
+class Stats(object):
+    """ Call counts, cumulative wall time and allocations per method,
+    together with hit ratios of watched caches.
+
+    Times are cumulative: a method calling other instrumented methods
+    includes their time. With memory=True allocations are recorded as the
+    net bytes still allocated on return where tracemalloc is available,
+    otherwise (Python 2) as the growth of the peak resident set size of
+    the process during the call.
+    """
+
+    def __init__(self, memory=False):
+        """ Parameters:
+        -----------
+        memory: boolean. Record allocations. Default False.
+        """
+        if memory and tracemalloc is None and resource is None:
+            raise RuntimeError("memory tracking requires tracemalloc or the resource module")
+        self.memory = memory
+        self.calls = OrderedDict()
+        self.caches = OrderedDict()
+        self.tracing = False
+
+    def start(self):
+        """ Starts tracing allocations, if requested and not traced yet. """
+        if self.memory and tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+
+    def stop(self):
+        """ Stops tracing allocations, if started by start(). """
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def call(self, name, func, *args, **kwargs):
+        """ Returns func(*args, **kwargs), recording the call under name. """
+        memory = self.memory and (tracemalloc is None or tracemalloc.is_tracing())
+        if memory:
+            before = self.memory_in_use()
+        start = timeit.default_timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = timeit.default_timer() - start
+            record = self.calls.get(name)
+            if record is None:
+                record = self.calls[name] = {'calls': 0, 'seconds': 0., 'allocated': None}
+            record['calls'] += 1
+            record['seconds'] += seconds
+            if memory:
+                allocated = self.memory_in_use() - before
+                record['allocated'] = (record['allocated'] or 0) + allocated
+
+    def memory_in_use(self):
+        """ Returns traced bytes, or the peak resident set size without tracemalloc. """
+        if tracemalloc is not None:
+            return tracemalloc.get_traced_memory()[0]
+        return peak_rss()
+
+    def watch(self, name, cache):
+        """ Adds LRUCache to report hits and misses of from now on.
+
+        Parameters:
+        -----------
+        name: str
+        cache: LRUCache
+        """
+        if name not in self.caches:
+            self.caches[name] = (cache, cache.hits, cache.misses)
+
+    def cache_stats(self):
+        """ Returns dict {name: {hits, misses, hit_ratio, size}} of watched caches. """
+        out = OrderedDict()
+        for name, (cache, hits, misses) in self.caches.items():
+            hits, misses = cache.hits - hits, cache.misses - misses
+            out[name] = {'hits': hits,
+                         'misses': misses,
+                         'hit_ratio': float(hits) / (hits + misses) if hits + misses else None,
+                         'size': len(cache)}
+        return out
+
+    def reset(self):
+        """ Removes all recorded calls and restarts counting cache hits. """
+        self.calls.clear()
+        for name, (cache, _, _) in list(self.caches.items()):
+            self.caches[name] = (cache, cache.hits, cache.misses)
+
+    def to_dict(self):
+        """ Returns dict {'calls': {name: record}, 'caches': cache_stats()}. """
+        return {'calls': OrderedDict((name, dict(record)) for name, record in self.calls.items()),
+                'caches': self.cache_stats()}
+
+    def to_json(self, **kwargs):
+        """ Returns to_dict() as json string; kwargs are passed to json.dumps. """
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def slowest(self):
+        """ Returns recorded calls as list of (name, calls, seconds, allocated),
+        slowest first. """
+        rows = [(name, record['calls'], record['seconds'], record['allocated'])
+                for name, record in self.calls.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
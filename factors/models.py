@@ -3,126 +3,194 @@ from __future__ import print_function
 import numpy as np
 import pandas as pd
 
-from collections import OrderedDict
-from settings import UPAGE, LOWAGE, MAXAGE, XLSWB, INSURANCE_IDS, MALE, FEMALE
-from utils import dictify, prae_to_continuous, merge_two_dicts, cartesian, expand, x_to_series
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from datetime import date
+from cache import curve_fingerprint, fingerprint
+from cube import CashflowCube
+from curve import YieldCurve, curve_points
+from database import Database
+from instrument import Stats, instrumented
+from results import RESULT_VERSION
+from discount import (present_values, insurance_timing, discount_matrix,
+                      discount_weights, key_rate_derivatives, scenario_present_values)
+from settings import (UPAGE, LOWAGE, XLSWB, INSURANCE_IDS, MALE, FEMALE, SEXES, TIMING,
+                      ADJUSTMENT_TYPES, ADJUSTMENT_ITEMS, UNDEFINED_PARTNER, PENSION_AGE_FREE,
+                      PORTFOLIO_KEYS)
+from utils import (prae_to_continuous, prae_to_continuous_rows, merge_two_dicts,
+                   lazy_property, to_payments, to_matrix)
+from writers import frame_rows, long_rows, wide_rows, write_xlsx, write_csv
+
+# adjustments of one sex and benefit type, see LifeTable.adjustment
+Adjustment = namedtuple('Adjustment', ADJUSTMENT_ITEMS)
 
 
 class LifeTable(object):
-    def __init__(self, tablename, xlswb=XLSWB):
+    def __init__(self, tablename, xlswb=XLSWB, database=None, store=None, baseyear=None,
+                 results=None):
         self.tablename = tablename
-        self.xlswb = xlswb
-        self.legend = self.get_legend()
+        self.stats = None
+        self.database = database if database is not None else Database(xlswb)
+        self.store = store
+        self.results = results
+        self.xlswb = self.database.xlswb
         self.params = self.get_parameters()
-        self.lx = self.get_lx()
-        self.hx = self.get_hx()
-        self.adjust = self.get_adjustments()
-        self.ukv = self.get_ukv()
-        self.testdata = self.get_test_data()
+        self.generation = self.params['type'] == 'multi'
+        if self.generation:
+            self.baseyear = int(baseyear) if baseyear is not None else date.today().year
+        else:
+            self.baseyear = None
         self.pension_age = None
         self.intrest = None
-        self.lookup = None
         self.cfs = None
         self.factors = None
-        self.yield_curve = None
+
+    # Workbook derived attributes are loaded on first use, so a table only
+    # parses the sheets it needs (e.g. no test data unless run_test is called).
+
+    @lazy_property
+    def legend(self):
+        return self.get_legend()
+
+    @lazy_property
+    def engine(self):
+        return self.database.engine(int(self.params['lx']), self.baseyear)
+
+    @lazy_property
+    def lx(self):
+        return self.get_lx()
+
+    @lazy_property
+    def hx(self):
+        return self.get_hx()
+
+    @lazy_property
+    def adjust(self):
+        return self.get_adjustments()
+
+    @lazy_property
+    def adjust_records(self):
+        records = self.adjust.tolist()
+        return {(sex, insurance_type): Adjustment(*records[i][j])
+                for i, sex in enumerate(SEXES)
+                for j, insurance_type in enumerate(ADJUSTMENT_TYPES)}
+
+    @lazy_property
+    def ukv(self):
+        return self.get_ukv()
+
+    @lazy_property
+    def testdata(self):
+        return self.get_test_data()
 
     def get_legend(self):
-        df = pd.read_excel(self.xlswb, sheetname='tbl_insurance_types')
+        df = self.database['tbl_insurance_types']
         df.set_index('id_type', inplace=True)
-        return df.ix[INSURANCE_IDS]
+        return df.reindex(INSURANCE_IDS)
 
     def get_parameters(self):
-        df = pd.read_excel(self.xlswb, sheetname='tbl_tariff')
+        df = self.database['tbl_tariff']
         df.set_index('name', inplace=True)
         return df.ix[self.tablename].to_dict()
 
     def get_lx(self):
-        df = pd.read_excel(self.xlswb, sheetname='tbl_lx')
-        df.set_index(['id', 'gender', 'age'], inplace=True)
-        select = int(self.params['lx'])
-        return {gender: df.ix[select].ix[gender] for gender in (MALE, FEMALE)}
+        if not self.generation:
+            return self.database.lx(int(self.params['lx']))
+        # generation table: survivors per cohort born in the grid's birth years
+        birthyears = range(self.baseyear - UPAGE + 1, self.baseyear - LOWAGE + 1)
+        return {sex: pd.DataFrame({year: self.engine.tables[sex].cohort_lx(year)
+                                   for year in birthyears},
+                                  columns=birthyears).rename_axis('age')
+                for sex in (MALE, FEMALE)}
 
     def get_hx(self):
-        df = pd.read_excel(self.xlswb, sheetname='tbl_hx')
-        df.set_index(['id', 'gender', 'age'], inplace=True)
-        select = int(self.params['hx'])
-        return {gender: df.ix[select].ix[gender] for gender in (MALE, FEMALE)}
+        return self.database.hx(int(self.params['hx']))
 
     def get_adjustments(self):
-        df = pd.read_excel(self.xlswb, sheetname='tbl_adjustments')
-        select = self.params['adjustments']
-        df = df[df['id'] == select]
-        df.drop('id', axis=1, inplace=True)
-        return dictify(df)
+        return self.database.adjustments(self.params['adjustments'])
+
+    def adjustment(self, sex, insurance_type):
+        """ Returns Adjustment (CX1, CX2, CX3, fnett, fcorr, fOTS) of sex and
+        benefit type, e.g. adjustment('M', 'partner').CX1. Vectorized code
+        gathers from the structured array self.adjust instead.
+
+        Parameters:
+        -----------
+        sex: either 'M' of 'F'
+        insurance_type: either 'retire', 'partner' or 'risk'
+        """
+        return self.adjust_records[(sex, insurance_type)]
 
     def get_ukv(self):
-        df = pd.read_excel(self.xlswb, sheetname='tbl_ukv')
         try:
-            df = df[df['id'] == int(self.params['ukv'])]
+            select = int(self.params['ukv'])
         except ValueError:
             return None
-        df.drop('id', axis=1, inplace=True)
-        df.set_index(['gender', 'pension_age', 'intrest'], inplace=True)
-        return df
+        return self.database.ukv(select)
 
     def get_test_data(self):
-        df1 = pd.read_excel(self.xlswb, sheetname='tbl_testdata_values')
-        df2 = pd.read_excel(self.xlswb, sheetname='tbl_testdata')
+        df1 = self.database['tbl_testdata_values']
+        df2 = self.database['tbl_testdata']
         out = pd.merge(df1, df2, left_on='testdata_id', right_on='id')
         return out[out['table'] == self.tablename]
 
-    def npx(self, age, sex, nyears):
+    def npx(self, age, sex, nyears, cohort=None):
         """Returns probability person with given age is still alive after n years.
 
+        Accepts arrays, which are broadcast against each other.
+
         Parameters:
         -----------
-        age: int
-        sex: either 'M' of 'F'
-        nyears: int
+        age: int or array
+        sex: either 'M' of 'F', or array of those
+        nyears: int or array
+        cohort: int or array. Age in the base year, for generation tables
+        only. Default age.
         """
-        future_age = np.minimum(age + nyears, MAXAGE)
-        current_age = np.minimum(age, MAXAGE)
-        return (float(self.lx[sex].ix[future_age]['lx']) /
-                self.lx[sex].ix[current_age]['lx'])
+        return self.engine.npx(age, sex, nyears, cohort)
 
-    def qx(self, age, sex):
+    def qx(self, age, sex, cohort=None):
         """Returns the probability that person with given age will die within 1 year.
 
+        Accepts arrays, which are broadcast against each other.
+
         Parameters:
         -----------
-        age: int
-        sex: either 'M' of 'F'
+        age: int or array
+        sex: either 'M' of 'F', or array of those
+        cohort: int or array. Age in the base year, see npx.
         """
-        return 1 - self.npx(age, sex, 1)
+        return 1 - self.npx(age, sex, 1, cohort)
 
-    def nqx(self, age, sex, nyears):
+    def nqx(self, age, sex, nyears, cohort=None):
         """Returns probability that person with will die
            in interval (nyears - 1, nyears).
 
+        Accepts arrays, which are broadcast against each other.
+
         Parameters:
         -----------
-        age: int
-        sex: either 'M' of 'F'
-        nyears: int
+        age: int or array
+        sex: either 'M' of 'F', or array of those
+        nyears: int or array
+        cohort: int or array. Age in the base year, see npx.
         """
-        return self.npx(age, sex, nyears - 1) - self.npx(age, sex, nyears)
+        return (self.npx(age, sex, np.asarray(nyears) - 1, cohort) -
+                self.npx(age, sex, nyears, cohort))
 
-    def cf_annuity(self, age, lx, defer=0):
+    @instrumented
+    def cf_annuity(self, age, sex, defer=0):
         """ Returns expected payments for (deferred) lifetime annuity.
 
         Parameters:
         -----------
         age: int
-        lx: series
+        sex: either 'M' of 'F'
         defer: int
         """
-        nrows = len(lx)
-        assert nrows > defer, "Error: deferral period exceeds number of table rows."
-        payments = pd.Series(defer * [0] + (nrows - defer) * [1])
-        out = (payments * lx.shift(-age) / lx.ix[age]).fillna(0)
-        out.index.rename('year', inplace=True)
-        return out
+        return to_payments(self.engine.annuity(age, sex, defer))
 
+    @instrumented
     def cf_ay_avg(self, age_insured, sex_insured, pension_age=None, **kwargs):
         """ Returns cash flows non-defered annuity for beneficiary.
 
@@ -132,20 +200,45 @@ class LifeTable(object):
         sex_insured: either 'M' of 'F'
 
         insurance_type: either 'partner' or 'risk. Default 'partner'
+        cohort: int. Age of the insured in the base year of a generation
+        table. Default age_insured.
         """
         insurance_type = kwargs.get('insurance_type', 'partner')
+        cohort = kwargs.get('cohort', age_insured)
         assert sex_insured in (MALE, FEMALE), "sex insured should be either M of F!"
         sex_beneficiary = FEMALE if sex_insured == MALE else MALE
         delta = int(self.params['delta'])
         sign = 1 if sex_insured == MALE else -1
-        gamma3 = self.adjust[sex_beneficiary][insurance_type]['CX3']
-        tbl_beneficiary = (self.lx[FEMALE]['lx'] if sex_insured == MALE
-                           else self.lx[MALE]['lx'])
-        cf_ay_avg = (self.cf_annuity(age_insured - sign * delta + gamma3,
-                     tbl_beneficiary) + self.cf_annuity(age_insured +
-                     1 - sign * delta + gamma3, tbl_beneficiary)) / 2.
-        cf_ay_avg = prae_to_continuous(cf_ay_avg)
-        return {'payments': cf_ay_avg}
+        gamma3 = self.adjustment(sex_beneficiary, insurance_type).CX3
+        age_beneficiary = age_insured - sign * delta + gamma3
+        return {'payments': to_payments(self.engine.annuity_avg(age_beneficiary, sex_beneficiary,
+                                                                cohort - sign * delta))}
+
+    def ay_avg_rows(self, ages, sex_insured, cohorts=None, insurance_type='partner'):
+        """ Returns matrix (ages x years) with the cf_ay_avg payments of all
+        given ages at once.
+
+        Parameters:
+        ----------
+        ages: array of int
+        sex_insured: either 'M' of 'F'
+        cohorts: array of int, age of the insured in the base year of a
+        generation table per age. Default ages.
+        insurance_type: either 'partner' or 'risk'. Default 'partner'.
+        """
+        assert sex_insured in (MALE, FEMALE), "sex insured should be either M of F!"
+        sex_beneficiary = FEMALE if sex_insured == MALE else MALE
+        delta = int(self.params['delta'])
+        sign = 1 if sex_insured == MALE else -1
+        gamma3 = self.adjustment(sex_beneficiary, insurance_type).CX3
+        ages = np.asarray(ages)
+        cohorts = ages if cohorts is None else np.asarray(cohorts)
+        ages_beneficiary = ages - sign * delta + gamma3
+        cohorts_beneficiary = cohorts - sign * delta
+        annuities = self.engine.annuities
+        payments = (annuities(ages_beneficiary, sex_beneficiary, cohort=cohorts_beneficiary) +
+                    annuities(ages_beneficiary + 1, sex_beneficiary, cohort=cohorts_beneficiary)) / 2.
+        return prae_to_continuous_rows(payments)
 
     def ay_avg(self, age_insured, sex_insured,
                intrest, insurance_type='partner'):
@@ -163,31 +256,112 @@ class LifeTable(object):
         return self.pv({'insurance_id': 'OPLL',
                        'payments': cf_ay_avg['payments']}, intrest)
 
+    def table_key(self):
+        """ Returns tuple with the table parameters cash flows depend on. """
+        return tuple(self.params[item] for item in ('lx', 'hx', 'adjustments', 'delta', 'round')) + \
+            (self.baseyear,)
+
+    def pension_age_free_rows(self):
+        """ Returns (memoized) dict {(insurance_id, sex, age): array} with the
+        payments of the factor grid rows that do not depend on the pension
+        age, see PENSION_AGE_FREE; shared by the cubes of all pension ages.
+        """
+        def build():
+            return {(insurance_id, sex, age): self.cf(insurance_id, age, sex, None)['payments'].values
+                    for insurance_id in PENSION_AGE_FREE if insurance_id in INSURANCE_IDS
+                    for sex in (MALE, FEMALE) for age in range(LOWAGE, UPAGE)}
+        return self.database.memoize(('pension_age_free',) + self.table_key(), build)
+
+    def lookup_cohorts(self):
+        """ Returns array with the cohorts (ages of the insured in the base
+        year) with their own lookup table rows, None for static tables.
+
+        Rows of generation tables depend on the birth year of the insured,
+        so these have a block of rows per age the insured can have today.
+        """
+        return np.arange(UPAGE) if self.generation else None
+
+    def lookup_rows(self, sex_insured, age_insured, ages):
+        """ Returns array with the lookup table row numbers of the ay_avg at
+        given ages of an insured, see get_lookup_items.
+
+        Parameters:
+        ----------
+        sex_insured: either 'M' of 'F'
+        age_insured: int
+        ages: array of int, LOWAGE <= age < UPAGE
+        """
+        block = [MALE, FEMALE].index(sex_insured)
+        if self.generation:
+            block = block * UPAGE + int(age_insured)
+        return block * (UPAGE - LOWAGE) + np.asarray(ages, dtype=int) - LOWAGE
+
+    def get_lookup_items(self):
+        """ Returns dict with intrest independent items of the lookup table.
+
+        'gender', 'age': sex and age per row
+        'cohort': age of the insured in the base year per row (generation tables only)
+        'cf_ay_avg': matrix with cash flows of ay_avg per row
+        'hx_avg', 'alpha1', 'factor': arrays
+        """
+        def build():
+            sexes, ages = [MALE, FEMALE], np.arange(LOWAGE, UPAGE)
+            cohorts = self.lookup_cohorts()
+            # rows per sex: one per age, or per (cohort, age) for generation tables
+            row_ages, row_cohorts = ages, None
+            if cohorts is not None:
+                row_ages, row_cohorts = np.tile(ages, len(cohorts)), np.repeat(cohorts, len(ages))
+            nrows = len(row_ages)
+            hx = np.vstack([self.hx[sex]['hx'].values for sex in sexes])
+            partner = self.adjust[:, ADJUSTMENT_TYPES.index('partner')]
+            items = {'gender': np.repeat(sexes, nrows),
+                     'age': np.tile(row_ages, len(sexes)),
+                     'cf_ay_avg': np.vstack([self.ay_avg_rows(row_ages, sex, row_cohorts)
+                                             for sex in sexes]),
+                     'hx_avg': ((hx[:, row_ages] + hx[:, row_ages + 1]) / 2.).ravel(),
+                     'alpha1': np.repeat(partner['CX1'], nrows),
+                     'factor': np.repeat(partner['fnett'] * partner['fcorr'] * partner['fOTS'],
+                                         nrows)}
+            if row_cohorts is not None:
+                items['cohort'] = np.tile(row_cohorts, len(sexes))
+            return items
+        return self.database.memoize(('lookup_items',) + self.table_key(), build)
+
+    @instrumented
     def create_lookup_table(self, intrest):
-        """ Returns a lookup table with age/sex dependent items for undefined partner.
+        """ Returns a lookup table with age/sex dependent items for undefined partner,
+        indexed by gender and age (gender, cohort and age for generation tables).
 
         Parameters:
         -----------
-        intrest: int, float of Series.
-        """
-
-        s = pd.DataFrame({'gender': (UPAGE - LOWAGE) * [MALE] +
-                         (UPAGE - LOWAGE) * [FEMALE],
-                         'age': range(LOWAGE, UPAGE) + range(LOWAGE, UPAGE)
-                          })
-        s['ay_avg'] = s.apply(lambda row: self.ay_avg(row['age'],
-                              row['gender'], intrest), axis=1)
-        s['hx_avg'] = s.apply(lambda row: (self.hx[row['gender']].ix[row['age']].values[0] +
-                                           self.hx[row['gender']].ix[row['age'] + 1].values[0]) / 2., axis=1)
-        s['alpha1'] = s.apply(lambda row: self.adjust[row['gender']]['partner']['CX1'], axis=1)
-        s['factor'] = s.apply(lambda row: self.adjust[row['gender']]['partner']['fnett'] *
-                              self.adjust[row['gender']]['partner']['fcorr'] *
-                              self.adjust[row['gender']]['partner']['fOTS'],
-                              axis=1)
+        intrest: YieldCurve, int, float or Series.
+        """
+        items = self.get_lookup_items()
+        index = [name for name in ('gender', 'cohort', 'age') if name in items]
+        s = pd.DataFrame({name: items[name] for name in index}, columns=index)
+        s['ay_avg'] = self.pv_batch(items['cf_ay_avg'], intrest, 'whole')
+        s['hx_avg'] = items['hx_avg']
+        s['alpha1'] = items['alpha1']
+        s['factor'] = items['factor']
         s['cf'] = s['ay_avg'] * s['hx_avg'] * s['factor']
-        s.set_index(['gender', 'age'], inplace=True)
+        s.set_index(index, inplace=True)
         return s
 
+    @instrumented
+    def lookup_table(self, intrest):
+        """ Returns cached lookup table for undefined partner, see create_lookup_table.
+
+        Tables are kept in a LRU cache shared by all tables in the database,
+        keyed by the table parameters and a fingerprint of the yield curve.
+
+        Parameters:
+        -----------
+        intrest: YieldCurve, int, float or Series.
+        """
+        key = self.table_key() + (curve_fingerprint(intrest),)
+        return self.database.lookups.get(key, lambda: self.create_lookup_table(intrest))
+
+    @instrumented
     def cf_retirement_pension(self, age_insured, sex_insured,
                               pension_age, **kwargs):
         """ Returns expected payments retirement pension.
@@ -202,20 +376,42 @@ class LifeTable(object):
         """
         postnumerando = (kwargs['postnumerando'] if
                          'postnumerando' in kwargs else False)
-        tbl_insured = self.lx[sex_insured]['lx']
-        alpha1 = self.adjust[sex_insured]['retire']['CX1']
-        alpha2 = self.adjust[sex_insured]['retire']['CX2']
-        fnett, fcorr, fOTS = (self.adjust[sex_insured]['retire'][item]
-                              for item in ['fnett', 'fcorr', 'fOTS'])
-        cf = self.cf_annuity(age_insured + alpha2, tbl_insured,
-                             defer=pension_age - age_insured + postnumerando)
+        adjustment = self.adjustment(sex_insured, 'retire')
+        alpha1, alpha2 = adjustment.CX1, adjustment.CX2
+        fnett, fcorr, fOTS = adjustment.fnett, adjustment.fcorr, adjustment.fOTS
+        cf = self.engine.annuity(age_insured + alpha2, sex_insured,
+                                 defer=pension_age - age_insured + postnumerando,
+                                 cohort=age_insured)
         cf = cf * self.npx(age_insured + alpha1, sex_insured,
-                           pension_age - age_insured)
+                           pension_age - age_insured, age_insured)
         cf = cf / self.npx(age_insured + alpha2, sex_insured,
-                           pension_age - age_insured)
+                           pension_age - age_insured, age_insured)
         cf = prae_to_continuous(cf)
-        return {'payments': cf * fnett * fcorr * fOTS}
+        return {'payments': to_payments(cf * fnett * fcorr * fOTS)}
+
+    @instrumented
+    def retirement_pension_rows(self, ages, sex_insured, pension_age):
+        """ Returns matrix (ages x years) with the cf_retirement_pension
+        payments of all given ages at once.
 
+        Parameters:
+        -----------
+        ages: array of int
+        sex_insured: either 'M' of 'F'
+        pension_age: int
+        """
+        adjustment = self.adjustment(sex_insured, 'retire')
+        alpha1, alpha2 = adjustment.CX1, adjustment.CX2
+        fnett, fcorr, fOTS = adjustment.fnett, adjustment.fcorr, adjustment.fOTS
+        ages = np.asarray(ages)
+        defer = pension_age - ages
+        cf = self.engine.annuities(ages + alpha2, sex_insured, defer, cohort=ages)
+        cf = cf * self.npx(ages + alpha1, sex_insured, defer, ages)[:, np.newaxis]
+        cf = cf / self.npx(ages + alpha2, sex_insured, defer, ages)[:, np.newaxis]
+        cf = prae_to_continuous_rows(cf)
+        return cf * fnett * fcorr * fOTS
+
+    @instrumented
     def cf_defined_partner(self, age_insured, sex_insured,
                            pension_age, **kwargs):
         """ Returns expected payments partner pension (defined partner).
@@ -225,44 +421,90 @@ class LifeTable(object):
         age_insured: int
         sex_insured: either 'M' of 'F'
         pension_age: int
+
+        cohort: int. Age of the insured in the base year of a generation
+        table, for payments of an insured reaching age_insured later on.
+        Default age_insured.
         """
         assert sex_insured in (MALE, FEMALE), "sex insured should be either M of F!"
         sex_beneficiary = FEMALE if sex_insured == MALE else MALE
-        tbl_insured = self.lx[sex_insured]['lx']
-        tbl_beneficiary = self.lx[sex_beneficiary]['lx']
         delta = int(self.params['delta'])
-        fnett, fcorr, fOTS = (self.adjust[sex_insured]['partner'][item]
-                              for item in ['fnett', 'fcorr', 'fOTS'])
-        alpha1 = self.adjust[sex_insured]['partner']['CX1']
-        alpha2 = self.adjust[sex_insured]['partner']['CX2']
-        gamma3 = self.adjust[sex_beneficiary]['partner']['CX3']
+        adjustment = self.adjustment(sex_insured, 'partner')
+        fnett, fcorr, fOTS = adjustment.fnett, adjustment.fcorr, adjustment.fOTS
+        alpha1, alpha2 = adjustment.CX1, adjustment.CX2
+        gamma3 = self.adjustment(sex_beneficiary, 'partner').CX3
         sign = 1 if sex_insured == MALE else -1
-        ay = self.cf_annuity(age_insured - sign * delta + gamma3,
-                             tbl_beneficiary)
-        ax = self.cf_annuity(age_insured + alpha1, tbl_insured)
-        axy = ax.multiply(ay)
-        f1 = self.cf_annuity(age_insured + alpha1, tbl_insured,
-                             pension_age - age_insured)
-        f1 = f1 * self.cf_annuity(age_insured - sign * delta + gamma3,
-                                  tbl_beneficiary, pension_age - age_insured)
-        f2 = self.cf_annuity(age_insured + alpha2,
-                             tbl_insured, pension_age - age_insured)
-        f2 = f2 * self.cf_annuity(age_insured - sign * delta + gamma3,
-                                  tbl_beneficiary, pension_age - age_insured)
-        temp1 = ((float(tbl_insured.ix[pension_age + alpha1]) /
-                 tbl_insured.ix[age_insured + alpha1]))
-        temp2 = ((float(tbl_insured.ix[age_insured + alpha2]) /
-                 tbl_insured.ix[pension_age + alpha2]))
+        age_beneficiary = age_insured - sign * delta + gamma3
+        defer = pension_age - age_insured
+        # age corrections shift the ages, not the birth years
+        cohort = kwargs.get('cohort', age_insured)
+        cohort_beneficiary = cohort - sign * delta
+
+        def build():
+            joint_annuity = self.engine.joint_annuity
+            ay = self.engine.annuity(age_beneficiary, sex_beneficiary, cohort=cohort_beneficiary)
+            axy = joint_annuity(age_insured + alpha1, sex_insured,
+                                age_beneficiary, sex_beneficiary, 0, cohort, cohort_beneficiary)
+            f1 = joint_annuity(age_insured + alpha1, sex_insured,
+                               age_beneficiary, sex_beneficiary, defer, cohort, cohort_beneficiary)
+            f2 = joint_annuity(age_insured + alpha2, sex_insured,
+                               age_beneficiary, sex_beneficiary, defer, cohort, cohort_beneficiary)
+            temp1 = self.npx(age_insured + alpha1, sex_insured, defer, cohort)
+            temp2 = 1. / self.npx(age_insured + alpha2, sex_insured, defer, cohort)
+            f2 = f2 * temp1 * temp2
+            return fnett * fcorr * fOTS * (ay - axy + (f1 - f2))
+
+        key = ('defined_partner', int(age_insured), sex_insured, int(pension_age),
+               self.engine.cohort_key(age_insured, cohort),
+               alpha1, alpha2, gamma3, delta, fnett, fcorr, fOTS)
+        return {'payments': to_payments(self.engine.memoize(key, build))}
+
+    @instrumented
+    def defined_partner_rows(self, ages, sex_insured, pension_age, cohorts=None):
+        """ Returns matrix (ages x years) with the cf_defined_partner payments
+        of all given ages at once.
+
+        Parameters:
+        ----------
+        ages: array of int
+        sex_insured: either 'M' of 'F'
+        pension_age: int
+        cohorts: array of int, age of the insured in the base year of a
+        generation table per age. Default ages.
+        """
+        assert sex_insured in (MALE, FEMALE), "sex insured should be either M of F!"
+        sex_beneficiary = FEMALE if sex_insured == MALE else MALE
+        delta = int(self.params['delta'])
+        adjustment = self.adjustment(sex_insured, 'partner')
+        fnett, fcorr, fOTS = adjustment.fnett, adjustment.fcorr, adjustment.fOTS
+        alpha1, alpha2 = adjustment.CX1, adjustment.CX2
+        gamma3 = self.adjustment(sex_beneficiary, 'partner').CX3
+        sign = 1 if sex_insured == MALE else -1
+        ages = np.asarray(ages)
+        cohorts = ages if cohorts is None else np.asarray(cohorts)
+        ages_beneficiary = ages - sign * delta + gamma3
+        cohorts_beneficiary = cohorts - sign * delta
+        defer = pension_age - ages
+
+        annuities = self.engine.annuities
+        ay = annuities(ages_beneficiary, sex_beneficiary, cohort=cohorts_beneficiary)
+        axy = annuities(ages + alpha1, sex_insured, cohort=cohorts) * ay
+        ay_deferred = annuities(ages_beneficiary, sex_beneficiary, defer, cohorts_beneficiary)
+        f1 = annuities(ages + alpha1, sex_insured, defer, cohorts) * ay_deferred
+        f2 = annuities(ages + alpha2, sex_insured, defer, cohorts) * ay_deferred
+        temp1 = self.npx(ages + alpha1, sex_insured, defer, cohorts)[:, np.newaxis]
+        temp2 = 1. / self.npx(ages + alpha2, sex_insured, defer, cohorts)[:, np.newaxis]
         f2 = f2 * temp1 * temp2
-        out = fnett * fcorr * fOTS * (ay - axy + (f1 - f2))
-        return {'payments': out}
+        return fnett * fcorr * fOTS * (ay - axy + (f1 - f2))
 
+    @instrumented
     def cf_undefined_partner(self, age_insured, sex_insured,
                              pension_age, **kwargs):
         """ Returns expected payments partner pension (undefined partner).
 
-        TO DO: intrest or yield curve really required to get cash flows
-        undefined partner?
+        Payments till retirement depend on intrest through ay_avg in the
+        lookup table. Use interest_free_cashflows to generate the factor
+        grid once for all interest bases.
 
         Parameters:
         ----------
@@ -284,57 +526,100 @@ class LifeTable(object):
             print("{0} {1}".format(msg1, msg2))
             intrest = 3  # default = 3 pct intrest rate!
 
-        hx_pd = kwargs.get('hx_pd', None)
+        hx_at_pensionage = self.hx_at_pensionage(sex_insured, pension_age,
+                                                 kwargs.get('hx_pd', None),
+                                                 kwargs.get('intrest', None))
+
+        # cf till retirement
+        lookup = self.lookup_table(intrest)
+        parts = self.undefined_partner_parts(age_insured, sex_insured,
+                                             pension_age, hx_at_pensionage)
+        lookup_rows = self.lookup_rows(sex_insured, age_insured, parts['ages'])
+        cf_till_pension_age = lookup['cf'].values[lookup_rows] * parts['nq']
+        cf = to_payments(np.append(cf_till_pension_age, parts['after']))
+        return {'age': age_insured, 'pension_age': pension_age, 'payments': cf}
+
+    def hx_at_pensionage(self, sex_insured, pension_age, hx_pd=None, intrest=None):
+        """ Returns probability of having a partner at pension age.
+
+        Parameters:
+        ----------
+        sex_insured: either 'M' of 'F'
+        pension_age: int
+        hx_pd: either 'None' for non-exchangable, 'one' for exchangable
+        or 'ukv' for Aegon methodology (depreciated).
+        intrest: int or float. Only used for hx_pd = 'ukv'.
+        """
         # by default, undefined partner pension is assumed to be exchangable
         if (hx_pd is None) or (hx_pd == 'one'):
-            hx_at_pensionage = 1
+            return 1
         elif hx_pd == 'ukv':
+            if isinstance(intrest, YieldCurve):
+                intrest = intrest.flat_rate
             try:
-                hx_at_pensionage = self.ukv.ix[(sex_insured, pension_age,
-                                                kwargs['intrest'])].values[0]
+                return self.ukv.ix[(sex_insured, pension_age, intrest)].values[0]
             except:
                 print('Undefined partner cashflows require UKV -- defaults hx_pd = 1')
-                hx_at_pensionage = 1
-        else:
-            hx_at_pensionage = self.hx[sex_insured]['hx'].ix[pension_age]
+                return 1
+        return self.hx[sex_insured]['hx'].ix[pension_age]
 
-        fnett, fcorr, fOTS = (self.adjust[sex_insured]['partner'][item]
-                              for item in ['fnett', 'fcorr', 'fOTS'])
+    def undefined_partner_parts(self, age_insured, sex_insured,
+                                pension_age, hx_at_pensionage=1):
+        """ Returns intrest independent parts of undefined partner cash flows.
 
-        # cf till retirement
-        if intrest == self.intrest:
-            lookup = self.lookup
+        Payments till retirement equal the lookup table cash flow at ages
+        'ages' times the probabilities 'nq'; payments from retirement
+        onwards are given by 'after'.
+
+        Parameters:
+        ----------
+        age_insured: int
+        sex_insured: either 'M' of 'F'
+        pension_age: int
+        hx_at_pensionage: float. Default 1.
+        """
+        alpha1 = self.adjustment(sex_insured, 'partner').CX1
+        ages = np.arange(max(age_insured, LOWAGE), min(pension_age, UPAGE))
+        nyears = ages - age_insured  # we need [k]q[current_age]
+        nq_current_age = self.nqx(age_insured + alpha1, sex_insured, nyears + 1, age_insured)
+        prob = self.npx(age_insured + alpha1, sex_insured, pension_age - age_insured, age_insured)
+        # valued at pension age, with the survivors of the insured's own cohort
+        cf_defined_partner = self.cf_defined_partner(pension_age, sex_insured, pension_age,
+                                                     cohort=age_insured)
+        cf_after_pension_age = hx_at_pensionage * prob * cf_defined_partner['payments'].values
+        return {'ages': ages, 'nq': nq_current_age, 'after': cf_after_pension_age}
+
+    def undefined_partner_rows(self, ages, sex_insured, pension_age, hx_at_pensionage=1):
+        """ Returns list with undefined_partner_parts of all given ages,
+        sharing the defined partner payments from pension age (one row per
+        cohort for generation tables) and taking all probabilities in one pass.
+
+        Parameters:
+        ----------
+        ages: array of int
+        sex_insured: either 'M' of 'F'
+        pension_age: int
+        hx_at_pensionage: float. Default 1.
+        """
+        alpha1 = self.adjustment(sex_insured, 'partner').CX1
+        ages = np.asarray(ages)
+        lookup_ages = [np.arange(max(age, LOWAGE), min(pension_age, UPAGE)) for age in ages]
+        lengths = [len(item) for item in lookup_ages]
+        insured = np.repeat(ages, lengths)
+        nyears = np.concatenate(lookup_ages + [np.zeros(0, dtype=int)]) - insured
+        nq = np.split(self.nqx(insured + alpha1, sex_insured, nyears + 1, insured),
+                      np.cumsum(lengths)[:-1])
+        prob = self.npx(ages + alpha1, sex_insured, pension_age - ages, ages)
+        if self.generation:
+            # valued at pension age, with the survivors of each insured's own cohort
+            payments = self.defined_partner_rows(np.full(len(ages), pension_age), sex_insured,
+                                                 pension_age, cohorts=ages)
         else:
-            lookup = self.create_lookup_table(intrest)
-            self.lookup = lookup
-            self.intrest = intrest
-
-        cf_till_pension_age = (lookup.ix[sex_insured].
-                               ix[age_insured:pension_age - 1])
-        current_age = age_insured  # we need [k]q[current_age]
-        cf_till_pension_age['age'] = cf_till_pension_age.index
-        nq_current_age = cf_till_pension_age.apply(lambda row:
-                                                   self.nqx(current_age + row['alpha1'],
-                                                            sex_insured,
-                                                            row['age'] - current_age + 1),
-                                                   axis=1)
-        cf_till_pension_age = cf_till_pension_age['cf'] * nq_current_age
-        cf_till_pension_age = pd.DataFrame(cf_till_pension_age, columns=['cf'])
-
-        # cf after retirement
-        prob = self.npx(age_insured + lookup['alpha1'].loc[(sex_insured, age_insured)], sex_insured, pension_age - age_insured)
-        cf_defined_partner = self.cf_defined_partner(pension_age, sex_insured, pension_age)
-        cf_after_pension_age = hx_at_pensionage * prob * cf_defined_partner['payments']
-        cf_after_pension_age = pd.DataFrame(cf_after_pension_age, columns=['cf'])
-        cf_after_pension_age['age'] = cf_after_pension_age.index + pension_age
-        cf_after_pension_age.set_index('age', inplace=True)
-        cf = cf_till_pension_age.append(cf_after_pension_age)
-        cf = pd.DataFrame(cf)
-        cf['year'] = range(len(cf))
-        cf.set_index('year', inplace=True)
-        cf = pd.Series(cf['cf'])
-        return {'age': age_insured, 'pension_age': pension_age, 'payments': cf}
+            payments = self.cf_defined_partner(pension_age, sex_insured, pension_age)['payments'].values
+        after = (hx_at_pensionage * prob)[:, np.newaxis] * payments
+        return [{'ages': lookup_ages[i], 'nq': nq[i], 'after': after[i]} for i in range(len(ages))]
 
+    @instrumented
     def cf_defined_one_year_risk(self, age_insured, sex_insured, pension_age, **kwargs):
         """ Ruturns expected cashflows one year risk premium (defined partner).
 
@@ -345,20 +630,19 @@ class LifeTable(object):
         sex_insured: either 'M' of 'F'
         pension_age: int
         """
-        # alpha1 = self.adjust[sex_insured]['risk']['CX1']
-        # fnett, fcorr, fOTS = (self.adjust[sex_insured]['risk'][item]
-        #                      for item in ['fnett', 'fcorr', 'fOTS'])
+        # adjustment = self.adjustment(sex_insured, 'risk')
         #  --- risk premiums are considered to be part of partnerpension, so its adjustments are used! ---
-        alpha1 = self.adjust[sex_insured]['partner']['CX1']
-        fnett, fcorr, fOTS = (self.adjust[sex_insured]['partner'][item]
-                              for item in ['fnett', 'fcorr', 'fOTS'])
+        adjustment = self.adjustment(sex_insured, 'partner')
+        alpha1 = adjustment.CX1
+        fnett, fcorr, fOTS = adjustment.fnett, adjustment.fcorr, adjustment.fOTS
         assert sex_insured in (MALE, FEMALE), "sex insured should be either M of F!"
 
         cf = self.cf_ay_avg(age_insured, sex_insured, insurance_type='partner')
-        qx = self.qx(age_insured + alpha1, sex_insured)
+        qx = self.qx(age_insured + alpha1, sex_insured, age_insured)
         cf = cf['payments'] * qx * fnett * fcorr * fOTS
         return {'insurance_id': 'NPTL-B', 'payments': cf}
 
+    @instrumented
     def cf_undefined_one_year_risk(self, age_insured, sex_insured, pension_age, **kwargs):
         """ Ruturns expected cashflows one year risk premium (undefined partner).
 
@@ -370,11 +654,13 @@ class LifeTable(object):
         pension_age: int
         """
 
-        hx_avg = (self.hx[sex_insured].ix[age_insured].values[0] + self.hx[sex_insured].ix[age_insured + 1].values[0]) / 2.
+        hx = self.hx[sex_insured]['hx'].values
+        hx_avg = (hx[int(age_insured)] + hx[int(age_insured) + 1]) / 2.
         cf_defined_one_year_risk = self.cf_defined_one_year_risk(age_insured, sex_insured, pension_age, **kwargs)
         cf = hx_avg * cf_defined_one_year_risk['payments']
         return {'insurance_id': 'NPTL-O', 'payments': cf}
 
+    @instrumented(label=lambda self, insurance_id, *args, **kwargs: 'cf[{0}]'.format(insurance_id))
     def cf(self, insurance_id, age_insured, sex_insured, pension_age, **kwargs):
         """ Returns cash flows for given insurance type.
 
@@ -385,14 +671,17 @@ class LifeTable(object):
         sex_insured: either 'M' of 'F'
         pension_age: int
 
-        intrest: int, float or Series. Optional. Default 3pct.
+        intrest: YieldCurve, int, float or Series. Optional. Default 3pct.
         """
 
         switcher = {'OPLL': {'call': self.cf_retirement_pension, 'hx_pd': None},
                     'NPLL-B': {'call': self.cf_defined_partner, 'hx_pd': None},
-                    'NPLL-O': {'call': self.cf_undefined_partner, 'hx_pd': 'non-exchangable'},
-                    'NPLLRS': {'call': self.cf_undefined_partner, 'hx_pd': 'one'},
-                    'NPLLRU': {'call': self.cf_undefined_partner, 'hx_pd': 'ukv'},
+                    'NPLL-O': {'call': self.cf_undefined_partner,
+                               'hx_pd': UNDEFINED_PARTNER['NPLL-O']},
+                    'NPLLRS': {'call': self.cf_undefined_partner,
+                               'hx_pd': UNDEFINED_PARTNER['NPLLRS']},
+                    'NPLLRU': {'call': self.cf_undefined_partner,
+                               'hx_pd': UNDEFINED_PARTNER['NPLLRU']},
                     'NPTL-B': {'call': self.cf_defined_one_year_risk, 'hx_pd': None},
                     'NPTL-O': {'call': self.cf_undefined_one_year_risk, 'hx_pd': None},
                     'ay_avg': {'call': self.cf_ay_avg, 'hx_pd': None}
@@ -406,44 +695,78 @@ class LifeTable(object):
                                                              **kwargs))
         return out
 
+    @instrumented(label=lambda self, cf, *args, **kwargs: 'pv[{0}]'.format(
+        'cube' if isinstance(cf, CashflowCube) else cf['insurance_id']))
     def pv(self, cf, intrest):
         """ Returns present value of cash flows.
 
         Parameters:
         -----------
         cf: dict {'insurance_id: str, 'payments': series, 'age': int, 'pension_age': int}
-        intrest: int, float or series
+        or CashflowCube, valued at once into an array (insurance_id x sex x age)
+        intrest: YieldCurve, int, float or series
         """
-        cfs = cf['payments']
+        if isinstance(cf, CashflowCube):
+            if cf.interest_free:
+                cf = cf.resolve(self.lookup_table(intrest)['cf'].values)
+            values = self.pv_batch(cf.matrix(), intrest, cf.timing(), cf.deferral())
+            return values.reshape(cf.shape[:3])
         insurance_id = cf['insurance_id']
-        year = pd.Series(cfs.index)
-        self.yield_curve = x_to_series(intrest, len(cfs))
-
-        if insurance_id in ['OPLL', 'NPLL-B', 'ay_avg']:
-            pv_factors = self.yield_curve.map(lambda r: 1. / (1 + r / 100.))**year
-        elif insurance_id in ['NPTL-B', 'NPTL-O']:
-            pv_factors = self.yield_curve.map(lambda r: 1. / (1 + r / 100.))**(year + 0.5)
-        elif insurance_id in ['NPLL-O', 'NPLLRS', 'NPLLRU']:
-            nyears_till_pension_age = cf['pension_age'] - cf['age']
-            year = year + 0.5 * (year <= nyears_till_pension_age)
-            pv_factors = self.yield_curve.map(lambda r: 1. / (1 + r / 100.))**year
-        else:
-            print("---ERROR: cannot process insurance_id: {0}".format(insurance_id))
+        if insurance_id not in TIMING:
+            raise ValueError("cannot process insurance_id: {0}".format(insurance_id))
+        deferral = cf['pension_age'] - cf['age'] if TIMING[insurance_id] == 'mixed' else None
+        return self.pv_batch(cf['payments'].values[np.newaxis, :], intrest,
+                             [TIMING[insurance_id]], deferral)[0]
 
-        present_value = sum(cfs * pv_factors)
-        rounding = self.params['round']
-        return round(present_value, rounding)
+    @instrumented
+    def pv_batch(self, cashflows, intrest, timing, deferral=None):
+        """ Returns present values of a cash flow matrix in one pass.
 
-    def run_test(self):
+        Parameters:
+        -----------
+        cashflows: 2-D array (policies x years)
+        intrest: YieldCurve, int, float or series
+        timing: array of str per row: 'whole' (whole year), 'mid' (mid-year)
+        or 'mixed' (mid-year till pension age, whole year thereafter)
+        deferral: array of int with years till pension age per row.
+        Required for 'mixed' rows only.
+        """
+        return present_values(cashflows, intrest, timing, deferral,
+                              rounding=self.params['round'])
+
+    @instrumented
+    def pv_cashflows(self, cfs, intrest):
+        """ Returns array with present value of each cash flow dict.
+
+        Parameters:
+        -----------
+        cfs: list of dicts as returned by cf()
+        intrest: YieldCurve, int, float or series
+        """
+        insurance_ids = [cf['insurance_id'] for cf in cfs]
+        deferral = [cf['pension_age'] - cf['age'] if 'pension_age' in cf else 0
+                    for cf in cfs]
+        cashflows = to_matrix([cf['payments'].values for cf in cfs])
+        return self.pv_batch(cashflows, intrest, insurance_timing(insurance_ids), deferral)
+
+    @instrumented
+    def run_test(self, cache=True):
         """ Performs tariff calulations om testdata.
 
         Parameters:
         ----------
-        d: dict.
+        cache: boolean. Take results from (and store them in) the result
+        cache, if the table has one. Default True.
         """
         msg1, msg2, msg3 = ("Generating cash flows...please wait...",
                             "Calculating present value of cash flows...",
                             "Sum of Errors Squared = ")
+        key = self.result_key('run_test') if cache and self.results is not None else None
+        cached = self.results.get(key) if key is not None else None
+        if cached is not None:
+            print(msg3),
+            print(sum(cached['difference'] * cached['difference']))
+            return cached
         print(msg1)
         testdata = self.testdata
         map_to_cashflows = lambda row: self.cf(insurance_id=row['insurance_id'],
@@ -451,16 +774,19 @@ class LifeTable(object):
                                                sex_insured=row['sex'],
                                                pension_age=row['pension_age'],
                                                intrest=row['intrest'])
-        map_to_present_value = lambda row: self.pv(cf=row['cf'], intrest=row['intrest'])
 
         testdata['cf'] = testdata.apply(map_to_cashflows, axis=1)
         print(msg2)
-        testdata['calculated'] = testdata.apply(map_to_present_value, axis=1)
+        testdata['calculated'] = np.nan
+        for intrest, group in testdata.groupby('intrest'):
+            testdata.loc[group.index, 'calculated'] = self.pv_cashflows(list(group['cf']), intrest)
         testdata['difference'] = testdata['test_value'] - testdata['calculated']
         del testdata['cf']
         error_squared = sum(testdata['difference'] * testdata['difference'])
         print(msg3),
         print(error_squared)
+        if key is not None:
+            self.results.put(key, testdata, tariff=self.tablename, checksum=self.database.checksum)
         return testdata
 
     def performance_test(self):
@@ -482,78 +808,417 @@ class LifeTable(object):
             calculated = self.pv(cfs, row.intrest)
             print("#{0} -- {1} -- {2}".format(row.Index, row.insurance_id, row.test_value - calculated))
 
-    def calculate_cashflows(self, pension_age, intrest=3):
-        """ Returns table with cashflows per insurance_id and age.
+    @contextmanager
+    def instrument(self, stats=None, memory=False):
+        """ Context manager recording call counts, wall time and (optionally)
+        allocations of the hot paths of this table and its database, together
+        with the hit ratios of the lookup and building block caches.
+
+        >> with table.instrument() as stats:
+        ..     table.calculate_factors(3)
+        >> stats.to_json()
+
+        Parameters:
+        -----------
+        stats: Stats. Optional. Default a new Stats object.
+        memory: boolean. Record allocations (needs tracemalloc). Default False.
+        """
+        stats = stats if stats is not None else Stats(memory=memory)
+        previous = self.stats, self.database.stats
+        self.stats = self.database.stats = stats
+        stats.watch('lookup_tables', self.database.lookups)
+        stats.watch('building_blocks', self.engine.memo)
+        stats.start()
+        try:
+            yield stats
+        finally:
+            stats.stop()
+            self.stats, self.database.stats = previous
+
+    def is_calculated(self, intrest, pension_age):
+        """ Returns True if cash flows are available for given intrest and pension_age.
+
+        Parameters:
+        -----------
+        intrest: YieldCurve, int, float or Series.
+        pension_age: int.
+        """
+        return (self.cfs is not None and pension_age == self.pension_age and
+                curve_fingerprint(intrest) == curve_fingerprint(self.intrest))
+
+    def cube_key(self, pension_age):
+        """ Returns key of the interest independent cash flow cube.
 
         Parameters:
         -----------
         pension_age: int
-        intrest: int, float or Series. Default 3 pct.
         """
+        return fingerprint('cashflows', self.tablename, self.table_key(), self.params['ukv'],
+                           int(pension_age), INSURANCE_IDS, LOWAGE, UPAGE,
+                           self.database.checksum)
 
-        # create table layout with all desired tariff combinations
-        df = cartesian(lists=[INSURANCE_IDS, [MALE, FEMALE], range(LOWAGE, UPAGE)],
-                       colnames=['insurance_id', 'sex_insured', 'age_insured'])
+    def result_key(self, kind, *parts):
+        """ Returns key of a result in the result cache: a fingerprint of
+        everything the result depends on.
 
-        # generate cashflows
-        def map_to_cf(row):
-            return self.cf(insurance_id=row['insurance_id'],
-                           age_insured=row['age_insured'],
-                           sex_insured=row['sex_insured'],
-                           pension_age=pension_age,
-                           intrest=intrest)
-        df['cf'] = df.apply(map_to_cf, axis=1)
+        Parameters:
+        -----------
+        kind: str, e.g. 'factors' or 'run_test'
+        parts: further inputs, e.g. pension age and curve fingerprint
+        """
+        return fingerprint('result', RESULT_VERSION, kind, self.tablename, self.table_key(),
+                           self.params['ukv'], INSURANCE_IDS, LOWAGE, UPAGE,
+                           self.database.checksum, *parts)
+
+    def interest_free_cashflows(self, pension_age):
+        """ Returns CashflowCube with the interest independent cash flows
+        of the factor grid.
+
+        Undefined partner payments till retirement depend on the interest
+        basis through ay_avg in the lookup table; these are kept as
+        deferred parts of the cube, see CashflowCube.resolve. Cubes are
+        cached in the database and, with a cube store, memory-mapped from
+        disk instead of regenerated.
+
+        Parameters:
+        -----------
+        pension_age: int
+        """
+        key = self.cube_key(pension_age)
+
+        def build():
+            cube = self.store.get(key) if self.store is not None else None
+            if cube is None:
+                cube = self.create_interest_free_cashflows(pension_age)
+                if self.store is not None:
+                    self.store.put(key, cube, tariff=self.tablename,
+                                   checksum=self.database.checksum)
+            return cube
+        return self.database.cubes.get(key, build)
+
+    @instrumented
+    def create_interest_free_cashflows(self, pension_age):
+        """ Returns CashflowCube with the interest independent cash flows
+        of the factor grid, see interest_free_cashflows.
+
+        Parameters:
+        -----------
+        pension_age: int
+        """
+        sexes, ages = [MALE, FEMALE], range(LOWAGE, UPAGE)
+        rows, deferred = [], []
+        shared = self.pension_age_free_rows()
+        # payments depending on the deferral, all ages at once
+        vectorized = {'OPLL': self.retirement_pension_rows, 'NPLL-B': self.defined_partner_rows}
+        blocks = {(insurance_id, sex): func(np.array(ages), sex, pension_age)
+                  for insurance_id, func in vectorized.items() if insurance_id in INSURANCE_IDS
+                  for sex in sexes}
+        undefined = {(insurance_id, sex): self.undefined_partner_rows(
+                         np.array(ages), sex, pension_age,
+                         self.hx_at_pensionage(sex, pension_age, UNDEFINED_PARTNER[insurance_id]))
+                     for insurance_id in UNDEFINED_PARTNER if insurance_id in INSURANCE_IDS
+                     for sex in sexes}
+        grid = ((insurance_id, sex, age) for insurance_id in INSURANCE_IDS
+                for sex in sexes for age in ages)
+        for i, (insurance_id, sex, age) in enumerate(grid):
+            if (insurance_id, sex, age) in shared:
+                rows.append(shared[(insurance_id, sex, age)])
+            elif (insurance_id, sex) in blocks:
+                rows.append(blocks[(insurance_id, sex)][age - LOWAGE])
+            elif (insurance_id, sex) in undefined:
+                parts = undefined[(insurance_id, sex)][age - LOWAGE]
+                rows.append(np.append(np.zeros(len(parts['ages'])), parts['after']))
+                deferred.append((i, self.lookup_rows(sex, age, parts['ages']), parts['nq']))
+            else:
+                rows.append(self.cf(insurance_id, age, sex, pension_age)['payments'].values)
+        return CashflowCube.from_rows(rows, INSURANCE_IDS, sexes, ages, pension_age, deferred)
+
+    @instrumented
+    def calculate_cashflows(self, pension_age, intrest=3):
+        """ Returns CashflowCube with cash flows per insurance_id, sex and age.
+
+        Only the undefined partner payments till retirement are recomputed
+        for another interest basis, see interest_free_cashflows.
+
+        Parameters:
+        -----------
+        pension_age: int
+        intrest: YieldCurve, int, float or Series. Default 3 pct.
+        """
+        cube = self.interest_free_cashflows(pension_age)
+        cube = cube.resolve(self.lookup_table(intrest)['cf'].values)
         self.intrest = intrest
         self.pension_age = pension_age
-        self.cfs = df
-        return df
+        self.cfs = cube
+        return cube
+
+    def factor_frame(self, cube, intrest):
+        """ Returns DataFrame with column 'tar' indexed by insurance_id,
+        sex_insured and age_insured.
+
+        Parameters:
+        -----------
+        cube: CashflowCube
+        intrest: YieldCurve, int, float or Series.
+        """
+        factors = cube.labels()
+        factors['tar'] = self.pv(cube, intrest).ravel()
+        factors.set_index(CashflowCube.colnames, inplace=True)
+        return factors
 
-    def calculate_factors(self, intrest, pension_age=67):
+    @instrumented
+    def calculate_factors(self, intrest, pension_age=67, cache=True):
         """ Returns factors.
 
+        With a result cache, factors calculated before (by any process
+        sharing the cache) are read from it; the cash flows are then not
+        calculated.
+
         Parameters:
         -----------
-        intrest: int, float or Series.
-        pension_age: int. Default 67 year.
+        intrest: YieldCurve, int, float or Series.
+        pension_age: int, or list or range of int, see calculate_pension_ages.
+        Default 67 year.
+        cache: boolean. Take factors from (and store them in) the result
+        cache, if the table has one. Default True.
         """
-        if (intrest == self.intrest) and (pension_age == self.pension_age):
-            factors = self.cfs
-        else:
+        if not np.isscalar(pension_age):
+            return self.calculate_pension_ages(intrest, pension_age, cache)
+        key = None
+        if cache and self.results is not None:
+            key = self.result_key('factors', int(pension_age), curve_fingerprint(intrest))
+            factors = self.results.get(key)
+            if factors is not None:
+                if not self.is_calculated(intrest, pension_age):
+                    self.cfs = self.intrest = self.pension_age = None
+                self.factors = factors
+                return factors
+        if not self.is_calculated(intrest, pension_age):
             self.cfs = self.calculate_cashflows(intrest=intrest, pension_age=pension_age)
-            factors = self.cfs.copy(deep=True)
-        factors['tar'] = factors.apply(lambda row: self.pv(row['cf'], intrest=intrest), axis=1)
-        factors.set_index(['insurance_id', 'sex_insured', 'age_insured'], inplace=True)
-        factors.drop('cf', inplace=True, axis=1)
+        factors = self.factor_frame(self.cfs, intrest)
         self.factors = factors
+        if key is not None:
+            self.results.put(key, factors, tariff=self.tablename, checksum=self.database.checksum)
         return factors
 
+    @instrumented
+    def calculate_pension_ages(self, intrest, pension_ages, cache=True):
+        """ Returns factors for several pension ages in one call, indexed by
+        pension_age, insurance_id, sex_insured and age_insured.
+
+        The lookup table and the cash flows not depending on the pension age
+        (see pension_age_free_rows) are calculated once; per pension age only
+        the deferral dependent rows are built, sliced from shared survival
+        arrays. Factors equal those of calculate_factors per pension age; the
+        cash flows and factors kept by the table are left as they are.
+
+        Parameters:
+        -----------
+        intrest: YieldCurve, int, float or Series.
+        pension_ages: list or range of int
+        cache: boolean. Take factors from (and store them in) the result
+        cache, if the table has one. Default True.
+        """
+        curve = YieldCurve.from_value(intrest)
+        lookup_cf = self.lookup_table(curve)['cf'].values
+        pension_ages = [int(pension_age) for pension_age in pension_ages]
+        frames = []
+        for pension_age in pension_ages:
+            key = factors = None
+            if cache and self.results is not None:
+                key = self.result_key('factors', pension_age, curve_fingerprint(curve))
+                factors = self.results.get(key)
+            if factors is None:
+                cube = self.interest_free_cashflows(pension_age).resolve(lookup_cf)
+                factors = self.factor_frame(cube, curve)
+                if key is not None:
+                    self.results.put(key, factors, tariff=self.tablename,
+                                     checksum=self.database.checksum)
+            frames.append(factors)
+        return pd.concat(frames, keys=pension_ages, names=['pension_age'])
+
+    @instrumented
+    def calculate_sensitivities(self, intrest, pension_age=67):
+        """ Returns factors with key rate durations and convexities.
+
+        Derivatives are taken analytically with respect to every point of
+        the yield curve (as a decimal, 1 pct = 0.01), including the
+        dependence of undefined partner payments till retirement on the
+        curve through ay_avg. Rounding is ignored.
+
+        duration: -dP / dr / P
+        convexity: d2P / dr2 / P
+        Both are NaN where the factor is zero.
+
+        Columns are ('tar', ''), ('duration', k) and ('convexity', k), k being
+        the position of the curve point as passed, trailing repeats of the
+        last rate included; the last point sets the rate of all later years.
+
+        Parameters:
+        -----------
+        intrest: YieldCurve, int, float or Series.
+        pension_age: int. Default 67 year.
+        """
+        curve = YieldCurve.from_value(intrest)
+        npoints = curve_points(intrest)
+        factors = self.calculate_factors(curve, pension_age=pension_age, cache=False)
+        cube = self.cfs
+        first, second = (key_rate_derivatives(cube.matrix(), curve, cube.timing(),
+                                              cube.deferral(), order, npoints)
+                         for order in (1, 2))
+
+        deferred = self.interest_free_cashflows(pension_age).deferred
+        if deferred is not None and len(deferred['rows']):
+            # payments lookup_cf[index] * nq depend on the curve through ay_avg;
+            # they fall before pension age, so are discounted mid-year
+            items = self.get_lookup_items()
+            scale = (items['hx_avg'] * items['factor'])[:, np.newaxis]
+            lookup1, lookup2 = (key_rate_derivatives(items['cf_ay_avg'], curve, 'whole',
+                                                     order=order, npoints=npoints) * scale
+                                for order in (1, 2))
+            rows, index, nq = deferred['rows'], deferred['index'], deferred['nq']
+            nyears = index.shape[1]
+            mid, dmid = curve.mid(nyears), curve.derivatives(nyears)[1]
+            payments1 = lookup1[index] * nq[:, :, np.newaxis]
+            payments2 = lookup2[index] * nq[:, :, np.newaxis]
+            first[rows] += np.einsum('jtk,t->jk', payments1, mid)
+            second[rows] += (np.einsum('jtk,t->jk', payments2, mid) +
+                             2 * np.einsum('jtk,t,tk->jk', payments1, dmid,
+                                           curve.key_rates(nyears, npoints)))
+
+        tar = factors['tar'].values[:, np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.hstack((tar, -first / tar, second / tar))
+        points = range(npoints)
+        columns = pd.MultiIndex.from_tuples([('tar', '')] +
+                                            [('duration', k) for k in points] +
+                                            [('convexity', k) for k in points],
+                                            names=[None, 'key_rate'])
+        return pd.DataFrame(values, index=factors.index, columns=columns)
+
+    @instrumented
+    def calculate_scenarios(self, curves, pension_age=67, chunksize=100):
+        """ Returns factors for many yield curves in one call.
+
+        The interest independent cash flows (see interest_free_cashflows)
+        are discounted against chunks of curves at the same time. Undefined
+        partner payments till retirement depend on the curve through ay_avg,
+        so those are rebuilt per curve from their deferred parts.
+
+        Parameters:
+        -----------
+        curves: 2-D array (scenarios x maturities), intrest in pct.
+        pension_age: int. Default 67 year.
+        chunksize: int. Number of curves discounted at once. Default 100.
+
+        Returns 4-D array (scenarios x insurance_id x sex x age) with axes
+        INSURANCE_IDS, [MALE, FEMALE] and range(LOWAGE, UPAGE).
+        """
+        curves = np.atleast_2d(np.asarray(curves, dtype=float))
+        cube = self.interest_free_cashflows(pension_age)
+        cashflows, timing, deferral = cube.matrix(), cube.timing(), cube.deferral()
+        pre_rows, pre_index, pre_nq = (cube.deferred[item] for item in ('rows', 'index', 'nq'))
+        nyears = pre_index.shape[1]
+
+        items = self.get_lookup_items()
+        ay_avg, hx_avg, factor = items['cf_ay_avg'], items['hx_avg'], items['factor']
+
+        rounding = self.params['round']
+        out = np.empty((len(curves), len(cashflows)))
+        for start in range(0, len(curves), chunksize):
+            chunk = curves[start:start + chunksize]
+            values = scenario_present_values(cashflows, chunk, timing, deferral)
+            if len(pre_rows):
+                whole, mid = discount_weights(discount_matrix(chunk, max(nyears, ay_avg.shape[1])))
+                ay = np.round(whole[:, :ay_avg.shape[1]].dot(ay_avg.T), rounding)
+                lookup_cf = ay * hx_avg * factor
+                values[:, pre_rows] += np.einsum('sjk,jk,sk->sj', lookup_cf[:, pre_index],
+                                                 pre_nq, mid[:, :nyears])
+            out[start:start + chunksize] = np.round(values, rounding)
+        return out.reshape((len(curves),) + cube.shape[:3])
+
+    @instrumented
+    def portfolio_factors(self, keys, intrest):
+        """ Returns keys with column 'factor' added.
+
+        Keys on the factor grid are valued through one batched valuation per
+        pension age, other keys (ages outside LOWAGE..UPAGE, other insurance
+        types) one by one.
+
+        Parameters:
+        -----------
+        keys: DataFrame with distinct rows of insurance_id, sex, age and pension_age
+        intrest: YieldCurve, int, float or Series.
+        """
+        distinct = keys[PORTFOLIO_KEYS].reset_index(drop=True)
+        distinct['factor'] = np.nan
+        insurance_ids, sexes = pd.Index(INSURANCE_IDS), pd.Index([MALE, FEMALE])
+        for pension_age, group in distinct.groupby('pension_age'):
+            on_grid = (group['insurance_id'].isin(INSURANCE_IDS) &
+                       (group['age'] >= LOWAGE) & (group['age'] < UPAGE))
+            if on_grid.any():
+                rows = group[on_grid]
+                sex = sexes.get_indexer(rows['sex'])
+                assert (sex >= 0).all(), "sex should be either M of F!"
+                grid = self.pv(self.interest_free_cashflows(int(pension_age)), intrest)
+                distinct.loc[rows.index, 'factor'] = grid[insurance_ids.get_indexer(rows['insurance_id']),
+                                                          sex, rows['age'].values.astype(int) - LOWAGE]
+            for row in group[~on_grid].itertuples():
+                cf = self.cf(row.insurance_id, int(row.age), row.sex, int(pension_age),
+                             intrest=intrest)
+                distinct.loc[row.Index, 'factor'] = self.pv(merge_two_dicts(
+                    {'age': int(row.age), 'pension_age': int(pension_age)}, cf), intrest)
+        return distinct
+
+    @instrumented
+    def value_portfolio(self, policies, intrest, benefit='benefit', factors=None):
+        """ Returns (values, totals) of a portfolio of policies.
+
+        Factors are calculated once per distinct key (insurance_id, sex, age,
+        pension_age), see portfolio_factors, and joined back to the policies.
+
+        values: policies with columns 'factor' and 'pv' (factor * benefit)
+        totals: sum of benefit and pv per insurance_id, with a 'total' row
+
+        Parameters:
+        -----------
+        policies: DataFrame with columns insurance_id, sex, age, pension_age
+        and benefit
+        intrest: YieldCurve, int, float or Series.
+        benefit: str. Name of benefit amount column. Default 'benefit'.
+        factors: DataFrame with known factors per key, as returned by
+        portfolio_factors. Optional.
+        """
+        distinct = policies[PORTFOLIO_KEYS].drop_duplicates()
+        if factors is None:
+            factors = self.portfolio_factors(distinct, intrest)
+        values = pd.merge(policies, factors, on=PORTFOLIO_KEYS, how='left')
+        values.index = policies.index
+        values['pv'] = values['factor'] * values[benefit]
+        totals = values.groupby('insurance_id')[[benefit, 'pv']].sum()
+        totals.loc['total'] = totals.sum()
+        return values, totals
+
+    @instrumented
     def export(self, xlswb, intrest, pension_age=67):
         """ Exports results to given xlswb.
 
         Parameters:
         -----------
         xlswb: str
-        intrest: int, float or Series.
+        intrest: YieldCurve, int, float or Series.
         pension_age: int. Default 67 year.
         """
-        if (intrest == self.intrest) and (pension_age == self.pension_age):
+        if self.is_calculated(intrest, pension_age) and self.factors is not None:
             result = self.factors
         else:
-            result = self.calculate_factors(intrest=intrest, pension_age=pension_age)
+            result = self.calculate_factors(intrest=intrest, pension_age=pension_age, cache=False)
 
         sheets = OrderedDict()
         sheets['legend'] = self.legend
         sheets['factors'] = result.unstack(['sex_insured', 'insurance_id'])
-        temp = self.cfs.copy(deep=True)
-        temp['cf'] = temp['cf'].map(lambda x: x['payments'])
-        cashflows = expand(temp, 'cf')
-        cashflows.set_index(['sex_insured', 'insurance_id', 'age_insured', 'year'], inplace=True)
-        sheets['cashflows'] = cashflows.unstack(['sex_insured', 'insurance_id'])
-        sheets['yield_curve'] = pd.DataFrame(self.yield_curve, columns=['intrest'])
-        sheets['lx'] = pd.concat([self.lx[MALE], self.lx[FEMALE]], axis=1)
-        sheets['hx'] = pd.concat([self.hx[MALE], self.hx[FEMALE]], axis=1)
-        adjustments = pd.read_excel(XLSWB, sheetname='tbl_adjustments')
-        sheets['adjustments'] = adjustments[adjustments['id'] == self.params['adjustments']]
+        sheets['cashflows'] = self.cfs.to_frame()
+        sheets.update(self.basis_sheets())
 
         # write everything to Excel
         writer = pd.ExcelWriter(xlswb)
@@ -563,3 +1228,89 @@ class LifeTable(object):
 
         msg = "Ready. See {0} for output".format(xlswb)
         print(msg)
+
+    def basis_sheets(self):
+        """ Returns OrderedDict with yield curve, lx, hx and adjustments frames. """
+        sheets = OrderedDict()
+        curve = YieldCurve.from_value(self.intrest)
+        sheets['yield_curve'] = pd.DataFrame({'intrest': curve.to_series(self.cfs.shape[3])})
+        sheets['lx'] = pd.concat([self.lx[MALE], self.lx[FEMALE]], axis=1)
+        sheets['hx'] = pd.concat([self.hx[MALE], self.hx[FEMALE]], axis=1)
+        adjustments = self.database['tbl_adjustments']
+        sheets['adjustments'] = adjustments[adjustments['id'] == self.params['adjustments']]
+        return sheets
+
+    @instrumented
+    def export_stream(self, filename, intrest, pension_age=67, fmt='xlsx'):
+        """ Exports results sheet by sheet, streaming rows to disk.
+
+        Cash flows are written straight from the cash flow matrix, without
+        the expanded and unstacked frames export() builds in memory.
+
+        Parameters:
+        -----------
+        filename: str. Workbook for fmt 'xlsx', directory for fmt 'csv'.
+        intrest: YieldCurve, int, float or Series.
+        pension_age: int. Default 67 year.
+        fmt: either 'xlsx' (write-only workbook, cash flows per age and year)
+        or 'csv' (one csv file per sheet, cash flows in long format).
+        Default 'xlsx'.
+        """
+        if fmt not in ('xlsx', 'csv'):
+            raise ValueError("fmt should be either 'xlsx' or 'csv'")
+        if not (self.is_calculated(intrest, pension_age) and self.factors is not None):
+            self.calculate_factors(intrest=intrest, pension_age=pension_age, cache=False)
+
+        cube = self.cfs
+        sheets = OrderedDict()
+        sheets['legend'] = frame_rows(self.legend)
+        if fmt == 'xlsx':
+            columns = [(sex, insurance_id) for sex in cube.sexes for insurance_id in cube.insurance_ids]
+            sheets['factors'] = frame_rows(self.factors.unstack(['sex_insured', 'insurance_id']))
+            sheets['cashflows'] = wide_rows(cube.values, cube.ages, columns)
+        else:
+            labels = cube.labels().itertuples(index=False)
+            sheets['factors'] = frame_rows(self.factors)
+            sheets['cashflows'] = long_rows(labels, cube.matrix(), cube.lengths.ravel(),
+                                            CashflowCube.colnames)
+        for sheetname, content in self.basis_sheets().items():
+            sheets[sheetname] = frame_rows(content)
+
+        if fmt == 'xlsx':
+            write_xlsx(filename, sheets)
+        else:
+            write_csv(filename, sheets)
+
+        msg = "Ready. See {0} for output".format(filename)
+        print(msg)
+
+
+class LifeTableRegistry(object):
+    """ Hands out LifeTables for several tariffs sharing one parsed database.
+
+    Tariffs referring to the same lx, hx, adjustments or ukv id share the
+    underlying frames and commutation engine, and optionally a CubeStore
+    and a ResultCache.
+    Generation table tariffs are valued in baseyear (default current year).
+    """
+
+    def __init__(self, xlswb=XLSWB, database=None, store=None, baseyear=None, results=None):
+        self.database = database if database is not None else Database(xlswb)
+        self.store = store
+        self.baseyear = baseyear
+        self.results = results
+        self.tables = {}
+
+    def __getitem__(self, tablename):
+        if tablename not in self.tables:
+            self.tables[tablename] = LifeTable(tablename, database=self.database,
+                                               store=self.store, baseyear=self.baseyear,
+                                               results=self.results)
+        return self.tables[tablename]
+
+    def __contains__(self, tablename):
+        return tablename in self.tablenames()
+
+    def tablenames(self):
+        """ Returns list with names of all tariffs in the database. """
+        return list(self.database['tbl_tariff']['name'])
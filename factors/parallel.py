@@ -0,0 +1,67 @@
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from discount import curve_matrix
+from models import LifeTableRegistry
+from settings import XLSWB, INSURANCE_IDS, MALE, FEMALE, LOWAGE, UPAGE
+
+# per process state: the registry is built once in the parent process and
+# inherited by forked workers, so mortality tables are never pickled
+_worker = {}
+
+
+def _init_worker(xlswb, curves):
+    """ Initializes process with registry (if not inherited) and curves. """
+    if _worker.get('xlswb') != xlswb:
+        _worker['registry'] = LifeTableRegistry(xlswb)
+        _worker['xlswb'] = xlswb
+    _worker['curves'] = curves
+
+
+def _factor_job(job):
+    """ Returns (job, factor cube) for job = (tariff, pension_age). """
+    tariff, pension_age = job
+    table = _worker['registry'][tariff]
+    return job, table.calculate_scenarios(_worker['curves'], pension_age)
+
+
+def generate_factor_sets(tariffs, pension_ages, curves, workers=None, xlswb=XLSWB):
+    """ Returns factors for all combinations of tariff, pension age and curve.
+
+    Each (tariff, pension_age) combination is a stateless job, valued
+    against all curves at once in a pool of worker processes.
+
+    Parameters:
+    -----------
+    tariffs: list of str
+    pension_ages: list of int
+    curves: list of int, float, list or Series, or 2-D array (scenarios x maturities)
+    workers: int. Number of processes. Default number of cpu's, 1 runs in-process.
+    xlswb: str
+
+    Returns DataFrame with column 'tar', indexed by tariff, pension_age,
+    scenario (position in curves), insurance_id, sex_insured and age_insured.
+    """
+    curves = curve_matrix(curves)
+    jobs = [(tariff, pension_age) for tariff in tariffs for pension_age in pension_ages]
+    _init_worker(xlswb, curves)
+    if workers == 1:
+        results = [_factor_job(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers, _init_worker, (xlswb, curves))
+        try:
+            results = pool.map(_factor_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    frames = []
+    for (tariff, pension_age), cube in results:
+        index = pd.MultiIndex.from_product([[tariff], [pension_age], np.arange(len(curves)),
+                                            INSURANCE_IDS, [MALE, FEMALE], range(LOWAGE, UPAGE)],
+                                           names=['tariff', 'pension_age', 'scenario',
+                                                  'insurance_id', 'sex_insured', 'age_insured'])
+        frames.append(pd.DataFrame({'tar': cube.ravel()}, index=index))
+    return pd.concat(frames)
@@ -0,0 +1,168 @@
+import os
+import pickle
+import tempfile
+
+from settings import RESULT_CACHE_SIZE
+
+# bump when results of the same inputs change, so old entries are not used
+RESULT_VERSION = '1'
+
+# errors raised reading a partly removed, corrupt or outdated entry
+READ_ERRORS = (IOError, OSError, EOFError, ValueError, KeyError, AttributeError, ImportError,
+               IndexError, pickle.UnpicklingError)
+
+
+class ResultCache(object):
+    """ On-disk cache of result frames (factors, test results), keyed by a
+    content hash of everything they depend on, see LifeTable.result_key.
+
+    Every entry is one pickle file, written to a temporary file first and
+    renamed into place, so processes sharing the directory never read a
+    partly written entry. Unreadable entries count as missing. The least
+    recently used entries are removed when the cache exceeds maxbytes.
+    """
+
+    suffix = '.pkl'
+
+    def __init__(self, directory, maxbytes=RESULT_CACHE_SIZE):
+        """ Parameters:
+        -----------
+        directory: str. Created if it does not exist.
+        maxbytes: int. Maximum total size of cached results. Default RESULT_CACHE_SIZE.
+        """
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def path(self, key):
+        """ Returns file of entry with given key (hex digest). """
+        return os.path.join(self.directory, key + self.suffix)
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def keys(self):
+        """ Returns list with keys of all entries. """
+        return [name[:-len(self.suffix)] for name in os.listdir(self.directory)
+                if name.endswith(self.suffix) and not name.startswith('.')]
+
+    def get(self, key):
+        """ Returns cached result for key, None if not cached.
+
+        Parameters:
+        -----------
+        key: str. Hex digest.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            os.utime(path, None)
+        except READ_ERRORS:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['result']
+
+    def put(self, key, result, **meta):
+        """ Stores result under key and evicts entries beyond maxbytes.
+
+        Parameters:
+        -----------
+        key: str. Hex digest.
+        result: DataFrame (or any picklable object)
+        meta: additional items to keep with the entry, e.g. the workbook checksum
+        """
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self.directory, prefix='.tmp',
+                                           suffix=self.suffix)
+        except (IOError, OSError):
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump({'meta': meta, 'result': result}, f, pickle.HIGHEST_PROTOCOL)
+            os.chmod(tmpname, 0o644)
+            os.rename(tmpname, self.path(key))
+        except (IOError, OSError):
+            os.remove(tmpname)
+            return
+        self.evict()
+
+    def meta(self, key):
+        """ Returns dict with meta data of entry, None if not cached. """
+        try:
+            with open(self.path(key), 'rb') as f:
+                return pickle.load(f)['meta']
+        except READ_ERRORS:
+            return None
+
+    def size(self):
+        """ Returns total size in bytes of all entries. """
+        return sum(size for _, _, size in self.entries())
+
+    def entries(self):
+        """ Returns list of (mtime, key, size), least recently used first. """
+        out = []
+        for key in self.keys():
+            try:
+                stat = os.stat(self.path(key))
+            except OSError:
+                continue
+            out.append((stat.st_mtime, key, stat.st_size))
+        return sorted(out)
+
+    def remove(self, key):
+        """ Removes entry with given key, if cached. """
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        """ Removes all entries. """
+        for key in self.keys():
+            self.remove(key)
+
+    def invalidate(self, checksum):
+        """ Removes entries made from another workbook.
+
+        Parameters:
+        -----------
+        checksum: str. Keep entries with this workbook checksum.
+        """
+        for key in self.keys():
+            meta = self.meta(key)
+            if meta is None or meta.get('checksum') != checksum:
+                self.remove(key)
+
+    def evict(self, maxbytes=None):
+        """ Removes least recently used entries till total size <= maxbytes.
+
+        Parameters:
+        -----------
+        maxbytes: int. Optional. Default self.maxbytes.
+        """
+        maxbytes = self.maxbytes if maxbytes is None else maxbytes
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if total <= maxbytes:
+                break
+            self.remove(key)
+            total -= size
+
+    def stats(self):
+        """ Returns dict with hits, misses, number of entries and size in bytes. """
+        entries = self.entries()
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(entries),
+                'size': sum(size for _, _, size in entries),
+                'maxbytes': self.maxbytes}
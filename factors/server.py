@@ -0,0 +1,435 @@
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+import threading
+import timeit
+
+import numpy as np
+
+from collections import defaultdict, deque
+from cache import LRUCache
+from curve import YieldCurve
+from models import LifeTableRegistry
+from settings import (XLSWB, INSURANCE_IDS, TIMING, MALE, FEMALE, LOWAGE, UPAGE, SERVER_PORT,
+                      SERVER_BATCH_SIZE, GRID_CACHE_SIZE, LATENCY_WINDOW)
+
+try:
+    import Queue as queue
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+except ImportError:
+    import queue
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl
+
+QUOTE_ITEMS = ['tariff', 'insurance_id', 'sex', 'age', 'pension_age', 'curve']
+
+
+class FactorService(object):
+    """ Factors of preloaded tariffs for named yield curves.
+
+    Factors on the grid (INSURANCE_IDS x sex x LOWAGE..UPAGE) are looked
+    up in factor grids, one per tariff, pension age and curve, valued from
+    the interest free cash flow cube on first use and kept in a LRU cache.
+    Other quotes are valued one by one. Not thread-safe: the server calls
+    it from one worker thread only.
+    """
+
+    def __init__(self, tariffs, curves, pension_ages=(), xlswb=XLSWB, store=None):
+        """ Parameters:
+        -----------
+        tariffs: list of str. Tariffs that can be quoted.
+        curves: dict {name: YieldCurve, int, float, list or Series}
+        pension_ages: list of int. Grids to value at once for every tariff
+        and curve. Optional.
+        xlswb: str
+        store: CubeStore. Optional.
+        """
+        self.registry = LifeTableRegistry(xlswb, store=store)
+        self.tariffs = list(tariffs)
+        unknown = [tariff for tariff in self.tariffs if tariff not in self.registry]
+        if unknown:
+            raise ValueError("unknown tariffs: {0}".format(', '.join(unknown)))
+        self.grids = LRUCache(GRID_CACHE_SIZE)
+        self.single = LRUCache(GRID_CACHE_SIZE * 64)
+        self.curves = {}
+        for name, intrest in curves.items():
+            self.add_curve(name, intrest)
+        for tariff in self.tariffs:
+            for pension_age in pension_ages:
+                for name in self.curves:
+                    self.grid(tariff, pension_age, name)
+
+    def add_curve(self, name, intrest):
+        """ Adds (or replaces) yield curve under given name. """
+        curve, name = YieldCurve.from_value(intrest), str(name)
+        if name in self.curves and self.curves[name] != curve:
+            self.grids.clear()
+            self.single.clear()
+        self.curves[name] = curve
+
+    def key(self, item):
+        """ Returns quote key tuple (see QUOTE_ITEMS) from dict, raises ValueError if invalid.
+
+        Parameters:
+        -----------
+        item: dict with tariff, insurance_id, sex, age, pension_age and curve
+        """
+        missing = [name for name in QUOTE_ITEMS if name not in item]
+        if missing:
+            raise ValueError("missing items: {0}".format(', '.join(missing)))
+        tariff, insurance_id, sex = (str(item[name]) for name in ('tariff', 'insurance_id', 'sex'))
+        if tariff not in self.tariffs:
+            raise ValueError("unknown tariff: {0}".format(tariff))
+        if insurance_id not in TIMING:
+            raise ValueError("cannot process insurance_id: {0}".format(insurance_id))
+        if sex not in (MALE, FEMALE):
+            raise ValueError("sex should be either M of F")
+        if str(item['curve']) not in self.curves:
+            raise ValueError("unknown curve: {0}".format(item['curve']))
+        try:
+            age, pension_age = int(item['age']), int(item['pension_age'])
+        except (TypeError, ValueError):
+            raise ValueError("age and pension_age should be integers")
+        return tariff, insurance_id, sex, age, pension_age, str(item['curve'])
+
+    def grid(self, tariff, pension_age, curve):
+        """ Returns 3-D array (insurance_id x sex x age) with factors.
+
+        Parameters:
+        -----------
+        tariff: str
+        pension_age: int
+        curve: str. Name of curve.
+        """
+        def build():
+            table = self.registry[tariff]
+            return table.pv(table.interest_free_cashflows(pension_age), self.curves[curve])
+        return self.grids.get((tariff, pension_age, curve), build)
+
+    def factor(self, key):
+        """ Returns factor of a quote off the grid. """
+        def build():
+            tariff, insurance_id, sex, age, pension_age, curve = key
+            table, intrest = self.registry[tariff], self.curves[curve]
+            cf = table.cf(insurance_id, age, sex, pension_age, intrest=intrest)
+            cf.update({'age': age, 'pension_age': pension_age})
+            return table.pv(cf, intrest)
+        return self.single.get(key, build)
+
+    def quote(self, keys):
+        """ Returns array with factor per quote key, see key().
+
+        Quotes on the grid are gathered per tariff, pension age and curve
+        with one lookup in the factor grid each.
+
+        Parameters:
+        -----------
+        keys: list of tuples (tariff, insurance_id, sex, age, pension_age, curve)
+        """
+        out = np.empty(len(keys))
+        groups = defaultdict(list)
+        for i, key in enumerate(keys):
+            if key[1] in INSURANCE_IDS and LOWAGE <= key[3] < UPAGE:
+                groups[(key[0], key[4], key[5])].append(i)
+            else:
+                out[i] = self.factor(key)
+        sexes = [MALE, FEMALE]
+        for (tariff, pension_age, curve), rows in groups.items():
+            grid = self.grid(tariff, pension_age, curve)
+            index = np.array([(INSURANCE_IDS.index(keys[i][1]), sexes.index(keys[i][2]),
+                               keys[i][3] - LOWAGE) for i in rows])
+            out[rows] = grid[index[:, 0], index[:, 1], index[:, 2]]
+        return out
+
+
+class Metrics(object):
+    """ Thread-safe request counts, batch sizes and latencies of a server. """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.start = timeit.default_timer()
+        self.requests = 0
+        self.quotes = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched = 0
+        self.latencies = deque(maxlen=window)
+
+    def request(self, nquotes, seconds, error=False):
+        """ Records a request with nquotes quotes, answered in seconds. """
+        with self.lock:
+            self.requests += 1
+            self.quotes += nquotes
+            self.errors += bool(error)
+            self.latencies.append(seconds)
+
+    def batch(self, nrequests):
+        """ Records a batch of nrequests requests valued together. """
+        with self.lock:
+            self.batches += 1
+            self.batched += nrequests
+
+    def to_dict(self):
+        """ Returns dict with counts, throughput since start and latency
+        percentiles (ms) over the most recent requests. """
+        with self.lock:
+            uptime = timeit.default_timer() - self.start
+            latencies = np.array(self.latencies) * 1e3
+            out = {'uptime': uptime,
+                   'requests': self.requests,
+                   'quotes': self.quotes,
+                   'errors': self.errors,
+                   'batches': self.batches,
+                   'requests_per_batch': float(self.batched) / self.batches if self.batches else None,
+                   'requests_per_second': self.requests / uptime if uptime else None,
+                   'quotes_per_second': self.quotes / uptime if uptime else None}
+        for pct in (50, 90, 99):
+            out['latency_p{0}_ms'.format(pct)] = (float(np.percentile(latencies, pct))
+                                                  if len(latencies) else None)
+        out['latency_max_ms'] = float(latencies.max()) if len(latencies) else None
+        return out
+
+
+class Batcher(object):
+    """ Values requests of concurrent handler threads in batches.
+
+    One worker thread takes all requests queued while it was busy (up to
+    batch_size quotes) and values them with one call of func, so a lone
+    request is answered at once and bursts are vectorized. A failing
+    batch is retried request by request, so one bad request does not fail
+    the others.
+    """
+
+    def __init__(self, func, batch_size=SERVER_BATCH_SIZE, metrics=None):
+        """ Parameters:
+        -----------
+        func: callable(list of keys) returning sequence with one result per key
+        batch_size: int. Default SERVER_BATCH_SIZE.
+        metrics: Metrics. Optional.
+        """
+        self.func = func
+        self.batch_size = batch_size
+        self.metrics = metrics
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, keys):
+        """ Returns results for keys, blocking till their batch is valued. """
+        return self.wait({'keys': keys})
+
+    def call(self, func):
+        """ Returns func(), called by the worker thread in between batches. """
+        return self.wait({'call': func})
+
+    def wait(self, request):
+        request.update({'done': threading.Event(), 'result': None, 'error': None})
+        self.queue.put(request)
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+
+    def close(self):
+        """ Stops the worker thread after the queued requests. """
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        pending = None
+        while True:
+            request = self.queue.get() if pending is None else pending
+            pending = None
+            if request is None:
+                return
+            if 'call' in request:
+                self.execute(request)
+                continue
+            batch, size = [request], len(request['keys'])
+            while size < self.batch_size:
+                try:
+                    request = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None or 'call' in request:
+                    pending = request
+                    break
+                batch.append(request)
+                size += len(request['keys'])
+            self.evaluate(batch)
+            if pending is None and request is None:
+                return
+
+    def execute(self, request):
+        try:
+            request['result'] = request['call']()
+        except Exception as error:
+            request['error'] = error
+        request['done'].set()
+
+    def evaluate(self, batch):
+        if self.metrics is not None:
+            self.metrics.batch(len(batch))
+        try:
+            results = self.func([key for request in batch for key in request['keys']])
+            start = 0
+            for request in batch:
+                request['result'] = results[start:start + len(request['keys'])]
+                start += len(request['keys'])
+        except Exception:
+            for request in batch:
+                try:
+                    request['result'] = self.func(request['keys'])
+                except Exception as error:
+                    request['error'] = error
+        for request in batch:
+            request['done'].set()
+
+
+class QuoteHandler(BaseHTTPRequestHandler):
+    """ JSON over HTTP:
+
+    GET  /quote?tariff=..&insurance_id=..&sex=..&age=..&pension_age=..&curve=..
+    POST /quote  one quote (object) or many (list of objects)
+    POST /curves {name: intrest}, adds or replaces curves
+    GET  /curves, /metrics, /health
+    """
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/quote':
+            self.quote(dict(parse_qsl(url.query)))
+        elif url.path == '/metrics':
+            self.send_json(200, self.server.metrics.to_dict())
+        elif url.path == '/curves':
+            self.send_json(200, dict((name, list(curve.rates))
+                                     for name, curve in self.server.service.curves.items()))
+        elif url.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        try:
+            content = self.read_json()
+        except ValueError:
+            return self.send_json(400, {'error': 'invalid json'})
+        if path == '/quote':
+            self.quote(content)
+        elif path == '/curves' and isinstance(content, dict):
+            service = self.server.service
+            try:
+                # curves are replaced by the worker thread, in between batches
+                self.server.batcher.call(lambda: [service.add_curve(name, intrest)
+                                                  for name, intrest in content.items()])
+            except (ValueError, TypeError, AssertionError) as error:
+                return self.send_json(400, {'error': str(error)})
+            self.send_json(200, {'curves': sorted(service.curves)})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def quote(self, content):
+        start = timeit.default_timer()
+        items = content if isinstance(content, list) else [content]
+        status = 200
+        try:
+            keys = [self.server.service.key(item) for item in items]
+            factors = [float(factor) for factor in self.server.batcher.submit(keys)]
+            out = {'factors': factors} if isinstance(content, list) else {'factor': factors[0]}
+        except (ValueError, TypeError, AttributeError) as error:
+            status, out = 400, {'error': str(error)}
+        except Exception as error:
+            status, out = 500, {'error': str(error)}
+        self.send_json(status, out)
+        self.server.metrics.request(len(items), timeit.default_timer() - start, status != 200)
+
+
+class FactorServer(ThreadingMixIn, HTTPServer):
+    """ Threaded HTTP server answering quotes from a FactorService. """
+
+    daemon_threads = True
+
+    def __init__(self, service, host='127.0.0.1', port=SERVER_PORT,
+                 batch_size=SERVER_BATCH_SIZE, verbose=False):
+        """ Parameters:
+        -----------
+        service: FactorService
+        host: str. Default localhost only.
+        port: int. Default SERVER_PORT, 0 picks a free port.
+        batch_size: int. Most quotes valued in one batch. Default SERVER_BATCH_SIZE.
+        verbose: boolean. Log every request. Default False.
+        """
+        HTTPServer.__init__(self, (host, port), QuoteHandler)
+        self.service = service
+        self.metrics = Metrics()
+        self.batcher = Batcher(service.quote, batch_size, self.metrics)
+        self.verbose = verbose
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.batcher.close()
+
+
+def parse_curve(text):
+    """ Returns (name, intrest) from 'name=rate' or 'name=rate,rate,..'. """
+    name, _, rates = text.partition('=')
+    if not rates:
+        raise argparse.ArgumentTypeError("curve should be given as name=rate[,rate..]")
+    return name, [float(rate) for rate in rates.split(',')]
+
+
+def main(argv=None):
+    """ Runs factor server till interrupted. """
+    parser = argparse.ArgumentParser(description="Local server quoting factors.")
+    parser.add_argument('tariffs', nargs='+', help="tariffs to serve")
+    parser.add_argument('--curve', type=parse_curve, action='append', default=[],
+                        help="yield curve as name=rate[,rate..] (default flat=3)")
+    parser.add_argument('--pension-age', type=int, action='append', default=[],
+                        help="pension ages to preload")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--xlswb', default=XLSWB)
+    parser.add_argument('--verbose', action='store_true', help="log every request")
+    args = parser.parse_args(argv)
+
+    start = timeit.default_timer()
+    service = FactorService(args.tariffs, dict(args.curve or [('flat', 3)]),
+                            args.pension_age, args.xlswb)
+    server = FactorServer(service, args.host, args.port, verbose=args.verbose)
+    print("Serving {0} on http://{1}:{2} (ready in {3:.2f} s)".format(
+        ', '.join(args.tariffs), server.server_address[0], server.server_address[1],
+        timeit.default_timer() - start))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
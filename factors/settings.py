@@ -2,6 +2,13 @@ import os
 
 MALE = 'M'
 FEMALE = 'F'
+SEXES = [MALE, FEMALE]
+
+# adjustments (age corrections CX1..CX3 and factors) per sex and benefit type
+ADJUSTMENT_TYPES = ['retire', 'partner', 'risk']
+ADJUSTMENT_ITEMS = ['CX1', 'CX2', 'CX3', 'fnett', 'fcorr', 'fOTS']
+# (type, item) pairs that may be missing from a table, e.g. no CX3 for retirement pensions
+OPTIONAL_ADJUSTMENTS = [('retire', 'CX3')]
 
 LOWAGE = 15
 UPAGE = 70
@@ -12,5 +19,65 @@ INFILE = 'lifedb.xls'
 
 XLSWB = os.path.join(DATADIR, INFILE)
 
+# directory for the columnar workbook cache if the workbook's directory is read-only
+# (e.g. an installed package); environment variable FACTORS_CACHE_DIR overrides it
+CACHE_DIR = os.environ.get('FACTORS_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'factors'))
+
+# number of undefined partner lookup tables (one per yield curve) kept in memory
+LOOKUP_CACHE_SIZE = 16
+
+# number of interest independent cash flow cubes (one per tariff and pension age) kept in memory
+CUBE_CACHE_SIZE = 16
+
+# number of yield curves (with their discount vectors) kept in memory
+CURVE_CACHE_SIZE = 64
+
+# number of intermediate cash flow vectors memoized per mortality table
+MEMO_CACHE_SIZE = 4096
+
+SHEETS = ['tbl_insurance_types', 'tbl_tariff', 'tbl_lx', 'tbl_hx',
+          'tbl_adjustments', 'tbl_ukv', 'tbl_testdata_values', 'tbl_testdata']
+
+# generation tables: qx per id, gender, calendar year and age (read if present)
+GENERATION_SHEET = 'tbl_qx_generation'
+OPTIONAL_SHEETS = [GENERATION_SHEET]
+
+# number of cohort survival vectors kept in memory per generation table
+COHORT_CACHE_SIZE = 256
+
 INSURANCE_IDS = ['OPLL', 'NPLL-B', 'NPLL-O',
                  'NPLLRS', 'NPTL-B', 'NPTL-O', 'ay_avg']
+
+# discounting of payments: whole year, mid-year or mid-year till pension age
+TIMING = {'OPLL': 'whole', 'NPLL-B': 'whole', 'ay_avg': 'whole',
+          'NPTL-B': 'mid', 'NPTL-O': 'mid',
+          'NPLL-O': 'mixed', 'NPLLRS': 'mixed', 'NPLLRU': 'mixed'}
+
+# undefined partner insurances with their probability of a partner at pension age
+UNDEFINED_PARTNER = {'NPLL-O': 'non-exchangable', 'NPLLRS': 'one', 'NPLLRU': 'ukv'}
+
+# insurances with cash flows that do not depend on the pension age
+PENSION_AGE_FREE = ['NPTL-B', 'NPTL-O', 'ay_avg']
+
+# allowed slowdown of a benchmark against its baseline, as a fraction
+BENCHMARK_THRESHOLD = 0.5
+
+# maximum total size in bytes of a store with persisted cash flow cubes
+CUBE_STORE_SIZE = 256 * 1024 ** 2
+
+# maximum total size in bytes of an on-disk cache with factor and test results
+RESULT_CACHE_SIZE = 64 * 1024 ** 2
+
+# actuarial key of a policy: policies sharing it share their factor
+PORTFOLIO_KEYS = ['insurance_id', 'sex', 'age', 'pension_age']
+
+# number of policy rows valued at once when streaming policy files
+STREAM_CHUNKSIZE = 100000
+
+# factor server: default port (localhost only), most quotes valued in one batch,
+# factor grids kept warm and number of recent latencies kept for percentiles
+SERVER_PORT = 8765
+SERVER_BATCH_SIZE = 4096
+GRID_CACHE_SIZE = 64
+LATENCY_WINDOW = 10000
@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from cube import CashflowCube
+from settings import CUBE_STORE_SIZE
+
+
+class CubeStore(object):
+    """ On-disk store of CashflowCubes, shared by processes on one machine.
+
+    Every cube is a directory with its values as .npy file, which is
+    memory-mapped read-only on load, so processes reading the same cube
+    share its pages instead of each holding a copy. The small deferred
+    parts of interest independent cubes are kept in a .npz file. Entries are written
+    to a temporary directory first and renamed into place. The least
+    recently used entries are removed when the store exceeds maxbytes.
+    """
+
+    def __init__(self, directory, maxbytes=CUBE_STORE_SIZE):
+        """ Parameters:
+        -----------
+        directory: str. Created if it does not exist.
+        maxbytes: int. Maximum total size of stored cubes. Default CUBE_STORE_SIZE.
+        """
+        self.directory = directory
+        self.maxbytes = maxbytes
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def path(self, key):
+        """ Returns directory of entry with given key (hex digest). """
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.path(key), 'meta.json'))
+
+    def keys(self):
+        """ Returns list with keys of all complete entries. """
+        return [key for key in os.listdir(self.directory)
+                if not key.startswith('.') and key in self]
+
+    def get(self, key):
+        """ Returns memory-mapped CashflowCube for key, None if not stored.
+
+        Parameters:
+        -----------
+        key: str. Hex digest, see LifeTable.cube_key.
+        """
+        path = self.path(key)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+            lengths = np.load(os.path.join(path, 'lengths.npy'))
+            deferred = None
+            if meta.get('deferred'):
+                with np.load(os.path.join(path, 'deferred.npz')) as arrays:
+                    deferred = {item: arrays[item] for item in ('rows', 'index', 'nq')}
+        except (IOError, OSError, ValueError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return CashflowCube(values, meta['insurance_ids'], meta['sexes'], meta['ages'],
+                            meta['pension_age'], lengths, deferred)
+
+    def put(self, key, cube, **meta):
+        """ Stores cube under key and evicts entries beyond maxbytes.
+
+        Parameters:
+        -----------
+        key: str. Hex digest, see LifeTable.cube_key.
+        cube: CashflowCube
+        meta: additional items to keep with the entry, e.g. the workbook checksum
+        """
+        if key in self:
+            return
+        tmpdir = tempfile.mkdtemp(dir=self.directory, prefix='.tmp')
+        try:
+            np.save(os.path.join(tmpdir, 'values.npy'), cube.values)
+            np.save(os.path.join(tmpdir, 'lengths.npy'), cube.lengths)
+            if cube.interest_free:
+                np.savez(os.path.join(tmpdir, 'deferred.npz'), **cube.deferred)
+            meta.update({'deferred': cube.interest_free,
+                         'insurance_ids': cube.insurance_ids,
+                         'sexes': cube.sexes,
+                         'ages': [int(age) for age in cube.ages],
+                         'pension_age': int(cube.pension_age)})
+            with open(os.path.join(tmpdir, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            os.chmod(tmpdir, 0o755)
+            os.rename(tmpdir, self.path(key))
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            if key not in self:
+                raise
+        self.evict()
+
+    def meta(self, key):
+        """ Returns dict with meta data of entry.
+
+        Parameters:
+        -----------
+        key: str
+        """
+        with open(os.path.join(self.path(key), 'meta.json')) as f:
+            return json.load(f)
+
+    def entry_size(self, key):
+        """ Returns size in bytes of entry. """
+        path = self.path(key)
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    def size(self):
+        """ Returns total size in bytes of all entries. """
+        return sum(self.entry_size(key) for key in self.keys())
+
+    def remove(self, key):
+        """ Removes entry with given key, if stored.
+
+        Memory maps held by other processes stay valid until closed.
+        """
+        shutil.rmtree(self.path(key), ignore_errors=True)
+
+    def invalidate(self, checksum=None):
+        """ Removes entries, all or those made from another workbook.
+
+        Parameters:
+        -----------
+        checksum: str. Keep entries with this workbook checksum. Optional.
+        Default remove all entries.
+        """
+        for key in self.keys():
+            if checksum is None or self.meta(key).get('checksum') != checksum:
+                self.remove(key)
+
+    def evict(self, maxbytes=None):
+        """ Removes least recently used entries till total size <= maxbytes.
+
+        Parameters:
+        -----------
+        maxbytes: int. Optional. Default self.maxbytes.
+        """
+        maxbytes = self.maxbytes if maxbytes is None else maxbytes
+        entries = sorted((os.path.getmtime(self.path(key)), key) for key in self.keys())
+        sizes = dict((key, self.entry_size(key)) for _, key in entries)
+        total = sum(sizes.values())
+        for _, key in entries:
+            if total <= maxbytes:
+                break
+            self.remove(key)
+            total -= sizes[key]
@@ -0,0 +1,240 @@
+from __future__ import print_function
+
+import os
+import timeit
+
+import pandas as pd
+
+from collections import OrderedDict
+from settings import PORTFOLIO_KEYS, STREAM_CHUNKSIZE
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = pq = None
+
+# number of rows read to estimate the memory use of a policy row
+SAMPLE_ROWS = 1000
+# copies of a chunk alive while valuing it (chunk, merged values, output)
+CHUNK_COPIES = 4
+
+
+def is_parquet(filename):
+    """ Returns True if filename has a Parquet extension. """
+    return os.path.splitext(filename)[1].lower() in ('.parquet', '.pq')
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError("Reading or writing Parquet files requires pyarrow.")
+
+
+def _row_group_chunks(parquet, chunksize):
+    """ Yields DataFrames with at most chunksize rows, reading one row group
+    at a time (for pyarrow versions without ParquetFile.iter_batches).
+    """
+    for group in range(parquet.num_row_groups):
+        frame = parquet.read_row_group(group).to_pandas()
+        for offset in range(0, len(frame), chunksize):
+            yield frame.iloc[offset:offset + chunksize]
+        del frame
+
+
+def read_chunks(filename, chunksize=STREAM_CHUNKSIZE):
+    """ Yields DataFrames with at most chunksize policies from a csv or
+    Parquet file, so the file never has to fit in memory.
+
+    Parquet files are read in record batches of at most chunksize rows.
+    Versions of pyarrow before 3.0 cannot read part of a row group; there
+    memory is bounded by the row group size instead (files written by
+    value_file have one row group per chunk).
+
+    Parameters:
+    -----------
+    filename: str. Parquet if the extension is .parquet or .pq, else csv.
+    chunksize: int. Default STREAM_CHUNKSIZE.
+    """
+    if not is_parquet(filename):
+        for chunk in pd.read_csv(filename, chunksize=chunksize):
+            yield chunk
+        return
+    _require_pyarrow()
+    parquet = pq.ParquetFile(filename)
+    if hasattr(parquet, 'iter_batches'):
+        chunks = (batch.to_pandas() for batch in parquet.iter_batches(batch_size=chunksize))
+    else:
+        chunks = _row_group_chunks(parquet, chunksize)
+    start = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
+
+
+def chunksize_for(filename, max_memory):
+    """ Returns number of policies per chunk to stay within max_memory bytes.
+
+    The memory use per row is estimated from the first SAMPLE_ROWS rows.
+
+    Parameters:
+    -----------
+    filename: str
+    max_memory: int. Bytes.
+    """
+    sample = next(read_chunks(filename, SAMPLE_ROWS))
+    per_row = sample.memory_usage(index=True, deep=True).sum() / float(max(len(sample), 1))
+    return max(1, int(max_memory / (CHUNK_COPIES * per_row)))
+
+
+class Counters(object):
+    """ Progress and throughput of a streaming valuation. """
+
+    def __init__(self):
+        self.rows = 0
+        self.chunks = 0
+        self.keys = 0
+        self.hits = 0
+        self.start = timeit.default_timer()
+        self.seconds = 0.
+
+    def update(self, rows, keys, hits):
+        """ Records a valued chunk.
+
+        Parameters:
+        -----------
+        rows: int. Number of policies in the chunk.
+        keys: int. Number of distinct keys in the chunk.
+        hits: int. Number of those keys valued in an earlier chunk.
+        """
+        self.rows += rows
+        self.chunks += 1
+        self.keys += keys - hits
+        self.hits += hits
+        self.seconds = timeit.default_timer() - self.start
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else None
+
+    def to_dict(self):
+        return OrderedDict([('rows', self.rows),
+                            ('chunks', self.chunks),
+                            ('keys', self.keys),
+                            ('hits', self.hits),
+                            ('seconds', self.seconds),
+                            ('rows_per_second', self.rows_per_second)])
+
+    def __str__(self):
+        return "{0} rows in {1} chunks, {2} factors ({3} reused), {4:.2f} s, {5:.0f} rows/s".format(
+            self.rows, self.chunks, self.keys, self.hits, self.seconds, self.rows_per_second or 0)
+
+
+def print_progress(counters):
+    """ Prints counters; use as progress callback. """
+    print(counters)
+
+
+def value_chunks(table, chunks, intrest, benefit='benefit', counters=None, progress=None):
+    """ Yields (values, totals) per chunk of policies, see LifeTable.value_portfolio.
+
+    Factors are kept per distinct key over all chunks, so every key is
+    valued once however often it occurs in the file.
+
+    Parameters:
+    -----------
+    table: LifeTable
+    chunks: iterable of DataFrames, e.g. read_chunks(filename)
+    intrest: int, float or Series.
+    benefit: str. Name of benefit amount column. Default 'benefit'.
+    counters: Counters. Optional.
+    progress: callable(counters), called after every chunk. Optional.
+    """
+    counters = Counters() if counters is None else counters
+    known = None
+    for chunk in chunks:
+        distinct = chunk[PORTFOLIO_KEYS].drop_duplicates()
+        if known is None:
+            new = distinct
+        else:
+            found = pd.merge(distinct, known[PORTFOLIO_KEYS], on=PORTFOLIO_KEYS,
+                             how='left', indicator=True)
+            new = distinct[(found['_merge'] == 'left_only').values]
+        if len(new):
+            factors = table.portfolio_factors(new, intrest)
+            known = factors if known is None else pd.concat([known, factors],
+                                                            ignore_index=True)
+        values, totals = table.value_portfolio(chunk, intrest, benefit, factors=known)
+        counters.update(len(chunk), len(distinct), len(distinct) - len(new))
+        if progress is not None:
+            progress(counters)
+        yield values, totals
+
+
+class ChunkWriter(object):
+    """ Appends DataFrames to a csv or Parquet file. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.parquet = is_parquet(filename)
+        if self.parquet:
+            _require_pyarrow()
+        self.writer = None
+        self.header = True
+
+    def write(self, frame):
+        if self.parquet:
+            batch = pyarrow.Table.from_pandas(frame, preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.filename, batch.schema)
+            self.writer.write_table(batch)
+        else:
+            frame.to_csv(self.filename, mode='w' if self.header else 'a',
+                         header=self.header, index=False)
+            self.header = False
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def value_file(table, infile, outfile, intrest, benefit='benefit', chunksize=None,
+               max_memory=None, progress=None):
+    """ Returns (totals, counters) of valuing a policy file chunk by chunk,
+    writing the valued policies to outfile as they are done.
+
+    Memory use depends on the chunk size, not on the size of the file. The
+    chunk size is chunksize if given, else derived from max_memory, else
+    STREAM_CHUNKSIZE.
+
+    Parameters:
+    -----------
+    table: LifeTable
+    infile: str. csv or Parquet file with columns insurance_id, sex, age,
+    pension_age and benefit
+    outfile: str. csv or Parquet file.
+    intrest: int, float or Series.
+    benefit: str. Name of benefit amount column. Default 'benefit'.
+    chunksize: int. Policies per chunk. Optional.
+    max_memory: int. Bytes to use for a chunk. Optional.
+    progress: callable(Counters), called after every chunk, e.g.
+    print_progress. Optional.
+    """
+    if chunksize is None:
+        chunksize = STREAM_CHUNKSIZE if max_memory is None else chunksize_for(infile, max_memory)
+    counters = Counters()
+    writer = ChunkWriter(outfile)
+    totals = None
+    try:
+        for values, chunk_totals in value_chunks(table, read_chunks(infile, chunksize), intrest,
+                                                 benefit, counters, progress):
+            writer.write(values)
+            chunk_totals = chunk_totals.drop('total')
+            totals = chunk_totals if totals is None else totals.add(chunk_totals, fill_value=0)
+    finally:
+        writer.close()
+    if totals is None:
+        totals = pd.DataFrame(columns=[benefit, 'pv'])
+    totals.loc['total'] = totals.sum()
+    return totals, counters
@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+from factors.benchmark import BENCHMARKS, compare, environment_differences, run_benchmarks
+
+
+class TestBenchmark(TestCase):
+
+    def test_run(self):
+        report = run_benchmarks(['npx', 'cf_annuity'])
+        self.assertEqual(list(report['results']), ['npx', 'cf_annuity'])
+        for result in report['results'].values():
+            self.assertGreater(result['seconds'], 0)
+            self.assertGreaterEqual(result['peak_memory'], 0)
+
+    def test_compare(self):
+        baseline = {'results': {'npx': {'seconds': 1., 'peak_memory': 1e8}}}
+        report = {'results': {'npx': {'seconds': 1.2, 'peak_memory': 2e8},
+                              'pv': {'seconds': 9., 'peak_memory': 0}}}
+        self.assertEqual(compare(report, baseline, threshold=0.5),
+                         [('npx', 'peak_memory', 1e8, 2e8)])
+        self.assertEqual(compare(report, baseline, threshold=1.), [])
+
+    def test_environment_differences(self):
+        report = run_benchmarks([])
+        self.assertEqual(environment_differences(report, report), [])
+        baseline = {'environment': dict(report['environment'], numpy='1.11.3', platform='other')}
+        self.assertEqual(environment_differences(report, baseline),
+                         [('numpy', '1.11.3', report['environment']['numpy'])])
+
+    def test_benchmarks_cover_all_cash_flow_kinds(self):
+        for name in ('cf_OPLL', 'cf_NPLL-B', 'cf_NPLL-O', 'cf_NPLLRS',
+                     'cf_NPTL-B', 'cf_NPTL-O', 'cf_ay_avg'):
+            self.assertIn(name, BENCHMARKS)
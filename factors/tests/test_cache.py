@@ -0,0 +1,29 @@
+from unittest import TestCase
+
+import pandas as pd
+
+from factors.cache import LRUCache, curve_fingerprint
+
+
+class TestLRUCache(TestCase):
+
+    def test_eviction_and_stats(self):
+        cache = LRUCache(maxsize=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        self.assertEqual(cache.get('a', lambda: None), 1)
+        cache.get('c', lambda: 3)
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 3, 2))
+
+
+class TestCurveFingerprint(TestCase):
+
+    def test_equivalent_curves(self):
+        self.assertEqual(curve_fingerprint(3), curve_fingerprint([3., 3., 3.]))
+        self.assertEqual(curve_fingerprint([1, 2]), curve_fingerprint(pd.Series([1., 2.])))
+
+    def test_different_curves(self):
+        self.assertNotEqual(curve_fingerprint([1, 2]), curve_fingerprint([2, 1]))
@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+import numpy as np
+
+from factors.commutation import Commutation, survival_matrix
+
+
+class TestCommutation(TestCase):
+
+    def setUp(self):
+        lx = np.maximum(0, 1000 - np.arange(121) ** 1.5).round()
+        self.lx = lx
+        self.engine = Commutation({'M': lx, 'F': lx})
+
+    def test_survival_matrix(self):
+        tpx = survival_matrix(self.lx)
+        self.assertEqual(tpx.shape, (121, 121))
+        self.assertAlmostEqual(tpx[30, 10], self.lx[40] / self.lx[30])
+        self.assertEqual(tpx[110, 20], 0)
+
+    def test_npx(self):
+        self.assertAlmostEqual(self.engine.npx(30, 'M', 10), self.lx[40] / self.lx[30])
+        self.assertEqual(self.engine.npx(30, 'M', 200), 0)
+
+    def test_deferred_annuity(self):
+        payments = self.engine.annuity(30, 'F', defer=5)
+        self.assertTrue((payments[:5] == 0).all())
+        self.assertAlmostEqual(payments[5], self.lx[35] / self.lx[30])
+
+    def test_npx_broadcasts(self):
+        ages = np.array([20, 30, 40])
+        sexes = np.array(['M', 'F', 'M'])
+        out = self.engine.npx(ages[:, np.newaxis], sexes[:, np.newaxis], np.arange(5))
+        self.assertEqual(out.shape, (3, 5))
+        for i in range(3):
+            for n in range(5):
+                self.assertEqual(out[i, n], self.engine.npx(ages[i], sexes[i], n))
+
+    def test_npx_caps_at_maxage(self):
+        lx = np.linspace(1000, 100, 121)
+        engine = Commutation({'M': lx, 'F': lx})
+        self.assertAlmostEqual(engine.npx(100, 'F', 50), lx[120] / lx[100])
+        self.assertEqual(engine.npx(150, 'M', 1), 1)
+        self.assertEqual(self.engine.npx(150, 'M', 1), 0)
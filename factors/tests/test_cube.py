@@ -0,0 +1,40 @@
+from unittest import TestCase
+
+import numpy as np
+
+from factors.cube import CashflowCube
+from factors.discount import present_values
+
+
+class TestCashflowCube(TestCase):
+
+    def setUp(self):
+        rows = [[1., 1., 1.], [1., 1.], [0., 1., 1.], [0., 1., 1., 1.]]
+        self.cube = CashflowCube.from_rows(rows, ['OPLL', 'NPLL-O'], ['M'], [65, 66], 67)
+
+    def test_layout(self):
+        self.assertEqual(self.cube.shape, (2, 1, 2, 4))
+        self.assertEqual(self.cube.lengths.tolist(), [[[3, 2]], [[3, 4]]])
+        self.assertEqual(list(self.cube.payments('OPLL', 'M', 66)), [1., 1.])
+        self.assertEqual(list(self.cube.deferral()), [2, 1, 2, 1])
+
+    def test_present_values(self):
+        expected = present_values(self.cube.matrix(), 3, ['whole', 'whole', 'mixed', 'mixed'],
+                                  [2, 1, 2, 1])
+        np.testing.assert_array_equal(self.cube.present_values(3).ravel(), expected)
+
+    def test_to_frame(self):
+        frame = self.cube.to_frame()
+        self.assertEqual(len(frame), 3 + 4)
+        self.assertTrue(np.isnan(frame[('cf', 'M', 'OPLL')].ix[66].ix[2]))
+        self.assertEqual(frame[('cf', 'M', 'NPLL-O')].ix[65].tolist(), [0., 1., 1.])
+
+    def test_resolve(self):
+        rows = [[1., 1.], [0., 0., 2.]]
+        deferred = [(1, np.array([1, 0]), np.array([.5, .25]))]
+        cube = CashflowCube.from_rows(rows, ['OPLL', 'NPLL-O'], ['M'], [65], 67, deferred)
+        self.assertTrue(cube.interest_free)
+        resolved = cube.resolve(np.array([10., 20.]))
+        self.assertFalse(resolved.interest_free)
+        self.assertEqual(resolved.matrix().tolist(), [[1., 1., 0.], [10., 2.5, 2.]])
+        self.assertEqual(cube.matrix()[1].tolist(), [0., 0., 2.])
@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+import numpy as np
+
+from factors.curve import YieldCurve
+from factors.models import LifeTable
+
+
+class TestYieldCurve(TestCase):
+
+    def test_equal_curves_hash_alike(self):
+        curve = YieldCurve([1, 2, 2])
+        self.assertEqual(curve, YieldCurve([1., 2.]))
+        self.assertEqual(len(set([curve, YieldCurve([1, 2])])), 1)
+        self.assertNotEqual(curve, YieldCurve(2))
+        self.assertIs(YieldCurve.from_value([1, 2]), YieldCurve.from_value([1., 2., 2.]))
+
+    def test_vectors_are_cached(self):
+        curve = YieldCurve([1, 2])
+        np.testing.assert_array_equal(curve.intrest(4), [1., 2., 2., 2.])
+        whole, mid = curve.weights(3)
+        v = curve.discount_factors(3)
+        np.testing.assert_allclose(whole, v ** np.arange(3))
+        np.testing.assert_allclose(mid, v ** (np.arange(3) + 0.5))
+        self.assertIs(curve.whole(5).base, whole.base)
+        self.assertFalse(whole.flags.writeable)
+        mixed = curve.mixed(1, 4)
+        np.testing.assert_array_equal(mixed[:2], curve.mid(2))
+        np.testing.assert_array_equal(mixed[2:], curve.whole(4)[2:])
+
+    def test_accepted_as_intrest(self):
+        curve = [0.5, 1., 1.5]
+        table = LifeTable('AEG2011')
+        expected = table.calculate_factors(curve, pension_age=67)['tar'].values
+        other = LifeTable('AEG2011', database=table.database)
+        factors = other.calculate_factors(YieldCurve(curve), pension_age=67)['tar'].values
+        np.testing.assert_array_equal(factors, expected)
+        cf = other.cf('OPLL', 40, 'M', 67, intrest=3)
+        self.assertEqual(other.pv(cf, YieldCurve(3)), other.pv(cf, 3))
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from factors.database import Database, cache_filename
+from factors.settings import XLSWB, SHEETS, SEXES, ADJUSTMENT_TYPES
+
+
+class CacheOnlyDatabase(Database):
+
+    def read_workbook(self):
+        raise AssertionError("workbook should not be parsed")
+
+
+class TestDatabase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.xlswb = os.path.join(self.tmpdir, 'lifedb.xls')
+        shutil.copy(XLSWB, self.xlswb)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache_roundtrip(self):
+        parsed = Database(self.xlswb)
+        self.assertTrue(os.path.exists(cache_filename(self.xlswb)))
+        cached = CacheOnlyDatabase(self.xlswb)
+        for sheetname in SHEETS:
+            self.assertTrue(parsed[sheetname].equals(cached[sheetname]))
+
+    def test_cache_invalidated_on_change(self):
+        Database(self.xlswb)
+        with open(self.xlswb, 'ab') as f:
+            f.write(b'\0')
+        self.assertRaises(AssertionError, CacheOnlyDatabase, self.xlswb)
+
+    def test_cache_sheets_read_on_access(self):
+        Database(self.xlswb)
+        cached = CacheOnlyDatabase(self.xlswb)
+        self.assertEqual(cached.sheets, {})
+        cached['tbl_tariff']
+        self.assertEqual(list(cached.sheets), ['tbl_tariff'])
+
+    def test_cache_changed_after_construction(self):
+        Database(self.xlswb)
+        database = Database(self.xlswb)
+        os.remove(cache_filename(self.xlswb))
+        self.assertEqual(sorted(database['tbl_tariff'].columns),
+                         sorted(Database(self.xlswb, cache=False)['tbl_tariff'].columns))
+
+    def test_cache_falls_back_to_cachedir(self):
+        # a directory in place of the cache file makes the workbook's location unwritable
+        os.mkdir(cache_filename(self.xlswb))
+        cachedir = os.path.join(self.tmpdir, 'cache')
+        Database(self.xlswb, cachedir=cachedir)
+        self.assertTrue(os.path.exists(cache_filename(self.xlswb, cachedir)))
+        CacheOnlyDatabase(self.xlswb, cachedir=cachedir)
+
+
+class TestAdjustments(TestCase):
+
+    def test_indexed_by_sex_and_type(self):
+        database = Database()
+        df = database['tbl_adjustments']
+        df = df[df['id'] == 1]
+        adjustments = database.adjustments(1)
+        self.assertEqual(adjustments.shape, (len(SEXES), len(ADJUSTMENT_TYPES)))
+        for gender, type_, item, value in df[['gender', 'type', 'adjustment', 'value']].values:
+            self.assertEqual(adjustments[item][SEXES.index(gender), ADJUSTMENT_TYPES.index(type_)],
+                             value)
+        self.assertTrue(np.isnan(adjustments['CX3'][0, ADJUSTMENT_TYPES.index('retire')]))
+
+    def test_missing_item_raises(self):
+        database = Database()
+        df = database['tbl_adjustments']
+        database.sheets['tbl_adjustments'] = df[~((df['id'] == 1) & (df['gender'] == 'F') &
+                                                  (df['type'] == 'partner') &
+                                                  (df['adjustment'] == 'fnett'))]
+        self.assertRaises(KeyError, database.adjustments, 1)
+        self.assertRaises(KeyError, database.adjustments, 99)
+        database.adjustments(2)
+
+    def test_unknown_value_raises(self):
+        database = Database()
+        df = database['tbl_adjustments']
+        row = df[df['id'] == 1].iloc[:1].copy()
+        row['type'] = 'retirement'
+        database.sheets['tbl_adjustments'] = pd.concat([df, row], ignore_index=True)
+        self.assertRaises(ValueError, database.adjustments, 1)
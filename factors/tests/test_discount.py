@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+import numpy as np
+
+from factors.discount import discount_factors, key_rate_derivatives, present_values
+
+
+class TestPresentValues(TestCase):
+
+    def setUp(self):
+        self.cashflows = np.array([[1., 1., 1., 1.],
+                                   [0., 2., 2., 0.],
+                                   [1., 1., 1., 1.]])
+        self.v = 1 / 1.03
+        self.years = np.arange(4)
+
+    def test_discount_factors_forward_fill(self):
+        v = discount_factors([1, 2], 4)
+        np.testing.assert_allclose(v, 1 / (1 + np.array([1, 2, 2, 2]) / 100.))
+
+    def test_timing_conventions(self):
+        pv = present_values(self.cashflows, 3, ['whole', 'mid', 'mixed'],
+                            deferral=[0, 0, 1])
+        self.assertAlmostEqual(pv[0], sum(self.v ** self.years))
+        self.assertAlmostEqual(pv[1], sum(self.cashflows[1] * self.v ** (self.years + 0.5)))
+        exponent = self.years + 0.5 * (self.years <= 1)
+        self.assertAlmostEqual(pv[2], sum(self.v ** exponent))
+
+    def test_rounding(self):
+        pv = present_values(self.cashflows, 3, 'whole', rounding=2)
+        np.testing.assert_array_equal(pv, np.round(pv, 2))
+
+    def test_key_rate_derivatives(self):
+        curve, h = [1., 2., 3.], 1e-4
+        timing, deferral = ['whole', 'mid', 'mixed'], [0, 0, 1]
+        first = key_rate_derivatives(self.cashflows, curve, timing, deferral)
+        second = key_rate_derivatives(self.cashflows, curve, timing, deferral, order=2)
+        base = present_values(self.cashflows, curve, timing, deferral)
+        for k in range(len(curve)):
+            up, down = list(curve), list(curve)
+            up[k] += h * 100
+            down[k] -= h * 100
+            pv_up = present_values(self.cashflows, up, timing, deferral)
+            pv_down = present_values(self.cashflows, down, timing, deferral)
+            np.testing.assert_allclose(first[:, k], (pv_up - pv_down) / (2 * h), rtol=1e-6)
+            np.testing.assert_allclose(second[:, k], (pv_up - 2 * base + pv_down) / h ** 2,
+                                       rtol=1e-3)
@@ -1,7 +1,223 @@
+import os
+import shutil
+import tempfile
 from unittest import TestCase
 
+import numpy as np
+import pandas as pd
+
+from factors.models import LifeTable, LifeTableRegistry
+from factors.tests.test_generation import generation_database
+
 
 class TestFactors(TestCase):
 
     def test_always_true(self):
         self.assertTrue(1, 1)
+
+
+class TestLazyAttributes(TestCase):
+
+    def test_loaded_on_first_use(self):
+        table = LifeTable('AEG2011')
+        self.assertFalse(set(['lx', 'hx', 'adjust', 'ukv', 'testdata']) & set(vars(table)))
+        table.npx(40, 'M', 10)
+        self.assertIn('engine', vars(table))
+        self.assertNotIn('testdata', vars(table))
+        self.assertIs(table.hx, table.hx)
+
+
+class TestLifeTableRegistry(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.registry = LifeTableRegistry()
+
+    def test_tables_are_cached(self):
+        self.assertIs(self.registry['AEG2011'], self.registry['AEG2011'])
+
+    def test_shared_mortality(self):
+        col, zl = self.registry['COL2003'], self.registry['ZL2007']
+        self.assertEqual(col.params['hx'], zl.params['hx'])
+        self.assertIs(col.hx, zl.hx)
+        self.assertIs(col.database, zl.database)
+
+    def test_same_results_as_standalone_table(self):
+        standalone = LifeTable('AEG2011')
+        shared = self.registry['AEG2011']
+        self.assertEqual(standalone.npx(40, 'M', 25), shared.npx(40, 'M', 25))
+
+
+class TestScenarios(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.table = LifeTable('AEG2011')
+
+    def test_scenarios_equal_single_curve_factors(self):
+        curves = np.array([[0.5, 1., 1.5, 2.], [2., 2.5, 3., 3.]])
+        cube = self.table.calculate_scenarios(curves, pension_age=65, chunksize=1)
+        for scenario, curve in enumerate(curves):
+            factors = self.table.calculate_factors(list(curve), pension_age=65)
+            expected = factors['tar'].values.reshape(cube.shape[1:])
+            np.testing.assert_array_equal(cube[scenario], expected)
+
+
+class TestSensitivities(TestCase):
+
+    def test_durations_match_bumped_factors(self):
+        curve, h = [0.5, 1., 1.5], 1e-4
+        table = LifeTable('AEG2011')
+        table.params['round'] = None
+        result = table.calculate_sensitivities(curve, pension_age=67)
+        tar = result['tar'].values
+        np.testing.assert_array_equal(tar, table.calculate_factors(curve, pension_age=67)['tar'])
+        for k in range(len(curve)):
+            up, down = list(curve), list(curve)
+            up[k] += h * 100
+            down[k] -= h * 100
+            pv_up = table.calculate_factors(up, pension_age=67)['tar'].values
+            pv_down = table.calculate_factors(down, pension_age=67)['tar'].values
+            valued = tar != 0
+            np.testing.assert_allclose((-result[('duration', k)] * tar)[valued],
+                                       ((pv_up - pv_down) / (2 * h))[valued], rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose((result[('convexity', k)] * tar)[valued],
+                                       ((pv_up - 2 * tar + pv_down) / h ** 2)[valued],
+                                       rtol=1e-3, atol=1e-3)
+
+    def test_key_rate_per_curve_point(self):
+        curve = [1., 2., 2., 2.]
+        table = LifeTable('AEG2011')
+        result = table.calculate_sensitivities(curve, pension_age=67)
+        self.assertEqual(list(result['duration'].columns), list(range(len(curve))))
+        self.assertEqual(list(result['convexity'].columns), list(range(len(curve))))
+        short = table.calculate_sensitivities(curve[:2], pension_age=67)
+        np.testing.assert_allclose(result['duration'].sum(axis=1), short['duration'].sum(axis=1))
+        np.testing.assert_array_equal(result[('duration', 0)], short[('duration', 0)])
+
+
+class TestPensionAges(TestCase):
+
+    def test_equal_to_single_pension_age(self):
+        table = LifeTable('AEG2011')
+        factors = table.calculate_factors([1., 1.5, 2.], pension_age=[60, 67, 70])
+        self.assertEqual(factors.index.names[0], 'pension_age')
+        for pension_age in (60, 67, 70):
+            expected = LifeTable('AEG2011').calculate_factors([1., 1.5, 2.], pension_age)
+            np.testing.assert_array_equal(factors.loc[pension_age]['tar'].values,
+                                          expected['tar'].values)
+
+    def test_generation_table_equal_to_single_pension_age(self):
+        table = LifeTable('AEG2011IMP', database=generation_database(), baseyear=2020)
+        factors = table.calculate_factors(3, pension_age=[60, 67])
+        for pension_age in (60, 67):
+            expected = LifeTable('AEG2011IMP', database=generation_database(),
+                                 baseyear=2020).calculate_factors(3, pension_age)
+            np.testing.assert_array_equal(factors.loc[pension_age]['tar'].values,
+                                          expected['tar'].values)
+            # grid rows equal the cash flows of a single insured
+            cube = table.interest_free_cashflows(pension_age).resolve(table.lookup_table(3)['cf'].values)
+            for insurance_id in ('OPLL', 'NPLL-B', 'NPLL-O', 'NPLLRS'):
+                for sex, age in (('M', 25), ('F', 40)):
+                    payments = table.cf(insurance_id, age, sex, pension_age, intrest=3)['payments']
+                    np.testing.assert_allclose(cube.payments(insurance_id, sex, age).values,
+                                               payments.values, atol=1e-12)
+
+
+class TestInterestFreeCashflows(TestCase):
+
+    def test_curve_change_only_rediscounts(self):
+        table = LifeTable('AEG2011')
+        table.calculate_factors(3, pension_age=67)
+        with table.instrument() as stats:
+            factors = table.calculate_factors([1., 1.5, 2.], pension_age=67)
+        self.assertNotIn('create_interest_free_cashflows', stats.calls)
+        self.assertEqual(stats.calls['create_lookup_table']['calls'], 1)
+        expected = LifeTable('AEG2011').calculate_factors([1., 1.5, 2.], pension_age=67)
+        np.testing.assert_array_equal(factors['tar'].values, expected['tar'].values)
+
+    def test_deferred_payments(self):
+        table = LifeTable('AEG2011')
+        cube = table.interest_free_cashflows(67)
+        self.assertTrue(cube.interest_free)
+        resolved = cube.resolve(table.lookup_table(3)['cf'].values)
+        expected = table.cf('NPLL-O', 40, 'F', 67, intrest=3)['payments'].values
+        np.testing.assert_array_equal(resolved.payments('NPLL-O', 'F', 40).values, expected)
+
+
+class TestValuePortfolio(TestCase):
+
+    def test_factors_joined_to_policies(self):
+        table = LifeTable('AEG2011')
+        policies = pd.DataFrame({'insurance_id': ['OPLL', 'NPLL-O', 'OPLL', 'OPLL'],
+                                 'sex': ['M', 'F', 'M', 'F'],
+                                 'age': [40, 30, 40, 72],
+                                 'pension_age': [67, 67, 67, 67],
+                                 'benefit': [100., 200., 50., 10.]},
+                                index=['a', 'b', 'c', 'd'])
+        with table.instrument() as stats:
+            values, totals = table.value_portfolio(policies, 3)
+        self.assertEqual(stats.calls['create_interest_free_cashflows']['calls'], 1)
+        self.assertEqual(list(values.index), ['a', 'b', 'c', 'd'])
+        factors = table.calculate_factors(3, pension_age=67)['tar']
+        self.assertEqual(values.ix['a', 'factor'], factors[('OPLL', 'M', 40)])
+        self.assertEqual(values.ix['b', 'factor'], factors[('NPLL-O', 'F', 30)])
+        self.assertEqual(values.ix['d', 'factor'], table.pv(table.cf('OPLL', 72, 'F', 67), 3))
+        np.testing.assert_allclose(values['pv'], values['factor'] * policies['benefit'])
+        self.assertAlmostEqual(totals.ix['total', 'pv'], values['pv'].sum())
+        self.assertAlmostEqual(totals.ix['OPLL', 'benefit'], 160.)
+
+
+class TestLookupCache(TestCase):
+
+    def test_alternating_curves_hit_cache(self):
+        table = LifeTable('AEG2011')
+        lookups = table.database.lookups
+        for intrest in ([1, 2], 3, [1, 2], 3):
+            table.cf('NPLL-O', 40, 'M', 67, intrest=intrest)
+        self.assertEqual((lookups.misses, lookups.hits), (2, 2))
+
+
+class TestBuildingBlockMemo(TestCase):
+
+    def test_defined_partner_at_retirement_is_shared(self):
+        registry = LifeTableRegistry()
+        table = registry['AEG2011']
+        memo = table.engine.memo
+        table.cf('NPLLRS', 40, 'M', 67, intrest=3)
+        hits = memo.hits
+        table.cf('NPLLRS', 41, 'M', 67, intrest=3)
+        self.assertGreater(memo.hits, hits)
+        payments = table.cf_defined_partner(67, 'M', 67)['payments']
+        self.assertFalse(payments.values.flags.writeable)
+
+
+class TestExportStream(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.table = LifeTable('AEG2011')
+        cls.table.calculate_factors(3, pension_age=67)
+        cls.tmpdir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def test_csv(self):
+        directory = os.path.join(self.tmpdir, 'csv')
+        self.table.export_stream(directory, 3, pension_age=67, fmt='csv')
+        factors = pd.read_csv(os.path.join(directory, 'factors.csv'),
+                              index_col=['insurance_id', 'sex_insured', 'age_insured'])
+        expected = self.table.factors['tar']
+        np.testing.assert_allclose(factors['tar'].ix[expected.index].values, expected.values)
+        cashflows = pd.read_csv(os.path.join(directory, 'cashflows.csv'))
+        total = self.table.cfs.values.sum()
+        self.assertAlmostEqual(cashflows['cf'].sum(), total)
+
+    def test_xlsx(self):
+        filename = os.path.join(self.tmpdir, 'factors.xlsx')
+        self.table.export_stream(filename, 3, pension_age=67)
+        sheets = pd.read_excel(filename, sheetname=None)
+        self.assertEqual(len(sheets['factors']), 55)
+        self.assertIn('cashflows', sheets)
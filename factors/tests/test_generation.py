@@ -0,0 +1,132 @@
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from factors.database import Database
+from factors.generation import GenerationTable, CohortCommutation
+from factors.models import LifeTable
+from factors.settings import MALE, FEMALE, MAXAGE, GENERATION_SHEET
+
+
+def static_qx(lx):
+    lx = np.asarray(lx, dtype=float).ravel()
+    survivors = np.append(lx[1:], 0.)
+    return np.where(lx > 0, 1. - survivors / np.where(lx > 0, lx, 1.), 1.)
+
+
+def generation_frame(select, lx, years, improvement=0.):
+    """ Returns generation table sheet with the qx of lx in the first year,
+    decreasing by given fraction every year.
+    """
+    frames = []
+    years = np.asarray(years)
+    scale = (1. - improvement) ** (years - years[0])
+    for sex in (MALE, FEMALE):
+        qx = static_qx(lx[sex])
+        frames.append(pd.DataFrame({'id': select, 'gender': sex,
+                                    'year': np.repeat(years, MAXAGE + 1),
+                                    'age': np.tile(np.arange(MAXAGE + 1), len(years)),
+                                    'qx': np.outer(scale, qx).ravel()}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def generation_database():
+    """ Returns Database with tariffs AEG2011GEN (the qx of AEG2011 in every
+    year) and AEG2011IMP (3% yearly mortality improvement).
+    """
+    database = Database()
+    tariff = database['tbl_tariff']
+    row = tariff[tariff['name'] == 'AEG2011'].copy()
+    row['name'], row['type'], row['lx'] = 'AEG2011GEN', 'multi', 99
+    improving = row.copy()
+    improving['name'], improving['lx'] = 'AEG2011IMP', 98
+    database.sheets['tbl_tariff'] = pd.concat([tariff, row, improving], ignore_index=True)
+    database.sheets[GENERATION_SHEET] = pd.concat([
+        generation_frame(99, database.lx(2), range(1940, 2060)),
+        generation_frame(98, database.lx(2), range(1940, 2120), improvement=0.03)],
+        ignore_index=True)
+    return database
+
+
+class TestGenerationTable(TestCase):
+
+    def setUp(self):
+        years = [2000, 2001, 2002]
+        qx = np.zeros((len(years), MAXAGE + 1))
+        qx[:, :] = np.array([0.01, 0.02, 0.03])[:, np.newaxis]
+        self.table = GenerationTable(qx, years)
+
+    def test_cohort_diagonal(self):
+        qx = self.table.cohort_qx(2000)
+        self.assertEqual(list(qx[:4]), [0.01, 0.02, 0.03, 0.03])
+        self.assertEqual(list(self.table.cohort_qx(1990)[[0, 10, 11]]), [0.01, 0.01, 0.02])
+
+    def test_cohort_lx_is_cached(self):
+        lx = self.table.cohort_lx(2000)
+        np.testing.assert_allclose(lx[:3], [1., 0.99, 0.99 * 0.98])
+        self.assertIs(self.table.cohort_lx(2000), lx)
+        self.assertFalse(lx.flags.writeable)
+
+    def test_engine_uses_cohort_of_age(self):
+        engine = CohortCommutation({MALE: self.table, FEMALE: self.table}, baseyear=2001)
+        # aged 1 in 2001: born 2000, dies with rate of 2001 (0.02), then 2002 (0.03)
+        self.assertAlmostEqual(engine.npx(1, MALE, 2), 0.98 * 0.97)
+        np.testing.assert_allclose(engine.npx([0, 1], MALE, 1), [0.98, 0.98])
+        np.testing.assert_allclose(engine.annuity(1, MALE, defer=1)[:3], [0., 0.98, 0.98 * 0.97])
+
+    def test_engine_keeps_cohort_at_other_ages(self):
+        engine = CohortCommutation({MALE: self.table, FEMALE: self.table}, baseyear=2001)
+        # aged 2 in 2001 (born 1999) dies with rate 0.02, aged 1 in 2001 reaches age 2 in 2002
+        self.assertAlmostEqual(engine.npx(2, MALE, 1), 0.98)
+        self.assertAlmostEqual(engine.npx(2, MALE, 1, cohort=1), 0.97)
+        np.testing.assert_allclose(engine.annuity(2, MALE, cohort=1)[:2], [1., 0.97])
+        np.testing.assert_allclose(engine.annuities([2], MALE, cohort=[1])[0, :2], [1., 0.97])
+
+
+class TestGenerationLifeTable(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.database = generation_database()
+
+    def test_constant_generation_table_equals_static_table(self):
+        expected = LifeTable('AEG2011', database=self.database).calculate_factors(3)
+        table = LifeTable('AEG2011GEN', database=self.database, baseyear=2020)
+        self.assertIsInstance(table.engine, CohortCommutation)
+        factors = table.calculate_factors(3)
+        np.testing.assert_allclose(factors['tar'].values, expected['tar'].values, atol=2e-4)
+
+    def test_baseyears_have_own_engines(self):
+        table1 = LifeTable('AEG2011GEN', database=self.database, baseyear=2020)
+        table2 = LifeTable('AEG2011GEN', database=self.database, baseyear=2030)
+        self.assertIsNot(table1.engine, table2.engine)
+        self.assertNotEqual(table1.table_key(), table2.table_key())
+        self.assertEqual(list(table1.lx[MALE].columns)[-1], 2020 - 15)
+
+    def test_payments_after_pension_age_use_own_cohort(self):
+        table = LifeTable('AEG2011IMP', database=self.database, baseyear=2020)
+        later = LifeTable('AEG2011IMP', database=self.database, baseyear=2047)
+        alpha1 = table.adjustment(MALE, 'partner').CX1
+        # aged 40 in 2020 is aged 67 in 2047: same cohort
+        payments = later.cf_defined_partner(67, MALE, 67)['payments'].values
+        expected = table.npx(40 + alpha1, MALE, 27, cohort=40) * payments
+        parts = table.undefined_partner_parts(40, MALE, 67)
+        np.testing.assert_allclose(parts['after'], expected)
+        # aged 67 in 2020 is an older cohort with higher mortality
+        other = table.cf_defined_partner(67, MALE, 67)['payments'].values
+        self.assertGreater(abs(other.sum() - payments.sum()), 0.1)
+
+    def test_lookup_table_rows_per_cohort(self):
+        table = LifeTable('AEG2011IMP', database=self.database, baseyear=2020)
+        later = LifeTable('AEG2011IMP', database=self.database, baseyear=2030)
+        lookup, lookup_later = table.lookup_table(3), later.lookup_table(3)
+        self.assertEqual(lookup.index.names, ['gender', 'cohort', 'age'])
+        self.assertAlmostEqual(lookup.loc[(FEMALE, 40, 50), 'ay_avg'],
+                               lookup_later.loc[(FEMALE, 50, 50), 'ay_avg'])
+        self.assertNotAlmostEqual(lookup.loc[(FEMALE, 40, 50), 'ay_avg'],
+                                  lookup.loc[(FEMALE, 50, 50), 'ay_avg'], places=3)
+        # payments till pension age take the rows of the insured's cohort
+        parts = table.undefined_partner_parts(40, FEMALE, 67)
+        cf = table.cf('NPLL-O', 40, FEMALE, 67, intrest=3)['payments'].values
+        np.testing.assert_allclose(cf[:27], lookup.loc[FEMALE].loc[40, 'cf'].values[25:52] * parts['nq'])
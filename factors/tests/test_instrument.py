@@ -0,0 +1,42 @@
+import json
+from unittest import TestCase
+
+from factors.database import Database
+from factors.instrument import Stats
+from factors.models import LifeTable
+
+
+class TestInstrument(TestCase):
+
+    def test_disabled_by_default(self):
+        table = LifeTable('AEG2011')
+        self.assertIsNone(table.stats)
+        with table.instrument():
+            pass
+        self.assertIsNone(table.stats)
+        self.assertIsNone(table.database.stats)
+
+    def test_records_calls_and_caches(self):
+        table = LifeTable('AEG2011')
+        with table.instrument() as stats:
+            table.calculate_factors(3, pension_age=67)
+            table.calculate_factors(2, pension_age=67)
+        calls = stats.to_dict()['calls']
+        self.assertEqual(calls['calculate_factors']['calls'], 2)
+        self.assertEqual(calls['retirement_pension_rows']['calls'], 2)
+        self.assertEqual(calls['create_lookup_table']['calls'], 2)
+        caches = stats.cache_stats()
+        self.assertEqual(caches['lookup_tables']['misses'], 2)
+        self.assertGreater(caches['building_blocks']['hit_ratio'], 0)
+        self.assertEqual(json.loads(stats.to_json())['calls']['pv[cube]']['calls'], 2)
+
+    def test_records_memory(self):
+        table = LifeTable('AEG2011')
+        with table.instrument(memory=True) as stats:
+            table.cf_annuity(40, 'M', 27)
+        self.assertGreaterEqual(stats.calls['cf_annuity']['allocated'], 0)
+
+    def test_workbook_reads(self):
+        stats = Stats()
+        Database(cache=False, stats=stats)
+        self.assertEqual(stats.calls['read_workbook']['calls'], 1)
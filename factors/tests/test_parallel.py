@@ -0,0 +1,18 @@
+from unittest import TestCase
+
+import numpy as np
+
+from factors.models import LifeTable
+from factors.parallel import generate_factor_sets
+
+
+class TestGenerateFactorSets(TestCase):
+
+    def test_pool_matches_single_table(self):
+        curves = [3, [1., 1.5, 2.]]
+        factors = generate_factor_sets(['AEG2011', 'ZL2011'], [65, 67], curves, workers=2)
+        self.assertEqual(len(factors), 2 * 2 * 2 * 770)
+        expected = LifeTable('ZL2011').calculate_factors([1., 1.5, 2.], pension_age=65)
+        result = factors.xs(('ZL2011', 65, 1), level=['tariff', 'pension_age', 'scenario'])
+        np.testing.assert_array_equal(result['tar'].values, expected['tar'].values)
+        self.assertTrue((result.index == expected.index).all())
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import pandas as pd
+
+from factors.models import LifeTable
+from factors.results import ResultCache
+
+
+class TestResultCache(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.results = ResultCache(os.path.join(self.tmpdir, 'results'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip_and_evict(self):
+        frame = pd.DataFrame({'tar': [1., 2.]})
+        self.assertIsNone(self.results.get('a'))
+        self.results.put('a', frame, checksum='x')
+        pd.util.testing.assert_frame_equal(self.results.get('a'), frame)
+        self.results.put('b', frame, checksum='y')
+        self.results.invalidate('y')
+        self.assertEqual(self.results.keys(), ['b'])
+        self.results.evict(0)
+        self.assertEqual(self.results.keys(), [])
+
+    def test_corrupt_entry_is_a_miss(self):
+        with open(self.results.path('a'), 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertIsNone(self.results.get('a'))
+
+    def test_factors_are_cached(self):
+        table = LifeTable('AEG2011', results=self.results)
+        expected = table.calculate_factors(3, pension_age=67)
+        other = LifeTable('AEG2011', results=self.results)
+        with other.instrument() as stats:
+            factors = other.calculate_factors(3, pension_age=67)
+        self.assertNotIn('calculate_cashflows', stats.calls)
+        pd.util.testing.assert_frame_equal(factors, expected)
+        other.calculate_factors(3, pension_age=65)
+        self.assertEqual(len(self.results.keys()), 2)
+        with other.instrument() as stats:
+            other.calculate_factors(3, pension_age=67, cache=False)
+        self.assertIn('calculate_cashflows', stats.calls)
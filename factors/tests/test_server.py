@@ -0,0 +1,77 @@
+import json
+import threading
+from unittest import TestCase
+
+try:
+    from urllib2 import urlopen, Request
+except ImportError:
+    from urllib.request import urlopen, Request
+
+from factors.models import LifeTable
+from factors.server import Batcher, FactorServer, FactorService
+
+
+class TestFactorService(TestCase):
+
+    def test_quotes_equal_factors(self):
+        service = FactorService(['AEG2011'], {'flat': 3})
+        keys = [('AEG2011', 'OPLL', 'M', 40, 67, 'flat'),
+                ('AEG2011', 'NPLL-O', 'F', 30, 67, 'flat'),
+                ('AEG2011', 'OPLL', 'F', 72, 67, 'flat')]
+        factors = service.quote(keys)
+        table = LifeTable('AEG2011')
+        expected = table.calculate_factors(3, pension_age=67)['tar']
+        self.assertEqual(factors[0], expected[('OPLL', 'M', 40)])
+        self.assertEqual(factors[1], expected[('NPLL-O', 'F', 30)])
+        self.assertEqual(factors[2], table.pv(table.cf('OPLL', 72, 'F', 67), 3))
+        self.assertRaises(ValueError, service.key, {'tariff': 'AEG2011'})
+
+
+class TestBatcher(TestCase):
+
+    def test_failing_request_does_not_fail_batch(self):
+        def func(keys):
+            if 'bad' in keys:
+                raise ValueError('bad key')
+            return [key.upper() for key in keys]
+        batcher = Batcher(func)
+        try:
+            self.assertEqual(batcher.submit(['a', 'b']), ['A', 'B'])
+            self.assertRaises(ValueError, batcher.submit, ['bad'])
+            self.assertEqual(batcher.call(lambda: 1), 1)
+        finally:
+            batcher.close()
+
+
+class TestFactorServer(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FactorServer(FactorService(['AEG2011'], {'flat': 3}, [67]), port=0)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:{0}'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def post(self, path, content):
+        request = Request(self.url + path, json.dumps(content).encode('utf-8'),
+                          {'Content-Type': 'application/json'})
+        return json.loads(urlopen(request).read().decode('utf-8'))
+
+    def test_quote_and_metrics(self):
+        quote = {'tariff': 'AEG2011', 'insurance_id': 'OPLL', 'sex': 'M',
+                 'age': 40, 'pension_age': 67, 'curve': 'flat'}
+        single = self.post('/quote', quote)['factor']
+        many = self.post('/quote', [quote, dict(quote, age=41)])['factors']
+        self.assertEqual(many[0], single)
+        query = '&'.join('{0}={1}'.format(name, value) for name, value in quote.items())
+        response = urlopen('{0}/quote?{1}'.format(self.url, query)).read()
+        self.assertEqual(json.loads(response.decode('utf-8'))['factor'], single)
+        metrics = json.loads(urlopen(self.url + '/metrics').read().decode('utf-8'))
+        self.assertGreaterEqual(metrics['quotes'], 4)
+        self.assertIsNotNone(metrics['latency_p50_ms'])
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from factors.cube import CashflowCube
+from factors.models import LifeTable
+from factors.store import CubeStore
+
+
+class TestCubeStore(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = CubeStore(os.path.join(self.tmpdir, 'cubes'))
+        self.cube = CashflowCube(np.arange(24.).reshape(2, 1, 3, 4), ['OPLL', 'NPLL-O'],
+                                 ['M'], [65, 66, 67], 67)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip_is_memory_mapped(self):
+        self.store.put('a', self.cube, checksum='x')
+        cube = self.store.get('a')
+        self.assertIsInstance(cube.values.base, np.memmap)
+        np.testing.assert_array_equal(cube.values, self.cube.values)
+        self.assertEqual(cube.ages, [65, 66, 67])
+        self.assertIsNone(self.store.get('b'))
+
+    def test_invalidate(self):
+        self.store.put('a', self.cube, checksum='x')
+        self.store.put('b', self.cube, checksum='y')
+        self.store.invalidate(checksum='y')
+        self.assertEqual(self.store.keys(), ['b'])
+        self.store.invalidate()
+        self.assertEqual(self.store.keys(), [])
+
+    def test_evict_least_recently_used(self):
+        for key, mtime in zip('abc', (1, 3, 2)):
+            self.store.put(key, self.cube)
+            os.utime(self.store.path(key), (mtime, mtime))
+        self.store.evict(2 * self.store.entry_size('a'))
+        self.assertEqual(sorted(self.store.keys()), ['b', 'c'])
+
+    def test_lifetable_maps_stored_cube(self):
+        factors = LifeTable('AEG2011', store=self.store).calculate_factors(3, pension_age=67)
+        self.assertEqual(len(self.store.keys()), 1)
+        table = LifeTable('AEG2011', store=self.store)
+        with table.instrument() as stats:
+            result = table.calculate_factors(3, pension_age=67)
+        self.assertNotIn('cf[OPLL]', stats.calls)
+        self.assertIsInstance(table.interest_free_cashflows(67).values.base, np.memmap)
+        np.testing.assert_array_equal(result['tar'].values, factors['tar'].values)
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+
+import numpy as np
+import pandas as pd
+
+from factors.models import LifeTable
+from factors.streaming import value_file, chunksize_for, read_chunks, pq
+
+
+class TestValueFile(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tmpdir, 'policies.csv')
+        self.outfile = os.path.join(self.tmpdir, 'values.csv')
+        n = 250
+        self.policies = pd.DataFrame({'insurance_id': np.tile(['OPLL', 'NPLL-O', 'NPTL-B'], n)[:n],
+                                      'sex': np.tile(['M', 'F'], n)[:n],
+                                      'age': 20 + np.arange(n) % 50,
+                                      'pension_age': 67,
+                                      'benefit': np.arange(n, dtype=float)},
+                                     columns=['insurance_id', 'sex', 'age', 'pension_age',
+                                              'benefit'])
+        self.policies.to_csv(self.infile, index=False)
+        self.table = LifeTable('AEG2011')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_chunks_equal_whole_file(self):
+        seen = []
+        totals, counters = value_file(self.table, self.infile, self.outfile, 3, chunksize=60,
+                                      progress=lambda c: seen.append(c.rows))
+        self.assertEqual(seen, [60, 120, 180, 240, 250])
+        self.assertEqual(counters.chunks, 5)
+        self.assertEqual(counters.keys + counters.hits, 5 * 60 - 50)
+        self.assertEqual(counters.keys, 150)
+        values, expected = self.table.value_portfolio(self.policies, 3)
+        out = pd.read_csv(self.outfile)
+        np.testing.assert_allclose(out['pv'], values['pv'])
+        np.testing.assert_allclose(totals['pv'], expected['pv'].values)
+
+    @skipIf(pq is None, "requires pyarrow")
+    def test_parquet_chunks(self):
+        infile = os.path.join(self.tmpdir, 'policies.parquet')
+        outfile = os.path.join(self.tmpdir, 'values.parquet')
+        self.policies.to_parquet(infile, engine='pyarrow', index=False, row_group_size=1000)
+        chunks = list(read_chunks(infile, 60))
+        self.assertEqual([len(chunk) for chunk in chunks], [60, 60, 60, 60, 10])
+        self.assertEqual(list(chunks[-1].index), list(range(240, 250)))
+        totals, counters = value_file(self.table, infile, outfile, 3, chunksize=60)
+        self.assertEqual(counters.chunks, 5)
+        values, expected = self.table.value_portfolio(self.policies, 3)
+        np.testing.assert_allclose(pd.read_parquet(outfile)['pv'], values['pv'])
+        np.testing.assert_allclose(totals['pv'], expected['pv'].values)
+
+    def test_chunksize_for_memory(self):
+        small = chunksize_for(self.infile, 1 << 16)
+        self.assertGreater(chunksize_for(self.infile, 1 << 20), small)
+        self.assertGreaterEqual(small, 1)
@@ -1,3 +1,4 @@
+import functools
 import itertools
 import numpy as np
 import pandas as pd
@@ -12,17 +13,21 @@ def merge_two_dicts(x, y):
     return z
 
 
-def dictify(frame):
-    """ Converts multi-indexed dataframe to nested dict.
-    http://stackoverflow.com/questions/19798112/convert-pandas-dataframe-to-a-nested-dict
+class lazy_property(object):
+    """ Decorates method without arguments into an attribute computed on
+    first access. The result is stored on the instance, so later lookups
+    do not call the method again; deleting the attribute resets it.
     """
-    if len(frame.columns) == 1:
-        if frame.values.size == 1:
-            return frame.values[0][0]
-        return frame.values.squeeze()
-    grouped = frame.groupby(frame.columns[0])
-    d = {k: dictify(g.ix[:, 1:]) for k, g in grouped}
-    return d
+
+    def __init__(self, func):
+        self.func = func
+        functools.update_wrapper(self, func)
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.func.__name__] = self.func(obj)
+        return value
 
 
 def to_excel(frame, xlswb='output.xlsx'):
@@ -44,32 +49,29 @@ def prae_to_continuous(cfs):
 
     Parameters
     ----------
-    cfs: Series with cashflows.
+    cfs: Series or array with cashflows.
     """
 
-    first_cf_index = cfs[cfs > 0].index[0]
+    first_cf_index = np.flatnonzero(np.asarray(cfs) > 0)[0]
     cf_postnumerando = cfs.copy()
     cf_postnumerando[first_cf_index] = 0
     cf_average = (cfs + cf_postnumerando) / 2.
     return cf_average
 
 
-def expand(df, column_to_expand):
-    """ Returns df with 1 column having multiple values
-    expanded to single value cells.
+def prae_to_continuous_rows(cfs):
+    """ Converts preanumerando to continuous cashflows for each row of a
+    matrix, see prae_to_continuous.
 
-    Parameters:
+    Parameters
     ----------
-    df: DataFrame
-    column_to_expand: str
+    cfs: 2-D array with one cash flow per row.
     """
-    colnames = list(df.columns)
-    colnames.remove(column_to_expand)
-    df.set_index(colnames, inplace=True)
-    expanded = df.apply(lambda row: row[column_to_expand], axis=1).stack()
-    expanded = expanded.reset_index()
-    expanded.columns = colnames + ['year'] + [column_to_expand]
-    return expanded
+    first_cf_index = np.argmax(cfs > 0, axis=1)
+    cf_postnumerando = cfs.copy()
+    cf_postnumerando[np.arange(len(cfs)), first_cf_index] = 0
+    cf_average = (cfs + cf_postnumerando) / 2.
+    return cf_average
 
 
 def cartesian(lists, colnames):
@@ -86,22 +88,25 @@ def cartesian(lists, colnames):
     return df
 
 
-def x_to_series(x, n):
-    """ Converts int, float or list to Series of length n.
+def to_payments(values):
+    """ Returns Series with payments indexed by year.
 
     Parameters:
     -----------
-    x: int, float, list or Series
-    length: required length of returned Series
+    values: array with payments
     """
+    return pd.Series(values, index=pd.Index(np.arange(len(values)), name='year'))
+
+
+def to_matrix(rows):
+    """ Returns 2-D array with given rows, padded with zeros to equal length.
 
-    if isinstance(x, (int, float)):
-        s = pd.Series(n * [x])
-    elif isinstance(x, (list, pd.Series)):
-        x = list(x.values) if isinstance(x, pd.Series) else x
-        s = pd.Series(x + np.maximum(0, n - len(x)) * [None])
-        s.fillna(method='ffill', inplace=True)
-        s = s[:n]
-    else:
-        print("Error!")
-    return s
+    Parameters:
+    -----------
+    rows: list of arrays or Series
+    """
+    ncols = max(len(row) for row in rows) if len(rows) else 0
+    out = np.zeros((len(rows), ncols))
+    for i, row in enumerate(rows):
+        out[i, :len(row)] = row
+    return out
@@ -0,0 +1,96 @@
+import csv
+import os
+
+import numpy as np
+
+from openpyxl import Workbook
+
+
+def frame_rows(frame):
+    """ Yields header and rows (index included) of given DataFrame.
+
+    Parameters:
+    -----------
+    frame: DataFrame
+    """
+    frame = frame.reset_index()
+    yield [' '.join(str(item) for item in column if item != '')
+           if isinstance(column, tuple) else column for column in frame.columns]
+    for row in frame.itertuples(index=False):
+        yield list(row)
+
+
+def long_rows(labels, cashflows, lengths, colnames):
+    """ Yields header and rows (labels..., year, cf) of a cash flow matrix.
+
+    Parameters:
+    -----------
+    labels: list of tuples, one per row of cashflows
+    cashflows: 2-D array (rows x years)
+    lengths: number of years to write per row
+    colnames: list of str, names of the label columns
+    """
+    yield list(colnames) + ['year', 'cf']
+    for label, payments, length in zip(labels, cashflows, lengths):
+        for year, value in enumerate(payments[:length].tolist()):
+            yield list(label) + [year, value]
+
+
+def wide_rows(cube, ages, columns):
+    """ Yields header and rows (age_insured, year, one column per (sex, insurance_id)).
+
+    Parameters:
+    -----------
+    cube: 4-D array (insurance_id x sex x age x year)
+    ages: list of int
+    columns: list of (sex, insurance_id) tuples, in the order of cube's
+    first two axes flattened sex-major
+    """
+    yield ['age_insured', 'year'] + ['{0} {1}'.format(sex, insurance_id)
+                                     for sex, insurance_id in columns]
+    by_sex = np.swapaxes(cube, 0, 1)
+    nsex, nids = by_sex.shape[:2]
+    for i, age in enumerate(ages):
+        block = by_sex[:, :, i, :].reshape(nsex * nids, -1)
+        for year in range(block.shape[1]):
+            yield [age, year] + block[:, year].tolist()
+
+
+def _encode(value):
+    """ Returns utf-8 encoded value for text, value itself otherwise. """
+    if isinstance(value, type(u'')) and not isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+def write_xlsx(filename, sheets):
+    """ Writes sheets row by row to a write-only Excel workbook.
+
+    Parameters:
+    -----------
+    filename: str
+    sheets: OrderedDict {sheetname: iterable of rows}
+    """
+    workbook = Workbook(write_only=True)
+    for sheetname, rows in sheets.items():
+        worksheet = workbook.create_sheet(title=sheetname)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(filename)
+
+
+def write_csv(directory, sheets):
+    """ Writes sheets row by row to one csv file per sheet in given directory.
+
+    Parameters:
+    -----------
+    directory: str
+    sheets: OrderedDict {sheetname: iterable of rows}
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for sheetname, rows in sheets.items():
+        with open(os.path.join(directory, sheetname + '.csv'), 'wb') as f:
+            writer = csv.writer(f)
+            for row in rows:
+                writer.writerow([_encode(value) for value in row])